@@ -1,14 +1,22 @@
-from halinuxcompanion.api import API, Server
-from halinuxcompanion.dbus import Dbus
-from halinuxcompanion.notifier import Notifier
-from halinuxcompanion.companion import Companion
-from halinuxcompanion.sensor import Sensor, SensorManager
-from halinuxcompanion.sensors import *
+from halinuxcompanion.startup import StartupReport
 
+from contextlib import nullcontext
+from importlib import import_module
+from typing import List, Optional, TYPE_CHECKING
 import asyncio
 import json
 import logging
 import argparse
+import signal
+import sys
+
+# The modules are imported when they are needed, the notifier and the sensors that are disabled are never imported.
+if TYPE_CHECKING:
+    from halinuxcompanion.companion import Companion
+    from halinuxcompanion.notifier import Notifier
+    from halinuxcompanion.sampler import SamplerProcess
+    from halinuxcompanion.sensor import Sensor, SensorManager
+
 # set logging level using and environment variable
 logger = logging.getLogger("halinuxcompanion")
 
@@ -23,6 +31,78 @@ def load_config(file="config.json") -> dict:
         exit(1)
 
 
+def create_sensors(
+    companion: "Companion", names: List[str], report: Optional[StartupReport] = None
+) -> List["Sensor"]:
+    """Create the sensors of the given config names with their options, importing their modules (timed in the report)"""
+    from halinuxcompanion.sensor import Sensor
+
+    sensors = []
+    for name in names:
+        with report.step(f"Import sensor {name}") if report is not None else nullcontext():
+            import_module(f"halinuxcompanion.sensors.{name}")
+        sensors.extend(Sensor.types[name].create(companion.sensor_options[name]))
+    return sensors
+
+
+async def reload(
+    file: str,
+    loglevel: str,
+    companion: "Companion",
+    sensor_manager: "SensorManager",
+    notifier: Optional["Notifier"],
+    sampler: Optional["SamplerProcess"] = None,
+) -> None:
+    """Reload the configuration file and apply what changed to the running companion.
+    Sensors that were enabled, disabled or had their options changed are started/stopped individually, the rest keep
+    running and nothing is registered again. Settings that are part of the device registration or the notification
+    server can't be applied, a restart is needed for those, as well as changes to the sensors of the sampler process.
+    """
+    from halinuxcompanion.companion import Companion
+
+    logger.info("Reloading configuration file %s", file)
+    try:
+        with open(file, "r") as f:
+            config = json.load(f)
+        new = Companion(config)
+        # Command line loglevel takes precedence
+        if loglevel == "":
+            logger.setLevel(config.get("loglevel", logging.NOTSET))
+    except (OSError, ValueError) as e:
+        logger.error("Configuration reload failed, keeping the running configuration: %s", e)
+        return
+
+    for key in companion.restart_required(new):
+        logger.warning("Setting %s changed, it will be applied on the next restart", key)
+
+    running = [name for name, enabled in companion.sensors.items() if enabled]
+    stopped = [
+        name for name in running
+        if not new.sensors.get(name) or new.sensor_options[name] != companion.sensor_options[name]
+    ]
+    started = [name for name, enabled in new.sensors.items() if enabled and (name not in running or name in stopped)]
+    if sampler is not None:
+        for name in sorted(set(stopped + started) & set(sampler.names)):
+            logger.warning("Sensor %s is sampled by the sampler process, it will be applied on the next restart", name)
+        stopped = [name for name in stopped if name not in sampler.names]
+        started = [name for name in started if name not in sampler.names]
+    await sensor_manager.stop_sensors(stopped)
+    sensor_manager.adopt(create_sensors(new, started))
+    sensor_manager.set_policies(new.sensor_policies)
+    companion.sensors = new.sensors
+    companion.sensor_options = new.sensor_options
+    companion.sensor_policies = new.sensor_policies
+    companion.refresh_interval = new.refresh_interval
+    companion.polling = new.polling
+
+    if notifier is not None and new.notifier:
+        companion.url_program = notifier.url_program = new.url_program
+        companion.commands = notifier.commands = new.commands
+        companion.trace_file = notifier.tracer.path = new.trace_file
+
+    logger.info("Configuration reloaded, sensors stopped:%s started:%s", stopped, started)
+
+
 def commandline() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Home Assistan Linux Companion")
     parser.add_argument(
@@ -37,6 +117,18 @@ def commandline() -> argparse.Namespace:
         help="Log level",
         default="",
     )
+    parser.add_argument(
+        "--record",
+        help="Append the sensor samples, signals, notifications and Home Assistant responses to a file, to be replayed "
+        "with python -m halinuxcompanion.replay",
+        default="",
+    )
+    parser.add_argument(
+        "--startup-report",
+        help="Print the time taken by each startup step and the modules it imported, then exit before registering "
+        "with Home Assistant",
+        action="store_true",
+    )
     args = parser.parse_args()
     return args
 
@@ -51,7 +143,10 @@ async def main():
         - Actions are triggered in dbus listened by the application. Some are handled locally others are handled by Home
           Assistant, events are relayed to it as expected (closed and action).
     """
+    report = StartupReport()
     args = commandline()
+    if args.startup_report:
+        report.time_imports()
     logging.basicConfig(level="INFO")
     config = load_config(args.config)
 
@@ -61,44 +156,122 @@ async def main():
     elif "loglevel" in config:
         logger.setLevel(config["loglevel"])
 
-    companion = Companion(config)  # Companion objet where configuration is stored
+    with report.step("Load configuration"):
+        from halinuxcompanion.companion import Companion
+
+        try:
+            companion = Companion(config)  # Companion objet where configuration is stored
+        except ValueError as e:
+            logger.critical("Invalid configuration, exiting now: %s", e)
+            exit(1)
+
+    with report.step("Import api, dbus and sensor manager"):
+        from halinuxcompanion.api import API
+        from halinuxcompanion.dbus import Dbus
+        from halinuxcompanion.sensor import SensorManager
+        from halinuxcompanion.scheduler import Scheduler
+        from halinuxcompanion.recorder import RECORDER
+
+    if args.record:
+        RECORDER.start_recording(args.record)
+
     api = API(companion)  # API client to send data to Home Assistant
-    server = Server(companion)  # HTTP server that handles notifications
     # Initialize dbus connections
-    bus = Dbus()
-    await bus.init()
-    # Register sensors
-    sensors = list(filter(lambda x: x.config_name in companion.sensors, Sensor.instances))
-    sensor_manager = SensorManager(api, sensors, bus)
+    with report.step("Connect to dbus"):
+        bus = Dbus()
+        await bus.init()
+    # Register sensors, the ones that support it are sampled in a worker process when sampler_process is enabled
+    names = [name for name, enabled in companion.sensors.items() if enabled]
+    sampler = None
+    sampled: List["Sensor"] = []
+    if companion.sampler_process:
+        with report.step("Start sampler process"):
+            from halinuxcompanion.sampler import SamplerProcess, isolated
+
+            moved = isolated(names)
+            if moved:
+                sampler = SamplerProcess(companion, moved)
+                try:
+                    sampled = await sampler.start()
+                    names = [name for name in names if name not in moved]
+                except TimeoutError as e:
+                    logger.error("%s, sampling every sensor in this process", e)
+                    sampler = None
+    sensors = create_sensors(companion, names, report) + sampled
+    sensor_manager = SensorManager(api, sensors, bus, companion.sensor_policies)
+
+    if companion.notifier:
+        with report.step("Import notifier"):
+            from halinuxcompanion.api import Server
+            from halinuxcompanion.notifier import Notifier
+            from halinuxcompanion.push_channel import PushChannel
+
+    if args.startup_report:
+        # Only the local initialization is measured, nothing is registered with Home Assistant
+        print(report.format(), file=sys.stderr)
+        await api.session.close()
+        if sampler is not None:
+            sampler.stop()
+        return
 
     # If the device can't be registered exit immidiately, nothing to do.
-    ok, reg_data = await companion.load_or_register(api)
+    with report.step("Register device"):
+        ok, reg_data = await companion.load_or_register(api)
     if not ok:
         logger.critical("Device registration failed, exiting now")
         exit(1)
 
     api.process_registration_data(reg_data)
+    # Measure the cloudhook and remote ui endpoints in the background, to fail over when the local one goes away
+    api.start_prober()
 
     # If sensors can't be registered exit immidiately, nothing to do.
-    if not await sensor_manager.register_sensors():
+    with report.step("Register sensors"):
+        ok = await sensor_manager.register_sensors()
+    if not ok:
         logger.critical("Sensor registration failed, exiting now")
         exit(1)
 
     # Initialize the notifier which implies the webserver and the dbus interface
+    notifier = None
     if companion.notifier:
         # TODO: Session bus is initialized already.
         # DBus session client to send desktop notifications and listen to signals
-        # Notifier behavior: HA -> Webserver -> dbus ... dbus -> event_handler -> HA
-        notifier = Notifier()
-        await notifier.init(bus, api, server, companion)
-        await server.start()
+        # Notifier behavior: HA -> Webserver or websocket -> dbus ... dbus -> event_handler -> HA
+        with report.step("Start notifier"):
+            notifier = Notifier()
+            if companion.push_websocket:
+                await notifier.init(bus, api, None, companion)
+                push_channel = PushChannel(api, notifier.handle_notification)
+                push_channel.start()
+            else:
+                server = Server(companion)  # HTTP server that handles notifications
+                await notifier.init(bus, api, server, companion)
+                await server.start()
+
+    # Reload the configuration on SIGHUP, a reference to the task is kept so it's not garbage collected
+    reloading: Optional[asyncio.Task] = None
+
+    def on_sighup() -> None:
+        nonlocal reloading
+        if reloading is not None and not reloading.done():
+            logger.warning("Configuration reload already in progress")
+            return
+        reloading = asyncio.create_task(
+            reload(args.config, args.loglevel, companion, sensor_manager, notifier, sampler)
+        )
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+    # Write the last payloads, responses and signals on SIGUSR1
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, RECORDER.dump)
 
-    interval = companion.refresh_interval
-    # Loop forever updating sensors.
-    while True:
-        await sensor_manager.update_sensors()
-        await asyncio.sleep(interval)
+    # Loop forever updating sensors, paused while the machine sleeps.
+    scheduler = Scheduler(companion, api, sensor_manager)
+    scheduler.sampler = sampler
+    await scheduler.init(bus)
+    await scheduler.run()
 
 
-loop = asyncio.new_event_loop()
-loop.run_until_complete(main())
+if __name__ == "__main__":
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main())
@@ -1,8 +1,14 @@
 from .companion import Companion
+from .recorder import RECORDER
 
 import logging
-from aiohttp import (web, ClientSession, ClientResponse)
-from typing import Optional
+from aiohttp import ClientError, ClientSession, ClientResponse, ClientTimeout
+import asyncio
+import time
+from typing import List, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aiohttp import web
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +16,47 @@ SC_INVALID_JSON = 400
 SC_MOBILE_COMPONENT_NOT_LOADED = 404
 SC_INTEGRATION_DELETED = 410
 SESSION: Optional[ClientSession] = None
+# Seconds a webhook request can take, the default of the session is several minutes
+WEBHOOK_TIMEOUT = 10
+# Seconds between probes of the webhook endpoints that aren't carrying traffic
+ENDPOINT_PROBE_INTERVAL = 60
+# Weight of the last request in the latency moving average of an endpoint
+LATENCY_WEIGHT = 0.3
+# Minimum seconds left of the request timeout to fail over to another endpoint within the same request
+FAILOVER_MIN_TIME = 1
+GET_CONFIG = '{"type": "get_config"}'
+
+
+class Endpoint:
+    """A webhook url (local, cloudhook or remote_ui), with its health and latency"""
+
+    def __init__(self, name: str, url: str) -> None:
+        self.name = name
+        self.url = url
+        self.healthy = True
+        self.latency: Optional[float] = None  # Moving average in seconds, None until the first request
+        self.checked = 0.0  # Monotonic time of the last request
+
+    def succeeded(self, elapsed: float) -> None:
+        if not self.healthy:
+            logger.info('Webhook endpoint %s is back', self.name)
+        self.healthy = True
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += LATENCY_WEIGHT * (elapsed - self.latency)
+
+    def failed(self, error: Union[Exception, str]) -> None:
+        if self.healthy:
+            logger.warning('Webhook endpoint %s failed: %s', self.name, str(error) or "timeout")
+        self.healthy = False
+
+
+def unhealthy(status: int) -> bool:
+    """Responses of an endpoint that can't deliver to Home Assistant (e.g. a cloudhook while the instance isn't
+    connected), or of a Home Assistant without the mobile_app integration
+    """
+    return status >= 500 or status in (SC_MOBILE_COMPONENT_NOT_LOADED, SC_INTEGRATION_DELETED)
 
 
 class API:
@@ -24,6 +71,7 @@ class API:
     secret: str
     webhook_id: str
     webhook_url: str
+    endpoints: List[Endpoint]
     counter: int = 0
     session: ClientSession
 
@@ -36,29 +84,97 @@ class API:
         self.headers = {'Authorization': 'Bearer ' + self.token}
         self.instance_url = companion.ha_url
         self.register_payload = companion.registration_payload()
+        self.endpoints = []
+        self.probing: Optional[asyncio.Task] = None
+
+    def endpoint(self, exclude: List[Endpoint] = []) -> Endpoint:
+        """The fastest healthy webhook endpoint, endpoints without a measure yet are used in order (local first)"""
+        candidates = [e for e in self.endpoints if e not in exclude]
+        return min(candidates, key=lambda e: (not e.healthy, e.latency is None, e.latency or 0))
 
-    async def webhook_post(self, type: str, data: str) -> ClientResponse:
+    async def webhook_post(self, type: str, data: str, timeout: float = WEBHOOK_TIMEOUT) -> ClientResponse:
         """Send a POST request to the webhook endpoint with the given type and data
-        Simple wrapper that handles and logs response status, should be wrapped to handle clinet errors.
+        Simple wrapper that handles and logs response status, should be wrapped to handle clinet errors and timeouts.
+        The request goes to the fastest healthy endpoint, if it fails (or answers with an error status, see unhealthy)
+        and there's time left it's sent to the next one, so an endpoint that went away (e.g. the local one when leaving
+        the LAN) costs at most one request timeout. The last response is returned when every endpoint answered an error.
+
         :param type: Whats being posted, ussed for logging
         :param data: The data to send in the body of the request (json serialized)
+        :param timeout: Seconds to wait for the whole request, asyncio.TimeoutError is raised after them
         """
 
         self.counter += 1
-        logger.debug('Sending webhook POST %s type:%s ', self.counter, type)
+        deadline = time.monotonic() + timeout
+        tried = []
+        while True:
+            endpoint = self.endpoint(tried)
+            try:
+                res = await self._webhook_post(endpoint, type, data, deadline - time.monotonic())
+                tried.append(endpoint)
+                if (
+                    endpoint.healthy
+                    or len(tried) == len(self.endpoints)
+                    or deadline - time.monotonic() < FAILOVER_MIN_TIME
+                ):
+                    return res
+            except (ClientError, asyncio.TimeoutError) as e:
+                endpoint.failed(e)
+                tried.append(endpoint)
+                if len(tried) == len(self.endpoints) or deadline - time.monotonic() < FAILOVER_MIN_TIME:
+                    raise
+            logger.info('Webhook POST %s failed on %s, trying the next endpoint', self.counter, endpoint.name)
+
+    async def _webhook_post(self, endpoint: Endpoint, type: str, data: str, timeout: float) -> ClientResponse:
+        start = endpoint.checked = time.monotonic()
+        async with self.session.post(endpoint.url, data=data, timeout=ClientTimeout(total=timeout)) as res:
+            elapsed = time.monotonic() - start
+            # Only the latency of the requests that reached Home Assistant is measured
+            if unhealthy(res.status):
+                endpoint.failed(f"status {res.status}")
+            else:
+                endpoint.succeeded(elapsed)
+            RECORDER.record("webhook", self.counter, type, endpoint.name, res.status, elapsed)
+
+            if res.status == SC_INVALID_JSON:
+                logger.error('Invalid JSON %s', endpoint.url)
+            if res.status == SC_MOBILE_COMPONENT_NOT_LOADED:
+                logger.error('The mobile_app component has not ben loaded %s', endpoint.url)
+            elif res.status == SC_INTEGRATION_DELETED:
+                logger.error('The integration has been deleted, need to register again %s', endpoint.url)
 
-        async with self.session.post(self.webhook_url, data=data) as res:
-            logger.debug('Recived response %s to request %s', res.status, self.counter)
+            return res
 
-            if logger.level == logging.DEBUG:
-                if res.status == SC_INVALID_JSON:
-                    logger.error('Invalid JSON %s', self.webhook_url)
-                if res.status == SC_MOBILE_COMPONENT_NOT_LOADED:
-                    logger.error('The mobile_app component has not ben loaded %s', self.webhook_url)
-                elif res.status == SC_INTEGRATION_DELETED:
-                    logger.error('The integration has been deleted, need to register again %s', self.webhook_url)
+    async def probe_endpoints(self, timeout: float = WEBHOOK_TIMEOUT, idle: float = 0) -> bool:
+        """Measure the webhook endpoints with a get_config request, all at the same time
 
-            return res
+        :param timeout: Seconds to wait for each endpoint
+        :param idle: Only probe the endpoints without requests in the last seconds
+        :return: True if any endpoint answered
+        """
+        async def probe(endpoint: Endpoint) -> bool:
+            try:
+                await self._webhook_post(endpoint, "probe", GET_CONFIG, timeout)
+                return endpoint.healthy
+            except (ClientError, asyncio.TimeoutError) as e:
+                endpoint.failed(e)
+                return False
+
+        now = time.monotonic()
+        probed = [e for e in self.endpoints if now - e.checked >= idle]
+        return any(await asyncio.gather(*[probe(e) for e in probed]))
+
+    def start_prober(self) -> None:
+        """Start probing the endpoints in the background, if there's more than one"""
+        if len(self.endpoints) > 1 and self.probing is None:
+            self.probing = asyncio.create_task(self.prober())
+
+    async def prober(self) -> None:
+        """Probe the endpoints that aren't carrying traffic every ENDPOINT_PROBE_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(ENDPOINT_PROBE_INTERVAL)
+            await self.probe_endpoints(idle=ENDPOINT_PROBE_INTERVAL)
+            logger.debug('Webhook endpoints: %s', [(e.name, e.healthy, e.latency) for e in self.endpoints])
 
     async def post(self, endpoint: str, data: str) -> ClientResponse:
         """Send a POST request to the given Home Assisntat endpoint
@@ -79,6 +195,14 @@ class API:
         """
         return await self.session.get(self.instance_url + endpoint, headers=self.headers)
 
+    async def probe(self, timeout: float) -> bool:
+        """Cheap reachability check of Home Assistant through any of the webhook endpoints
+
+        :param timeout: Seconds to wait for the response
+        :return: True if Home Assisntat answered
+        """
+        return await self.probe_endpoints(timeout)
+
     def process_registration_data(self, data: dict) -> None:
         """Process the data returned from the registration endpoint
         :param data: The data returned from the registration endpoint
@@ -88,20 +212,32 @@ class API:
         self.webhook_url = self.instance_url + '/api/webhook/' + self.webhook_id
         self.cloudhook_url = data.get('cloudhook_url', "")
         self.remote_ui_url = data.get('remote_ui_url', "")
+        # https://developers.home-assistant.io/docs/api/native-app-integration/sending-data
+        self.endpoints = [Endpoint("local", self.webhook_url)]
+        if self.cloudhook_url:
+            self.endpoints.append(Endpoint("cloudhook", self.cloudhook_url))
+        if self.remote_ui_url:
+            self.endpoints.append(Endpoint("remote_ui", self.remote_ui_url + '/api/webhook/' + self.webhook_id))
 
 
 class Server:
-    """Class that runs an http server and handles requests in the route /notify"""
-    app: web.Application
+    """Class that runs an http server and handles requests in the route /notify
+    aiohttp.web is imported here, it's only needed when notifications are enabled.
+    """
+    app: "web.Application"
     host: str
     port: int
 
     def __init__(self, companion: Companion) -> None:
+        from aiohttp import web
+
         self.app = web.Application()
         self.host = companion.computer_ip
         self.port = companion.computer_port
 
     async def start(self) -> None:
+        from aiohttp import web
+
         logger.info('Starting http server on %s:%s', self.host, self.port)
         runner = web.AppRunner(self.app)
         await runner.setup()
@@ -0,0 +1,111 @@
+from halinuxcompanion.api import API
+
+from aiohttp import ClientError
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+# Commands running at the same time, the rest wait for a slot
+MAX_RUNNING = 4
+RESULT_EVENT_ENDPOINT = "/api/events/halinuxcompanion_command_result"
+
+
+class CommandRunner:
+    """Runs the notification commands and the url_program launches as subprocesses.
+    - At most max_running commands run at the same time, the rest wait for a slot.
+    - A command with dedupe set is ignored while a previous run of it is still going.
+    - Commands are killed (their whole process group) after their timeout.
+    - Every process is waited for, so none is left as a zombie, and the exit status and duration are logged and
+      optionally sent to Home Assistant as an event.
+    """
+
+    def __init__(self, api: Optional[API] = None, max_running: int = MAX_RUNNING) -> None:
+        self.api = api
+        self.slots = asyncio.Semaphore(max_running)
+        self.running: Dict[str, asyncio.Task] = {}  # Deduplicated commands by id
+        self.tasks: Set[asyncio.Task] = set()  # References to the running tasks
+
+    def run(
+        self,
+        id: str,
+        command: List[str],
+        timeout: Optional[float] = None,
+        dedupe: bool = False,
+        event: bool = False,
+        bounded: bool = True,
+    ) -> Optional[asyncio.Task]:
+        """Schedule a command
+
+        :param id: Identifies the command in the logs, the dedupe rule and the event
+        :param command: The program and its arguments
+        :param timeout: Seconds after which the command is killed, None to let it run
+        :param dedupe: Ignore the command if a previous run of the same id is still going
+        :param event: Send the result to Home Assistant as an event
+        :param bounded: Take one of the max_running slots, launches of long lived programs (e.g. a browser) don't
+        :return: The task running the command, None if it was deduplicated
+        """
+        if dedupe and id in self.running:
+            logger.warning("Command %s is already running, ignoring it", id)
+            return None
+
+        task = asyncio.create_task(self._run(id, command, timeout, event, bounded))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if dedupe:
+            self.running[id] = task
+            task.add_done_callback(lambda _: self.running.pop(id, None))
+        return task
+
+    async def _run(self, id: str, command: List[str], timeout: Optional[float], event: bool, bounded: bool) -> None:
+        if bounded:
+            await self.slots.acquire()
+        try:
+            logger.info("Running command %s: %s", id, command)
+            start = time.monotonic()
+            returncode, timed_out = await self.execute(command, timeout)
+            duration = round(time.monotonic() - start, 3)
+        finally:
+            if bounded:
+                self.slots.release()
+
+        logger.info(
+            "Command %s finished with status:%s in %ss%s", id, returncode, duration, " (timed out)" if timed_out else ""
+        )
+        if event and self.api is not None:
+            data = {"command": id, "returncode": returncode, "duration": duration, "timed_out": timed_out}
+            try:
+                await self.api.post(RESULT_EVENT_ENDPOINT, json.dumps(data))
+            except ClientError as e:
+                logger.error("Error sending the result of command %s: %s", id, e)
+
+    async def execute(self, command: List[str], timeout: Optional[float]) -> Tuple[Optional[int], bool]:
+        """Run a command in its own process group and wait for it, killing the group after the timeout
+
+        :return: (returncode, timed_out), the returncode is None if the command couldn't be started
+        """
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            logger.error("Could not start command %s: %s", command, e)
+            return None, False
+
+        try:
+            return await asyncio.wait_for(process.wait(), timeout), False
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            return await process.wait(), True
@@ -3,7 +3,7 @@ import json
 import platform
 import uuid
 import logging
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
 SC_INTEGRATION_DELETED = 410
@@ -25,25 +25,73 @@ CONFIG_KEYS = [
     ("sensors", True),
 ]
 
+# Settings that can't be reloaded on a running companion
+RESTART_KEYS = [
+    "ha_url",
+    "ha_token",
+    "device_id",
+    "device_name",
+    "manufacturer",
+    "model",
+    "computer_ip",
+    "computer_port",
+    "notifier",
+    "max_commands",
+    "push_websocket",
+    "sampler_process",
+]
+
 
 class CommandConfig(BaseModel):
     name: str
     command: List[str]
+    # Seconds after which the command is killed, None to let it run (e.g. a program that stays in the foreground).
+    # Only the commands with a timeout take one of the max_commands slots
+    timeout: Optional[float] = None
+    # Ignore the command while a previous run of it is still going
+    dedupe: bool = False
+    # Send the exit status and duration to Home Assistant as a halinuxcompanion_command_result event
+    event: bool = False
 
 
 class NotificationServiceConfig(BaseModel):
     enabled: bool
     url_program: str
     commands: Dict[str, CommandConfig]
+    # Commands running at the same time
+    max_commands: int = 4
+    # Receive notifications over a websocket opened to Home Assistant instead of the http server
+    websocket: bool = False
+    # JSON Lines file the notification traces are appended to, see halinuxcompanion.tracing
+    trace_file: Optional[str] = None
 
 
 class ServicesConfig(BaseModel):
     notifications: Optional[NotificationServiceConfig]
 
 
+class ReportPolicyConfig(BaseModel):
+    # Minimum change of a numeric state to be reported, absolute or relative to the last reported state (0.1 = 10%)
+    deadband: float = 0
+    relative: bool = False
+    # Seconds, minimum time between reports and maximum time without one
+    min_interval: float = 0
+    heartbeat: float = 0
+
+
+class PollingConfig(BaseModel):
+    # Factors the update and sampling intervals are multiplied by, the largest one that applies is used
+    battery: float = 4
+    idle: float = 10
+
+
 class SensorConfig(BaseModel):
+    # Any other key is an option specific to the sensor, passed to Sensor.create
+    model_config = ConfigDict(extra="allow")
+
     enabled: bool
     name: str
+    policy: Optional[ReportPolicyConfig] = None
 
 
 class CompanionConfig(BaseModel):
@@ -56,6 +104,9 @@ class CompanionConfig(BaseModel):
     computer_ip: str
     computer_port: int
     refresh_interval: Optional[int]
+    polling: PollingConfig = PollingConfig()
+    # Sample the sensors that support it in a worker process, see halinuxcompanion.sampler
+    sampler_process: bool = False
     sensors: Dict[str, SensorConfig]
     services: Optional[ServicesConfig]
 
@@ -85,14 +136,21 @@ class Companion:
     supports_encryption: bool = False
     app_data: dict = {}
     notifier: bool = False
+    push_websocket: bool = False
     refresh_interval: int = 15
+    polling: PollingConfig = PollingConfig()
+    sampler_process: bool = False
     computer_ip: str = ""
     computer_port: int = 8400
     ha_url: str = "http://localhost:8123"
     ha_token: str
     url_program: str = ""
     commands: Dict[str, CommandConfig] = {}
+    max_commands: int = 4
+    trace_file: Optional[str] = None
     sensors: Dict[str, bool] = {}
+    sensor_options: Dict[str, dict] = {}
+    sensor_policies: Dict[str, ReportPolicyConfig] = {}
 
     def __init__(self, config: dict):
         # Load only allowed values
@@ -117,15 +175,22 @@ class Companion:
             if config.refresh_interval
             else self.refresh_interval
         )
+        self.polling = config.polling
+        self.sampler_process = config.sampler_process
 
         from halinuxcompanion.sensors import __all__ as all_sensors
 
+        self.sensors = {}
+        self.sensor_options = {}
+        self.sensor_policies = {}
         for name, sensor in config.sensors.items():
             if name not in all_sensors:
-                logger.error("Sensor %s doesn't exist", name)
-                exit(1)
+                raise ValueError(f"Sensor {name} doesn't exist")
             else:
                 self.sensors[name] = sensor.enabled
+                self.sensor_options[name] = sensor.model_extra or {}
+                if sensor.policy:
+                    self.sensor_policies[name] = sensor.policy
 
         if (
             config.services
@@ -138,12 +203,23 @@ class Companion:
             push_token = hashlib.sha256(push_token.encode()).hexdigest()
 
             self.notifier = True
-            self.app_data = {
-                "push_token": push_token,  # TODO: Random generation, and store it in state
-                "push_url": f"http://{self.computer_ip}:{self.computer_port}/notify",
-            }
+            self.push_websocket = config.services.notifications.websocket
+            self.app_data = {"push_token": push_token}  # TODO: Random generation, and store it in state
+            if self.push_websocket:
+                # Home Assistant pushes the notifications over the websocket opened by halinuxcompanion.push_channel
+                self.app_data["push_websocket_channel"] = True
+            else:
+                self.app_data["push_url"] = f"http://{self.computer_ip}:{self.computer_port}/notify"
             self.url_program = config.services.notifications.url_program
             self.commands = config.services.notifications.commands
+            self.max_commands = config.services.notifications.max_commands
+            self.trace_file = config.services.notifications.trace_file
+
+    def restart_required(self, other: "Companion") -> List[str]:
+        """Settings that differ from another companion configuration and can't be applied without a restart, because
+        they are part of the device registration or the notification server.
+        """
+        return [key for key in RESTART_KEYS if getattr(self, key) != getattr(other, key)]
 
     def registration_payload(self) -> dict:
         return {
@@ -189,6 +265,7 @@ class Companion:
         if res.ok:
             data = await res.json()
             logger.info("Device Registration successful: %s", data)
+            data["app_data"] = self.app_data  # To know if it has to be updated on the next start
             self.save_registration_data(data)
             return True, data
         else:
@@ -200,6 +277,23 @@ class Companion:
             )
             return False, {}
 
+    async def update_registration(self, api: "API", data: dict) -> None:
+        """Update the app data of an existing registration (e.g. the notification channel changed)
+        https://developers.home-assistant.io/docs/api/native-app-integration/sending-data#update-registration
+
+        :param data: The stored registration data, updated with the app data on success
+        """
+        payload = self.registration_payload()
+        keys = ("app_data", "app_version", "device_name", "manufacturer", "model", "os_version")
+        update = {"type": "update_registration", "data": {key: payload[key] for key in keys}}
+        logger.info("Updating device registration with payload:%s", update)
+        res = await api.webhook_post("update_registration", data=json.dumps(update))
+        if res.ok:
+            data["app_data"] = self.app_data
+            self.save_registration_data(data)
+        else:
+            logger.error("Device registration update failed with status code %s", res.status)
+
     async def load_or_register(self, api: "API") -> Tuple[bool, dict]:
         """
         Load registration data from disk or register the companion APP
@@ -209,6 +303,8 @@ class Companion:
             logger.info("Loaded existing registration data from disk %s", registration_data)
             if await self.check_registration(api, registration_data):
                 logger.info("Device already registered")
+                if registration_data.get("app_data") != self.app_data:
+                    await self.update_registration(api, registration_data)
                 return True, registration_data
             else:
                 logger.info("Device registration data is invalid, re-registering")
@@ -1,7 +1,8 @@
 from dbus_next.aio import MessageBus, ProxyInterface
-from dbus_next import BusType
+from dbus_next import BusType, Message, MessageType
 from dbus_next.errors import DBusError
-from typing import Callable, Optional
+from typing import Callable, Dict, Optional, Tuple
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +11,20 @@ NOTIFICATIONS_INTERFACE = "org.freedesktop.Notifications"
 LOGIN_INTERFACE = "org.freedesktop.login1.Manager"
 SCREENSAVER_INTERFACE = "org.freedesktop.ScreenSaver"
 SCREENSAVER_GNOME_INTERFACE = "org.gnome.ScreenSaver"
+UPOWER_INTERFACE = "org.freedesktop.UPower"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+# The message bus itself, it owns its name and emits NameOwnerChanged
+BUS_SERVICE = "org.freedesktop.DBus"
+BUS_PATH = "/org/freedesktop/DBus"
+SYSTEMD_INTERFACE = "org.freedesktop.systemd1.Manager"
+SYSTEMD_SERVICE = "org.freedesktop.systemd1"
+SYSTEMD_UNIT_PATH = "/org/freedesktop/systemd1/unit"
+# Bus, service, path and interface of the battery summary of UPower (all the batteries of the system combined)
+UPOWER_DISPLAY_DEVICE = (
+    "system", UPOWER_INTERFACE, "/org/freedesktop/UPower/devices/DisplayDevice", "org.freedesktop.UPower.Device"
+)
+# Interfaces implemented by several objects are named after the object
+UPOWER_PROPERTIES = "upower_properties"
 
 SIGNALS = {
     "session.notification_on_action_invoked": {
@@ -36,6 +51,32 @@ SIGNALS = {
         "name": "on_prepare_for_shutdown",
         "interface": LOGIN_INTERFACE,
     },
+    "system.upower_on_properties_changed": {
+        "name": "on_properties_changed",
+        "interface": UPOWER_PROPERTIES,
+    },
+    # Signals with a "match" are received through a match rule instead of a proxy interface, for signals emitted by
+    # many objects (every unit of systemd) or with several arguments. See Dbus.register_match
+    "system.systemd_on_job_removed": {
+        "name": "JobRemoved",
+        "interface": SYSTEMD_INTERFACE,
+        "match": {"bus": "system", "sender": SYSTEMD_SERVICE, "path": "/org/freedesktop/systemd1"},
+    },
+    "system.systemd_on_unit_new": {
+        "name": "UnitNew",
+        "interface": SYSTEMD_INTERFACE,
+        "match": {"bus": "system", "sender": SYSTEMD_SERVICE, "path": "/org/freedesktop/systemd1"},
+    },
+    "system.systemd_on_unit_removed": {
+        "name": "UnitRemoved",
+        "interface": SYSTEMD_INTERFACE,
+        "match": {"bus": "system", "sender": SYSTEMD_SERVICE, "path": "/org/freedesktop/systemd1"},
+    },
+    "system.systemd_units_on_properties_changed": {
+        "name": "PropertiesChanged",
+        "interface": PROPERTIES_INTERFACE,
+        "match": {"bus": "system", "sender": SYSTEMD_SERVICE, "path_namespace": SYSTEMD_UNIT_PATH},
+    },
     "subscribed": [],
 }
 
@@ -58,6 +99,24 @@ INTERFACES = {
         "path": "/org/gnome/ScreenSaver",
         "interface": SCREENSAVER_GNOME_INTERFACE,
     },
+    UPOWER_INTERFACE: {
+        "type": "system",
+        "service": UPOWER_INTERFACE,
+        "path": "/org/freedesktop/UPower",
+        "interface": UPOWER_INTERFACE,
+    },
+    UPOWER_PROPERTIES: {
+        "type": "system",
+        "service": UPOWER_INTERFACE,
+        "path": "/org/freedesktop/UPower",
+        "interface": PROPERTIES_INTERFACE,
+    },
+    SYSTEMD_INTERFACE: {
+        "type": "system",
+        "service": SYSTEMD_SERVICE,
+        "path": "/org/freedesktop/systemd1",
+        "interface": SYSTEMD_INTERFACE,
+    },
     NOTIFICATIONS_INTERFACE: {
         "type": "session",
         "service": NOTIFICATIONS_INTERFACE,
@@ -76,10 +135,98 @@ async def get_interface(bus, service, path, interface) -> Optional[ProxyInterfac
         return None
 
 
+def bus_message(member: str, rule: str) -> Message:
+    """Call of the message bus itself with a single string argument (AddMatch, RemoveMatch, GetNameOwner)"""
+    return Message(
+        destination=BUS_SERVICE,
+        path=BUS_PATH,
+        interface=BUS_SERVICE,
+        member=member,
+        signature="s",
+        body=[rule],
+    )
+
+
+def match_rule(signal: dict) -> str:
+    """https://dbus.freedesktop.org/doc/dbus-specification.html#message-bus-routing-match-rules"""
+    match = signal["match"]
+    rule = f"type='signal',sender='{match['sender']}',interface='{signal['interface']}',member='{signal['name']}'"
+    if "arg0" in match:
+        rule += f",arg0='{match['arg0']}'"
+    if "path_namespace" in match:
+        return rule + f",path_namespace='{match['path_namespace']}'"
+    return rule + f",path='{match['path']}'"
+
+
+def properties_signal(bus: str, service: str, path: str, interface: str) -> str:
+    """Add the PropertiesChanged signal of the properties of an object interface to SIGNALS
+
+    :return: The signal alias
+    """
+    alias = f"{bus}.{service}{path}_on_properties_changed:{interface}"
+    SIGNALS[alias] = {
+        "name": "PropertiesChanged",
+        "interface": PROPERTIES_INTERFACE,
+        "match": {"bus": bus, "sender": service, "path": path, "arg0": interface},
+    }
+    return alias
+
+
+def owner_signal(bus: str, service: str) -> str:
+    """Add the NameOwnerChanged signal of a service to SIGNALS, the bus emits it when the service appears (empty old
+    owner), goes away (empty new owner) or is replaced, e.g. restarted by a package upgrade
+
+    :return: The signal alias
+    """
+    alias = f"{bus}.{service}_on_owner_changed"
+    SIGNALS[alias] = {
+        "name": "NameOwnerChanged",
+        "interface": BUS_SERVICE,
+        "match": {"bus": bus, "sender": BUS_SERVICE, "path": BUS_PATH, "arg0": service},
+    }
+    return alias
+
+
+def match_handler(signal: dict, owners: Dict[str, str], callback: Callable) -> Callable[[Message], None]:
+    """Message handler calling the callback with the arguments of the signal, preceded by the object path for the
+    signals matched by path_namespace (they come from many objects).
+
+    :param owners: Unique name of the owner of each service on the bus (see Dbus.follow_owner), the bus only knows the
+        messages by the unique name of their sender
+    """
+    match = signal["match"]
+    namespace = match.get("path_namespace")
+
+    def handler(msg: Message) -> None:
+        if (
+            msg.message_type != MessageType.SIGNAL
+            or msg.member != signal["name"]
+            or msg.interface != signal["interface"]
+            or msg.sender != owners.get(match["sender"])
+        ):
+            return
+        if namespace is None:
+            if msg.path != match["path"]:
+                return
+            result = callback(*msg.body)
+        elif msg.path.startswith(namespace + "/"):
+            result = callback(msg.path, *msg.body)
+        else:
+            return
+        if asyncio.iscoroutine(result):
+            asyncio.create_task(result)
+
+    return handler
+
+
 class Dbus:
     session: MessageBus
     system: MessageBus
     interfaces: dict[str, ProxyInterface] = {}
+    # Bus, match rule and message handler of the signals registered with a match rule, by (signal alias, callback)
+    matches: Dict[Tuple[str, Callable], Tuple[MessageBus, str, Callable]] = {}
+    # Unique name of the owner of the services sending the match rule signals by bus, "" while a service isn't on it
+    owners: Dict[str, Dict[str, str]] = {"system": {BUS_SERVICE: BUS_SERVICE}, "session": {BUS_SERVICE: BUS_SERVICE}}
 
     async def init(self) -> None:
         self.system = await MessageBus(bus_type=BusType.SYSTEM).connect()
@@ -100,13 +247,121 @@ class Dbus:
 
         return iface
 
-    async def register_signal(self, signal_alias: str, callback: Callable) -> None:
-        """Register a signal handler"""
+    async def get_properties(self, bus_type: str, service: str, path: str, interface: str) -> Optional[dict]:
+        """Values of the properties of an object interface, without introspecting it
+
+        :return: The values by property name, None if the object isn't available
+        """
+        bus = self.system if bus_type == "system" else self.session
+        reply = await bus.call(
+            Message(
+                destination=service,
+                path=path,
+                interface=PROPERTIES_INTERFACE,
+                member="GetAll",
+                signature="s",
+                body=[interface],
+            )
+        )
+        if reply.message_type == MessageType.ERROR:
+            logger.warning("Could not read the properties of %s %s %s: %s", service, path, interface, reply.body)
+            return None
+        return {name: variant.value for name, variant in reply.body[0].items()}
+
+    async def register_signal(self, signal_alias: str, callback: Callable) -> bool:
+        """Register a signal handler
+
+        :return: True if the signal was registered, False if the interface isn't available
+        """
+        if "match" in SIGNALS[signal_alias]:
+            return await self.register_match(signal_alias, callback)
         iface_name, signal_name = SIGNALS[signal_alias]["interface"], SIGNALS[signal_alias]["name"]
         iface = await self.get_interface(iface_name)
         if iface is not None and hasattr(iface, signal_name):
             getattr(iface, signal_name)(callback)
             logger.info("Registered signal callback for interface:%s, signal:%s", iface_name, signal_name)
             SIGNALS["subscribed"].append((signal_alias, callback))
+            return True
         else:
             logger.warning("Could not register signal callback for interface:%s, signal:%s", iface_name, signal_name)
+            return False
+
+    async def follow_owner(self, bus_type: str, service: str) -> bool:
+        """Keep the unique name of the owner of a service in owners, it changes when the service is restarted, so it's
+        followed with NameOwnerChanged for the lifetime of the connection
+
+        :return: False if the owner can't be followed
+        """
+        owners = self.owners[bus_type]
+        if service in owners:
+            return True
+        bus = self.system if bus_type == "system" else self.session
+        rule = (
+            f"type='signal',sender='{BUS_SERVICE}',interface='{BUS_SERVICE}',member='NameOwnerChanged',"
+            f"arg0='{service}'"
+        )
+        reply = await bus.call(bus_message("AddMatch", rule))
+        if reply.message_type == MessageType.ERROR:
+            logger.warning("Could not follow the owner of %s, %s", service, reply.body)
+            return False
+
+        def handler(msg: Message) -> None:
+            if (
+                msg.message_type == MessageType.SIGNAL
+                and msg.member == "NameOwnerChanged"
+                and msg.sender == BUS_SERVICE
+                and msg.body[0] == service
+            ):
+                logger.info("Owner of %s changed from '%s' to '%s'", service, msg.body[1], msg.body[2])
+                owners[service] = msg.body[2]
+
+        # Added before the handlers of the signals of the service, so they see the new owner
+        bus.add_message_handler(handler)
+        owner = await bus.call(bus_message("GetNameOwner", service))
+        if owner.message_type == MessageType.ERROR:
+            logger.info("%s is not on the %s bus, waiting for it", service, bus_type)
+        # Unless it changed while waiting for the reply
+        owners.setdefault(service, "" if owner.message_type == MessageType.ERROR else owner.body[0])
+        return True
+
+    async def register_match(self, signal_alias: str, callback: Callable) -> bool:
+        """Register a signal handler through a match rule, without introspecting the objects emitting the signal.
+        The sender doesn't need to be on the bus, its signals are received once it appears.
+
+        :return: True if the signal was registered, False if the match rule couldn't be added
+        """
+        signal = SIGNALS[signal_alias]
+        bus_type = signal["match"]["bus"]
+        bus = self.system if bus_type == "system" else self.session
+        rule = match_rule(signal)
+        if not await self.follow_owner(bus_type, signal["match"]["sender"]):
+            return False
+        reply = await bus.call(bus_message("AddMatch", rule))
+        if reply.message_type == MessageType.ERROR:
+            logger.warning("Could not register signal callback for %s, %s", rule, reply.body)
+            return False
+
+        handler = match_handler(signal, self.owners[bus_type], callback)
+        bus.add_message_handler(handler)
+        self.matches[(signal_alias, callback)] = (bus, rule, handler)
+        SIGNALS["subscribed"].append((signal_alias, callback))
+        logger.info("Registered signal callback for %s", rule)
+        return True
+
+    def unregister_signal(self, signal_alias: str, callback: Callable) -> None:
+        """Unregister a signal handler previously registered with register_signal"""
+        if (signal_alias, callback) not in SIGNALS["subscribed"]:
+            return
+        if (signal_alias, callback) in self.matches:
+            bus, rule, handler = self.matches.pop((signal_alias, callback))
+            bus.remove_message_handler(handler)
+            bus.send(bus_message("RemoveMatch", rule))
+            SIGNALS["subscribed"].remove((signal_alias, callback))
+            logger.info("Unregistered signal callback for %s", rule)
+            return
+        iface_name, signal_name = SIGNALS[signal_alias]["interface"], SIGNALS[signal_alias]["name"]
+        iface = self.interfaces[iface_name]
+        # dbus_next generates an off_<signal> method for every on_<signal> one
+        getattr(iface, "off_" + signal_name[3:])(callback)
+        SIGNALS["subscribed"].remove((signal_alias, callback))
+        logger.info("Unregistered signal callback for interface:%s, signal:%s", iface_name, signal_name)
@@ -0,0 +1,82 @@
+"""Helpers for sensors that report several devices (network interfaces, disks, ...) out of a single file"""
+import time
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, List, Optional, Sequence
+
+# If the boot clock advanced this many seconds more than the monotonic clock, the machine was suspended in between
+SUSPEND_GAP = 1.0
+COUNTER_32 = 2**32
+
+
+class Selector:
+    """Include/exclude shell style patterns (fnmatch) for device names.
+    A device is selected if it matches any include pattern (or there are none), no exclude pattern and the optional
+    check. The decision is cached per name since the set of devices is small and rarely changes.
+    """
+
+    def __init__(
+        self, include: Sequence[str] = (), exclude: Sequence[str] = (), check: Optional[Callable[[str], bool]] = None
+    ) -> None:
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.check = check
+        self.cache: Dict[str, bool] = {}
+
+    def __call__(self, name: str) -> bool:
+        selected = self.cache.get(name)
+        if selected is None:
+            selected = self.cache[name] = (
+                (not self.include or any(fnmatchcase(name, p) for p in self.include))
+                and not any(fnmatchcase(name, p) for p in self.exclude)
+                and (self.check is None or self.check(name))
+            )
+        return selected
+
+
+class Counters:
+    """Rates per second of cumulative counters, computed between consecutive snapshots of all devices.
+    - Devices that are new in a snapshot get a rate from the next one.
+    - A counter that went backwards is treated as a 32 bit wrap only when the wrap is plausible: the previous value fits
+      in 32 bits and the implied delta is under half the 32 bit range. Otherwise the counter was reset (e.g. a device
+      re-created with the same name, the counters are 64 bit on 64 bit kernels) and the device is skipped for this
+      snapshot.
+    - If the machine was suspended between snapshots no rates are returned, the interval isn't representative.
+    """
+
+    def __init__(self) -> None:
+        self.previous: Optional[Dict[str, Sequence[int]]] = None
+        self.time: float = 0.0
+        self.boottime: float = 0.0
+
+    def reset(self) -> None:
+        self.previous = None
+
+    def rates(self, snapshot: Dict[str, Sequence[int]]) -> Dict[str, List[float]]:
+        """Store the snapshot and return the rates per device since the previous one.
+
+        :param snapshot: Counters of each device, always in the same order
+        :return: Rates per second of each device, in the same order as the counters
+        """
+        now, boottime = time.monotonic(), time.clock_gettime(time.CLOCK_BOOTTIME)
+        previous, elapsed = self.previous, now - self.time
+        suspended = (boottime - self.boottime) - elapsed > SUSPEND_GAP
+        self.previous, self.time, self.boottime = snapshot, now, boottime
+        if previous is None or suspended or elapsed <= 0:
+            return {}
+
+        rates = {}
+        for device, counters in snapshot.items():
+            old = previous.get(device)
+            if old is None:
+                continue
+            deltas = []
+            for new, prev in zip(counters, old):
+                delta = new - prev
+                if delta < 0:
+                    delta += COUNTER_32
+                    if prev >= COUNTER_32 or not 0 <= delta < COUNTER_32 // 2:
+                        break
+                deltas.append(delta / elapsed)
+            else:
+                rates[device] = deltas
+        return rates
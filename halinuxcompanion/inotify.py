@@ -0,0 +1,70 @@
+"""Minimal non-blocking inotify, through the libc calls (no dependencies).
+The events are read when the caller wants them (e.g. on every update), there's no need for a reader in the event loop.
+https://man7.org/linux/man-pages/man7/inotify.7.html
+"""
+from typing import Dict, List, Tuple
+import ctypes
+import errno
+import os
+import struct
+
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event: wd, mask, cookie, len, followed by the name (len bytes, null padded)
+EVENT = struct.Struct("iIII")
+READ_SIZE = 65536
+
+
+class Inotify:
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}  # Path of each watch descriptor
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self.watches[wd] = path
+        return wd
+
+    def read(self) -> List[Tuple[str, int, str]]:
+        """The pending events, empty if there are none
+
+        :return: (path of the watch, mask, name) of each event, the name is empty for events of the watched path itself
+        """
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT.unpack_from(buffer, offset)
+                offset += EVENT.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                path = self.watches.get(wd, "")
+                if mask & IN_IGNORED:
+                    # The watch was removed, the watched directory is gone
+                    self.watches.pop(wd, None)
+                events.append((path, mask, name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+        self.watches.clear()
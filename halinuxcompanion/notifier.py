@@ -1,15 +1,20 @@
 from halinuxcompanion.companion import CommandConfig, Companion
 from halinuxcompanion.api import API, Server
 from halinuxcompanion.dbus import Dbus
+from halinuxcompanion.commands import CommandRunner
+from halinuxcompanion.recorder import RECORDER
+from halinuxcompanion.tracing import Trace, Tracer
 
 import asyncio
 from aiohttp.web import Response, json_response
 from aiohttp import ClientError
 from dbus_next.aio import ProxyInterface
+from dbus_next.errors import DBusError
 from dbus_next.signature import Variant
 from importlib.resources import files
 from collections import OrderedDict
-from typing import Dict, List
+from copy import deepcopy
+from typing import Dict, List, Optional
 import json
 import re
 import logging
@@ -51,6 +56,8 @@ RESPONSES = {
 }
 
 EMPTY_DICT = {}
+# Fields of the notification requests left out of the flight recorder
+PRIVATE_FIELDS = ("push_token", "registration_info")
 
 
 class Notifier:
@@ -62,6 +69,9 @@ class Notifier:
     5. Listens to the dbus events related to this notification.
     6. When dbus events are generated, it emits the event to Home Assistant (if appropieate).
     7. Some action events perform a local action like opening a url.
+
+    Each notification carries a trace (notification["trace"]) where the time of every step is recorded, see
+    halinuxcompanion.tracing.
     """
 
     # Only keeping the last 20 notifications and popping everytime a new one is added
@@ -78,10 +88,15 @@ class Notifier:
 
     def __init__(self):
         # The initialization is done in the init function
-        pass
+        # Dispatch lanes by tag, notifications with the same tag are sent to dbus one at a time so the replace_id of the
+        # previous one is known, and only the latest notification waiting in a lane is kept
+        self.lanes: Dict[str, asyncio.Task] = {}
+        self.queued: Dict[str, dict] = {}
+        self.runner = CommandRunner()
+        self.tracer = Tracer()
 
     async def init(
-        self, dbus: Dbus, api: API, webserverver: Server, companion: Companion
+        self, dbus: Dbus, api: API, webserverver: Optional[Server], companion: Companion
     ) -> None:
         """Function to initialize the notifier.
         1. Gets the dbus interface to send notifications and listen to events.
@@ -107,8 +122,10 @@ class Notifier:
         self.interface.on_action_invoked(self.on_action)
         self.interface.on_notification_closed(self.on_close)
 
-        # Setup http server route handler for incoming notifications
-        webserverver.app.router.add_route("POST", "/notify", self.on_ha_notification)
+        # Setup http server route handler for incoming notifications, there's no server when notifications come through
+        # the websocket push channel
+        if webserverver is not None:
+            webserverver.app.router.add_route("POST", "/notify", self.on_ha_notification)
 
         # API and necessary data
         self.api = api
@@ -116,21 +133,23 @@ class Notifier:
         self.url_program = companion.url_program
         self.commands = companion.commands
         self.ha_url = companion.ha_url
+        self.runner = CommandRunner(api, companion.max_commands)
+        self.tracer = Tracer(companion.trace_file)
 
     # Entrypoint to the Class logic
     async def on_ha_notification(self, request) -> Response:
         """Function that handles the notification POST request by Home Assistant.
 
-        This is the only entry point to start logic in this class.
-            This function is called by the http server when a notification is received. The notification is transformed
-            to the format dbus uses, and sent to dbus.
+        This function is called by the http server when a notification is received. After checking the push_token the
+        notification is handled by handle_notification, which is also the entry point of the websocket push channel.
 
         :param request: The request object
         :return: The response object
         """
+        trace = self.tracer.start()
         notification: dict = await request.json()
         push_token = notification.get("push_token")
-        logger.info("Received notification request:%s", notification)
+        logger.info("Received notification request trace:%s notification:%s", trace.id, notification)
 
         # Check if the notification is for this device
         if push_token != self.push_token:
@@ -141,8 +160,25 @@ class Notifier:
             )
             return json_response(body=RESPONSES["invalid_token"], status=400)
 
+        self.handle_notification(notification, trace)
+
+        return json_response(body=RESPONSES["ok"], status=201)
+
+    def handle_notification(self, notification: dict, trace: Optional[Trace] = None) -> None:
+        """Handles a notification coming from Home Assistant, either through the http server (on_ha_notification) or
+        the websocket push channel (halinuxcompanion.push_channel). Commands are run, the rest are sent to dbus.
+
+        :param notification: The notification as sent by Home Assistant (mutated)
+        :param trace: The trace started when the notification arrived, a new one if None
+        """
+        # Without the token and the webhook id, the notification is mutated from here on
+        RECORDER.record("notify", deepcopy({k: v for k, v in notification.items() if k not in PRIVATE_FIELDS}))
+        if trace is not None:
+            notification["trace"] = trace
         # Transform the notification to the format dbus uses
         notification = self.notification_transform(notification)
+        trace = notification["trace"]
+        trace.span("transformed")
 
         if notification["is_command"]:
             command_id = notification["message"]
@@ -153,25 +189,26 @@ class Notifier:
                     "Received notification command: id:%s name:%s", command_id, command.name
                 )
                 logger.info("Scheduling notification command: %s", command.command)
-                asyncio.create_task(
-                    asyncio.create_subprocess_exec(
-                        *command.command,
-                        stdout=asyncio.subprocess.DEVNULL,
-                        stderr=asyncio.subprocess.DEVNULL,
-                    )
+                # Commands without a timeout can keep running (e.g. a music player), so like the url_program launches
+                # they don't take a command slot
+                self.runner.run(
+                    command_id,
+                    command.command,
+                    command.timeout,
+                    command.dedupe,
+                    command.event,
+                    bounded=command.timeout is not None,
                 )
+                self.tracer.finish(trace, "command")
             else:
                 # Got notificatoin command but none defined
                 logger.error(
                     "Received notification command %s, but no command is defined",
                     command_id,
                 )
+                self.tracer.finish(trace, "undefined_command")
         else:
-            asyncio.create_task(
-                self.dbus_notify(self.notification_transform(notification))
-            )
-
-        return json_response(body=RESPONSES["ok"], status=201)
+            self.dispatch(notification)
 
     async def ha_event_trigger(
         self, event: str, action: str = "", notification: dict = {}
@@ -200,6 +237,8 @@ class Notifier:
             if event == "action":
                 data["action"] = action
 
+            trace: Optional[Trace] = notification.get("trace")
+            stage = f"{event}_event_failed"
             try:
                 res = await self.api.post(endpoint, json.dumps(data))
                 logger.info(
@@ -208,9 +247,17 @@ class Notifier:
                     data,
                     res.status,
                 )
+                stage = f"{event}_event"
                 return True
             except ClientError as e:
                 logger.error("Error sending Home Assistant event: %s", e)
+            finally:
+                # The notification is done once it's closed, actions can be invoked until then
+                if trace is not None:
+                    if event == "closed":
+                        self.tracer.finish(trace, stage)
+                    else:
+                        trace.span(stage)
 
         return False
 
@@ -222,9 +269,11 @@ class Notifier:
         :param notification: The notification to convert (mutated)
         :return: The mutated notification passed with the necessary fields to invoke a dbus notification.
         """
+        if "trace" not in notification:
+            notification["trace"] = self.tracer.start()
         # Add the data, avoids the need to check (branching) ahead
         data: dict = notification.setdefault("data", {})
-        tag: str = data.setdefault("tag", "")
+        data.setdefault("tag", "")
         actions: List[str] = ["default", "Default"]
         hints: Dict[str, Variant] = {}
         icon: str = HA_ICON  # Icon path
@@ -278,8 +327,8 @@ class Notifier:
                     pass
 
             # Replaces id:
-            # Using the notification tag, check if it should replace an existing notification
-            replace_id = self.tagtoid.get(tag, 0)
+            # Resolved from the notification tag when it's sent (Notifier.lane), since a notification with the same tag
+            # could still be in flight at this point
 
             # Dismiss/clear notification
             if notification["message"] == "clear_notification":
@@ -302,6 +351,38 @@ class Notifier:
 
         return notification
 
+    def dispatch(self, notification: dict) -> None:
+        """Queue a transformed notification in the lane of its tag, replacing the one waiting there (if any).
+        Notifications without a tag don't replace others, they are sent right away.
+
+        :param notification: The notification to send, transformed by notification_transform
+        """
+        tag: str = notification["data"].get("tag", "")
+        if not tag:
+            asyncio.create_task(self.dbus_notify(notification))
+            return
+
+        if tag in self.queued:
+            logger.info("Notification with tag:%s superseded before being sent", tag)
+            self.tracer.finish(self.queued[tag]["trace"], "superseded")
+        self.queued[tag] = notification
+        if tag not in self.lanes:
+            self.lanes[tag] = asyncio.create_task(self.lane(tag))
+
+    async def lane(self, tag: str) -> None:
+        """Send the notifications queued for a tag one at a time, until there are none left"""
+        try:
+            while tag in self.queued:
+                notification = self.queued.pop(tag)
+                notification["replace_id"] = self.tagtoid.get(tag, 0)
+                try:
+                    await self.dbus_notify(notification)
+                except DBusError as e:
+                    logger.error("Dbus notification with tag:%s failed: %s", tag, e)
+                    self.tracer.finish(notification["trace"], "failed")
+        finally:
+            del self.lanes[tag]
+
     async def dbus_notify(self, notification: dict) -> None:
         """Function to send a native dbus notification.
         According to the following link:
@@ -312,7 +393,9 @@ class Notifier:
             from the format Home Assistant sends.
         :return: None
         """
-        logger.info("Sending dbus notification")
+        trace: Trace = notification["trace"]
+        trace.span("queued")
+        logger.info("Sending dbus notification trace:%s", trace.id)
         id = await self.interface.call_notify(
             APP_NAME,
             notification["replace_id"],
@@ -323,7 +406,10 @@ class Notifier:
             notification["hints"],
             notification["timeout"],
         )
-        logger.info("Dbus notification dispatched id:%s", id)
+        trace.span("notified")
+        # The replay gives the notifications the recorded ids, which its actions and closes refer to
+        RECORDER.record("notified", id)
+        logger.info("Dbus notification dispatched id:%s trace:%s", id, trace.id)
 
         # History management: Add the new notification, and remove the oldest one.
         # Storage
@@ -337,6 +423,9 @@ class Notifier:
         otag = old_not.get("data", {}).get("tag", "")
         if otag in self.tagtoid:
             self.tagtoid.pop(otag)
+        if "trace" in old_not:
+            # Its actions and close events aren't handled anymore
+            self.tracer.finish(old_not["trace"], "evicted")
 
     async def on_action(self, id: int, action: str) -> None:
         """Function to handle the dbus notification action event
@@ -346,6 +435,7 @@ class Notifier:
         :param id: The dbus id of the notification
         :param action: The action that was invoked
         """
+        RECORDER.record("action", id, action)
         logger.info(
             "Notification action dbus event received: id:%s, action:%s", id, action
         )
@@ -356,6 +446,7 @@ class Notifier:
             )
             return
 
+        notification["trace"].span("action")
         actions: List[dict] = notification["data"].get("actions", {})
         if actions or action == "default":
             uri: str
@@ -370,9 +461,8 @@ class Notifier:
                 )
 
             if uri.startswith("http") and self.url_program != "":
-                asyncio.create_task(
-                    asyncio.create_subprocess_exec(self.url_program, uri)
-                )
+                # The program can keep running (e.g. the browser), so it has no timeout and doesn't take a command slot
+                self.runner.run(self.url_program, [self.url_program, uri], bounded=False)
                 logger.info("Launched action:%s uri:%s", action, uri)
 
             if emit_event:
@@ -387,11 +477,13 @@ class Notifier:
         :param id: The dbus id of the notification
         :param reason: The reason the notification was closed
         """
+        RECORDER.record("close", id, reason)
         logger.info(
             "Notification closed dbus event received: id:%s, reason:%s", id, reason
         )
         notification = self.history.get(id, {})
         if notification:
+            notification["trace"].span("closed")
             asyncio.create_task(
                 self.ha_event_trigger(event="closed", notification=notification)
             )
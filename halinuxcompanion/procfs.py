@@ -0,0 +1,89 @@
+"""Fast readers for procfs/sysfs files that are read on every tick.
+Files are opened once and kept open, every read is a single pread into a buffer that is reused, and the parsers only
+look at the fields they are asked for.
+"""
+import os
+from typing import Dict, List, Sequence, Tuple
+
+BUFFER_SIZE = 4096
+FILES: Dict[str, "ProcFile"] = {}
+
+
+class ProcFile:
+    """A procfs/sysfs file kept open for its whole lifetime"""
+
+    def __init__(self, path: str, size: int = BUFFER_SIZE) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self.buffer = bytearray(size)
+        self.length = 0
+
+    def read(self) -> bytearray:
+        """Re-read the file from the start into the buffer, growing it if the content doesn't fit.
+        The returned buffer is reused by the next read, only the first self.length bytes are valid.
+        """
+        while True:
+            self.length = os.preadv(self.fd, [self.buffer], 0)
+            if self.length < len(self.buffer):
+                return self.buffer
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def procfile(path: str) -> ProcFile:
+    """Shared ProcFile for the given path, so sensors reading the same file use a single file descriptor"""
+    file = FILES.get(path)
+    if file is None:
+        file = FILES[path] = ProcFile(path)
+    return file
+
+
+def fields(file: ProcFile, keys: Sequence[bytes]) -> List[int]:
+    """Parse the given keys of a 'Key:   value [unit]' file like /proc/meminfo, missing keys are 0.
+
+    :param file: The file to read
+    :param keys: The keys to look for, without the trailing colon
+    :return: The values in the same order as the keys
+    """
+    buffer = file.read()
+    length = file.length
+    values = []
+    for key in keys:
+        start = buffer.find(b"\n" + key + b":", 0, length)
+        if start == -1:
+            # First line of the file doesn't have a preceding new line
+            start = 0 if buffer.startswith(key + b":") else -1
+        if start == -1:
+            values.append(0)
+            continue
+        start = buffer.index(b":", start, length) + 1
+        end = buffer.find(b"\n", start, length)
+        values.append(int(buffer[start:end].split(None, 1)[0]))
+    return values
+
+
+def cpu_times(file: ProcFile) -> List[Tuple[int, int]]:
+    """Parse the cpu lines of /proc/stat into (busy, total) jiffies.
+    The first item is the aggregate of all cpus, followed by one item per online cpu. Like psutil, iowait is not
+    counted as busy time and guest time is not counted twice (it's already included in user and nice).
+    """
+    buffer = file.read()
+    length = file.length
+    times = []
+    start = 0
+    while buffer.startswith(b"cpu", start):
+        end = buffer.find(b"\n", start, length)
+        values = buffer[start:end].split()
+        user, nice, system, idle, iowait, irq, softirq, steal = map(int, values[1:9])
+        total = user + nice + system + idle + iowait + irq + softirq + steal
+        times.append((total - idle - iowait, total))
+        start = end + 1
+    return times
+
+
+def loadavg(file: ProcFile) -> Tuple[float, float, float]:
+    """Parse the 1, 5 and 15 minutes load average from /proc/loadavg"""
+    values = file.read()[:file.length].split(None, 3)
+    return float(values[0]), float(values[1]), float(values[2])
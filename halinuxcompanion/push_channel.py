@@ -0,0 +1,107 @@
+from halinuxcompanion.api import API
+
+from aiohttp import ClientError, ClientWebSocketResponse, WSMsgType
+from typing import Callable, Optional
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reconnection attempts, doubled on every failure
+RECONNECT_DELAY: float = 1
+RECONNECT_MAX_DELAY: float = 300
+HEARTBEAT: float = 30
+
+
+class PushChannelError(Exception):
+    pass
+
+
+class PushChannel:
+    """Receives notifications over a websocket opened to Home Assistant, instead of Home Assistant opening a connection
+    to the http server for each one. It works behind NAT or a VPN, no port has to be reachable.
+    https://developers.home-assistant.io/docs/api/native-app-integration/notifications#enabling-websocket-push-notifications
+
+    The channel is subscribed with support_confirm, every notification is confirmed once received, if it isn't Home
+    Assistant falls back to the push_url (when there's one).
+    """
+
+    def __init__(self, api: API, handler: Callable[[dict], None]) -> None:
+        self.api = api
+        self.handler = handler
+        self.url = "ws" + api.instance_url[len("http"):] + "/api/websocket"
+        self.message_id = 0
+        self.subscribed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        """Keep the channel subscribed, reconnecting when the connection drops"""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                await self.listen()
+                logger.warning("Push notification channel closed by Home Assistant")
+            except (ClientError, asyncio.TimeoutError, PushChannelError) as e:
+                logger.warning("Push notification channel error: %s", str(e) or "timeout")
+
+            if self.subscribed:
+                delay = RECONNECT_DELAY
+                self.subscribed = False
+            logger.info("Reconnecting push notification channel in %ss", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def send(self, ws: ClientWebSocketResponse, message: dict) -> None:
+        self.message_id += 1
+        await ws.send_json({"id": self.message_id, **message})
+
+    async def receive(self, ws: ClientWebSocketResponse) -> Optional[dict]:
+        """Next message of the websocket, None if it was closed"""
+        message = await ws.receive()
+        if message.type != WSMsgType.TEXT:
+            return None
+        return json.loads(message.data)
+
+    async def listen(self) -> None:
+        """Authenticate, subscribe to the push notification channel and handle the notifications until it's closed"""
+        async with self.api.session.ws_connect(self.url, heartbeat=HEARTBEAT) as ws:
+            # https://developers.home-assistant.io/docs/api/websocket#authentication-phase
+            await self.receive(ws)  # auth_required
+            await ws.send_json({"type": "auth", "access_token": self.api.token})
+            message = await self.receive(ws)
+            if message is None or message["type"] != "auth_ok":
+                raise PushChannelError(f"Authentication failed: {message}")
+
+            await self.send(ws, {
+                "type": "mobile_app/push_notification_channel",
+                "webhook_id": self.api.webhook_id,
+                "support_confirm": True,
+            })
+            subscription = self.message_id
+            while (message := await self.receive(ws)) is not None:
+                if message.get("id") != subscription:
+                    continue
+                if message["type"] == "result":
+                    if not message["success"]:
+                        raise PushChannelError(f"Subscription failed: {message.get('error')}")
+                    logger.info("Subscribed to the push notification channel")
+                    self.subscribed = True
+                elif message["type"] == "event":
+                    notification = message["event"]
+                    confirm_id = notification.pop("hass_confirm_id", None)
+                    if confirm_id is not None:
+                        await self.send(ws, {
+                            "type": "mobile_app/push_notification_confirm",
+                            "webhook_id": self.api.webhook_id,
+                            "confirm_id": confirm_id,
+                        })
+                    logger.info("Received notification from the push channel:%s", notification)
+                    try:
+                        self.handler(notification)
+                    except Exception:
+                        # A malformed notification must not close the channel
+                        logger.exception("Error handling notification:%s", notification)
@@ -0,0 +1,108 @@
+"""In-memory flight recorder of the hot path.
+The payloads sent on every update, the responses of Home Assistant and the dbus signals are recorded as plain tuples in
+a fixed-size ring buffer instead of being logged, which costs next to nothing. The buffer is written to
+$XDG_STATE_HOME/halinuxcompanion/flight-recorder.jsonl on SIGUSR1 and when an update fails, so the last records before
+a problem are there without running with debug logging.
+
+With --record <file> every record is also appended to the file as it's made, along with the sensor samples and the
+notifications received, which halinuxcompanion.replay feeds back through the sensor manager and the notifier.
+Records are written as compact JSON arrays: [time, kind, *fields].
+"""
+from collections import Counter, deque
+from typing import Deque, Optional, TextIO
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Records kept in memory
+RECORDER_SIZE = 500
+# Minimum seconds between dumps caused by errors, a failing Home Assistant fails every update
+DUMP_INTERVAL = 60
+# Seconds between the summaries of the periodic events
+SUMMARY_INTERVAL = 300
+
+
+def encode(value):
+    """JSON encoding of the values that aren't JSON types, dbus Variants (signal arguments) are written as values"""
+    return getattr(value, "value", repr(value))
+
+
+def serialize(record: tuple) -> str:
+    return json.dumps(record, separators=(",", ":"), default=encode)
+
+
+def default_path() -> str:
+    state_home = os.getenv("XDG_STATE_HOME", os.path.expanduser("~/.local/state"))
+    return os.path.join(state_home, "halinuxcompanion", "flight-recorder.jsonl")
+
+
+class FlightRecorder:
+    """Ring buffer of (time, kind, *fields) records, the fields are kept as they are (no copies, no formatting) so
+    they must not be mutated after being recorded.
+    """
+
+    def __init__(self, size: int = RECORDER_SIZE, path: Optional[str] = None) -> None:
+        self.records: Deque[tuple] = deque(maxlen=size)
+        self.path = path or default_path()
+        self.dumped = -DUMP_INTERVAL
+        # Recording file, every record is written to it when set
+        self.sink: Optional[TextIO] = None
+
+    def record(self, kind: str, *fields) -> None:
+        record = (time.time(), kind) + fields
+        self.records.append(record)
+        if self.sink is not None:
+            self.sink.write(serialize(record) + "\n")
+
+    def start_recording(self, path: str) -> None:
+        """Append every record to a file, it's line buffered so a killed process loses nothing"""
+        self.sink = open(path, "a", buffering=1)
+        logger.info("Recording to %s", path)
+
+    def stop_recording(self) -> None:
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+    def dump(self) -> None:
+        """Write the records to the dump file as JSON Lines, replacing the previous dump"""
+        self.dumped = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as f:
+                for record in self.records:
+                    f.write(serialize(record) + "\n")
+        except OSError as e:
+            logger.error("Could not write the flight recorder to %s: %s", self.path, e)
+            return
+        logger.info("Flight recorder written to %s (%s records)", self.path, len(self.records))
+
+    def dump_on_error(self) -> None:
+        """Dump the records, unless they were dumped in the last DUMP_INTERVAL seconds"""
+        if time.monotonic() - self.dumped >= DUMP_INTERVAL:
+            self.dump()
+
+
+class PeriodicSummary:
+    """Counts events and logs how many of each happened every interval, instead of a line per event"""
+
+    def __init__(self, log: logging.Logger, name: str, interval: float = SUMMARY_INTERVAL) -> None:
+        self.log = log
+        self.name = name
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.logged = time.monotonic()
+
+    def count(self, event: str) -> None:
+        self.counts[event] += 1
+        now = time.monotonic()
+        if now - self.logged >= self.interval:
+            self.log.info("%s in the last %ss: %s", self.name, round(now - self.logged), dict(self.counts))
+            self.counts.clear()
+            self.logged = now
+
+
+RECORDER = FlightRecorder()
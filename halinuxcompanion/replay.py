@@ -0,0 +1,216 @@
+"""Replay of a recording made with --record, to reproduce what a companion went through or to compare versions.
+The sensor samples go through the SensorManager (reporting policies, outbox, sender) and the notifications through the
+Notifier, against a stubbed Home Assistant that answers with the recorded responses and a stubbed dbus. The sensor
+signals go through the SensorManager to the replayed sensors, the state a signal set is in the forced sample recorded
+right after it. The actions and closes of the notifications go to the Notifier, which fires their events.
+
+    python -m halinuxcompanion.replay recording.jsonl --speed 0 --allocations
+
+--speed is how many times faster than real time the recording is played, 0 plays it as fast as possible.
+"""
+from halinuxcompanion.companion import Companion, ReportPolicyConfig
+from halinuxcompanion.notifier import Notifier
+from halinuxcompanion.sensor import Sensor, SensorManager
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+class ReplaySensor(Sensor, register=False):
+    """A sensor of the recording, its state is set from the recorded samples"""
+
+    __slots__ = ("config_name", "type")
+
+    def __init__(self, unique_id: str, config_name: str = "", type: str = "sensor") -> None:
+        super().__init__(unique_id=unique_id, name=unique_id)
+        self.config_name = config_name
+        self.type = type
+
+    async def on_signal(self, *args) -> bool:
+        """Handler of every recorded signal, the forced sample recorded after the signal pushes the sensor"""
+        return False
+
+
+class ReplayResponse:
+    def __init__(self, status: int) -> None:
+        self.status = status
+        self.ok = status < 400
+
+
+class ReplayAPI:
+    """Home Assistant answering every webhook with the next recorded response of its type (200 when there are none
+    left), after the recorded latency scaled by the replay speed.
+    """
+
+    def __init__(self, responses: Dict[str, List[Tuple[int, float]]], speed: float) -> None:
+        self.responses = responses
+        self.speed = speed
+        self.posts: Counter = Counter()
+        self.sent = 0  # Bytes
+
+    async def webhook_post(self, type: str, data: str, timeout: float = 0) -> ReplayResponse:
+        self.posts[type] += 1
+        self.sent += len(data)
+        status, elapsed = 200, 0.0
+        if self.responses.get(type):
+            status, elapsed = self.responses[type].pop(0)
+        if self.speed:
+            await asyncio.sleep(elapsed / self.speed)
+        return ReplayResponse(status)
+
+    async def post(self, endpoint: str, data: str) -> ReplayResponse:
+        self.posts[endpoint] += 1
+        self.sent += len(data)
+        return ReplayResponse(200)
+
+
+class NotificationsReplay:
+    """org.freedesktop.Notifications interface that accepts every notification, and gives them the recorded ids"""
+
+    def __init__(self, ids: List[int]) -> None:
+        self.ids = ids
+        self.notified = 0
+
+    async def call_notify(self, app, replace_id, icon, title, message, actions, hints, timeout) -> int:
+        self.notified += 1
+        return self.ids.pop(0) if self.ids else self.notified
+
+
+def load(lines: Iterable[str]) -> List[list]:
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+class Replay:
+    def __init__(
+        self, records: List[list], speed: float = 1, policies: Dict[str, ReportPolicyConfig] = {}
+    ) -> None:
+        self.records = records
+        self.speed = speed
+        responses: Dict[str, List[Tuple[int, float]]] = {}
+        ids = []
+        for record in records:
+            if record[1] == "webhook":
+                _, _, _, type, _, status, elapsed = record
+                responses.setdefault(type, []).append((status, elapsed))
+            elif record[1] == "notified":
+                ids.append(record[2])
+        self.api = ReplayAPI(responses, speed)
+        self.manager = SensorManager(self.api, [], None, policies)
+        self.sensors: Dict[str, ReplaySensor] = {}
+        self.notifier = Notifier()
+        self.notifier.interface = NotificationsReplay(ids)
+        self.notifier.api = self.api
+        self.notifier.url_program = ""
+        self.notifier.commands = {}
+        self.notifier.ha_url = ""
+        self.notifier.tagtoid = {}
+        self.counts: Counter = Counter()
+
+    def sensor(self, unique_id: str) -> ReplaySensor:
+        sensor = self.sensors.get(unique_id)
+        if sensor is None:
+            sensor = self.sensors[unique_id] = ReplaySensor(unique_id)
+            sensor.manager = self.manager
+        return sensor
+
+    def sample(self, unique_id: str, config_name: str, type: str, state, attributes: dict, force: bool) -> None:
+        sensor = self.sensor(unique_id)
+        # A sensor first seen in a signal doesn't know them yet
+        sensor.config_name, sensor.type = config_name, type
+        sensor.state = state
+        sensor.attributes = attributes
+        # Samples recorded in the same update are collected before the sender runs, and sent together
+        self.manager.collect([sensor], force)
+
+    async def run(self) -> float:
+        """Play the records, and wait for the last updates to be sent
+
+        :return: Seconds it took
+        """
+        start = time.perf_counter()
+        sender = asyncio.create_task(self.manager.sender())
+        previous: Optional[float] = None
+        for record in self.records:
+            timestamp, kind, fields = record[0], record[1], record[2:]
+            if previous is not None and timestamp > previous:
+                if self.speed:
+                    await asyncio.sleep((timestamp - previous) / self.speed)
+                else:
+                    # Without delays the updates would all be merged, each is sent before the next one is played
+                    await self.settle()
+            previous = timestamp
+            self.counts[kind] += 1
+            if kind == "sample":
+                self.sample(*fields)
+            elif kind == "signal":
+                signal_alias, unique_id, args = fields
+                await self.manager._signal_handler(self.sensor(unique_id), signal_alias, "on_signal", *args)
+            elif kind == "notify":
+                self.notifier.handle_notification(fields[0])
+            elif kind in ("action", "close"):
+                # The notification was shown before it was acted on
+                await self.settle()
+                handler = self.notifier.on_action if kind == "action" else self.notifier.on_close
+                await handler(*fields)
+
+        await self.settle()
+        # The events of the last actions and closes are posted by tasks of their own, one more turn of the loop sends
+        # them
+        await asyncio.sleep(0)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        return time.perf_counter() - start
+
+    async def settle(self) -> None:
+        """Wait until the queued updates and notifications are sent"""
+        while self.manager.outbox or self.manager.requests or self.notifier.lanes:
+            await asyncio.sleep(0.001 if self.speed else 0)
+
+    def summary(self, elapsed: float) -> str:
+        lines = [f"Replayed {sum(self.counts.values())} records in {elapsed:.3f}s: {dict(self.counts)}"]
+        lines.append(f"Webhook posts: {dict(self.api.posts)} ({self.api.sent} bytes)")
+        lines.append(f"Dbus notifications: {self.notifier.interface.notified}")
+        return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recording made with --record")
+    parser.add_argument("file", help="Recording file")
+    parser.add_argument("-s", "--speed", type=float, default=1, help="Times faster than real time, 0 for no delays")
+    parser.add_argument("-c", "--config", help="Config file the reporting policies are taken from")
+    parser.add_argument("--allocations", action="store_true", help="Trace the memory allocated during the replay")
+    args = parser.parse_args()
+    logging.basicConfig(level="WARNING")
+
+    with open(args.file) as f:
+        records = load(f)
+    policies = {}
+    if args.config:
+        with open(args.config) as f:
+            policies = Companion(json.load(f)).sensor_policies
+
+    async def replay() -> None:
+        player = Replay(records, args.speed, policies)
+        if args.allocations:
+            tracemalloc.start()
+        elapsed = await player.run()
+        print(player.summary(elapsed))
+        if args.allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+            tracemalloc.stop()
+            print(f"Memory: {current} bytes in {blocks} blocks still allocated, {peak} bytes peak")
+
+    asyncio.run(replay())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""Sampling of the heavy sensors in a worker process.
+With sampler_process enabled the sensor types marked as isolated (/proc scans, psutil calls) are created and sampled in
+a separate process, so their work runs on another core and doesn't add latency to the notifications and dbus handlers
+of the main process. The main process only reads their latest state and sends it.
+
+The processes share a block of memory split in fixed size slots, each slot is written by a single process and guarded
+by a sequence lock: the sequence is odd while the slot is being written, a reader retries when it reads an odd sequence
+or when the sequence changed while it was reading. Slots:
+    0: Control, written by the main process: update interval, scale, tick and suspended.
+    1: Sensors, written once by the worker: the registration fields of its sensors.
+    2: Tick, written by the worker: the last tick it sampled.
+    3..: State and attributes of each sensor, written by the worker on every tick (JSON).
+The worker samples when the main process asks for it, on every update of the Scheduler: the main process increments
+the tick of the control slot and writes to a pipe to wake the worker up, then waits until the worker wrote the tick
+back, so the update sends fresh samples.
+"""
+from halinuxcompanion.sensor import Sensor
+
+from importlib import import_module
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+import asyncio
+import json
+import logging
+import struct
+import time
+
+if TYPE_CHECKING:
+    from halinuxcompanion.companion import Companion
+
+logger = logging.getLogger(__name__)
+
+SLOT_SIZE = 16384
+MAX_SENSORS = 62
+CONTROL_SLOT = 0
+SENSORS_SLOT = 1
+TICK_SLOT = 2
+FIRST_SENSOR_SLOT = 3
+# Slot header: sequence (u64), length of the data (u32)
+HEADER = struct.Struct("<QI")
+# Interval, scale, tick, suspended
+CONTROL = struct.Struct("<ddQ?")
+TICK = struct.Struct("<Q")
+READ_RETRIES = 100
+# Seconds to wait for the worker to create its sensors
+START_TIMEOUT = 30
+# Seconds to wait for the worker to sample a tick, the previous samples are sent if it takes longer
+TICK_TIMEOUT = 1
+TICK_POLL = 0.002
+
+
+class Snapshots:
+    """The shared memory slots"""
+
+    def __init__(self, shm: SharedMemory) -> None:
+        self.shm = shm
+        self.buffer = shm.buf
+        # The sequence of each slot written by this process
+        self.sequences: Dict[int, int] = {}
+
+    @classmethod
+    def create(cls) -> "Snapshots":
+        return cls(SharedMemory(create=True, size=SLOT_SIZE * (FIRST_SENSOR_SLOT + MAX_SENSORS)))
+
+    @classmethod
+    def attach(cls, name: str) -> "Snapshots":
+        return cls(SharedMemory(name=name))
+
+    def write(self, slot: int, data: bytes) -> bool:
+        """:return: False if the data doesn't fit in a slot"""
+        if len(data) > SLOT_SIZE - HEADER.size:
+            return False
+        offset = slot * SLOT_SIZE
+        sequence = self.sequences.get(slot, 0) + 1
+        struct.pack_into("<Q", self.buffer, offset, sequence)  # Odd, being written
+        start = offset + HEADER.size
+        self.buffer[start:start + len(data)] = data
+        HEADER.pack_into(self.buffer, offset, sequence + 1, len(data))
+        self.sequences[slot] = sequence + 1
+        return True
+
+    def read(self, slot: int) -> Tuple[int, Optional[bytes]]:
+        """:return: (sequence, data), the data is None if the slot was never written or is being written"""
+        offset = slot * SLOT_SIZE
+        for _ in range(READ_RETRIES):
+            sequence, length = HEADER.unpack_from(self.buffer, offset)
+            if sequence % 2:
+                continue
+            start = offset + HEADER.size
+            data = bytes(self.buffer[start:start + length])
+            if struct.unpack_from("<Q", self.buffer, offset)[0] == sequence:
+                return sequence, data if sequence else None
+        return sequence, None
+
+    def close(self) -> None:
+        self.buffer.release()
+        self.shm.close()
+
+
+class SampledSensor(Sensor, register=False):
+    """A sensor sampled by the worker process, sampling it reads the latest state the worker published"""
+
+    __slots__ = (
+        "config_name", "type", "device_class", "state_class", "unit_of_measurement", "entity_category", "signals",
+        "slot", "sequence", "sampler",
+    )
+
+    def __init__(self, slot: int, sampler: "SamplerProcess", fields: dict) -> None:
+        super().__init__(**{field: fields[field] for field in ("unique_id", "name", "icon", "state", "attributes")})
+        for field in ("config_name", "type", "device_class", "state_class", "unit_of_measurement", "entity_category"):
+            setattr(self, field, fields[field])
+        # Only the suspend signals are handled in the main process, the sensor is unavailable while suspended
+        self.signals = fields["signals"]
+        self.slot = slot
+        self.sequence = 0
+        self.sampler = sampler
+
+    def sample(self) -> None:
+        if not self.sampler.alive():
+            self.state = "unavailable"
+            return
+        sequence, data = self.sampler.snapshots.read(self.slot)
+        if data is not None and sequence != self.sequence:
+            self.sequence = sequence
+            self.state, self.attributes = json.loads(data)
+
+
+class SamplerProcess:
+    """Starts the worker process and creates the sensors standing for the ones it samples"""
+
+    def __init__(self, companion: "Companion", names: List[str]) -> None:
+        self.names = names
+        self.options = {name: companion.sensor_options[name] for name in names}
+        self.snapshots = Snapshots.create()
+        self.process = None
+        # Wakes the worker up for a tick, the tick itself is in the control slot
+        self.wakeup, self.doorbell = get_context("spawn").Pipe(duplex=False)
+        self.control_values = (0.0, 0.0)
+        self.ticks = 0
+        self.suspended = False
+        self.dead = False
+        self.control(companion.refresh_interval, 1.0)
+
+    async def start(self) -> List[Sensor]:
+        """Start the worker and wait for it to create its sensors
+
+        :return: The sensors sampled by the worker
+        :raises TimeoutError: If the worker didn't publish its sensors in START_TIMEOUT seconds
+        """
+        # Spawned, forking would copy the event loop and the dbus connections
+        self.process = get_context("spawn").Process(
+            target=worker,
+            args=(
+                self.snapshots.shm.name, self.wakeup, self.names, self.options,
+                logging.getLogger("halinuxcompanion").level,
+            ),
+            name="halinuxcompanion-sampler",
+            daemon=True,
+        )
+        self.process.start()
+        self.wakeup.close()  # Only the worker reads it, it sees the end of file when this process exits
+        deadline = time.monotonic() + START_TIMEOUT
+        while (data := self.snapshots.read(SENSORS_SLOT)[1]) is None:
+            if time.monotonic() > deadline or not self.process.is_alive():
+                self.stop()
+                raise TimeoutError("Sampler process didn't start")
+            await asyncio.sleep(0.05)
+
+        sensors = [SampledSensor(FIRST_SENSOR_SLOT + i, self, fields) for i, fields in enumerate(json.loads(data))]
+        logger.info("Sampler process %s started with sensors: %s", self.process.pid, [s.unique_id for s in sensors])
+        return sensors
+
+    def control(self, interval: float, scale: float) -> None:
+        """Publish the update interval and its scale (see Scheduler) to the worker"""
+        if (interval, scale) != self.control_values:
+            self.control_values = (interval, scale)
+            self.write_control()
+
+    def write_control(self) -> None:
+        self.snapshots.write(CONTROL_SLOT, CONTROL.pack(*self.control_values, self.ticks, self.suspended))
+
+    def suspend(self, suspended: bool) -> None:
+        """Forward the sleep state, the suspended sensors of the worker stop sampling like the ones of this process"""
+        self.suspended = suspended
+        self.write_control()
+        self.ring()
+
+    def ring(self) -> bool:
+        if not self.alive():
+            return False
+        try:
+            self.doorbell.send_bytes(b"")
+            return True
+        except OSError:
+            return False
+
+    async def tick(self) -> None:
+        """Ask the worker to sample its sensors, and wait until it did (at most TICK_TIMEOUT seconds)"""
+        self.ticks += 1
+        self.write_control()
+        if not self.ring():
+            return
+        deadline = time.monotonic() + TICK_TIMEOUT
+        while TICK.unpack(self.snapshots.read(TICK_SLOT)[1] or TICK.pack(0))[0] != self.ticks:
+            if time.monotonic() > deadline:
+                logger.warning("Sampler process didn't sample in %ss, sending the previous samples", TICK_TIMEOUT)
+                return
+            await asyncio.sleep(TICK_POLL)
+
+    def alive(self) -> bool:
+        if self.dead:
+            return False
+        if self.process is not None and not self.process.is_alive():
+            logger.error("Sampler process exited with code %s, its sensors are unavailable", self.process.exitcode)
+            self.dead = True
+            return False
+        return True
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+        self.doorbell.close()
+        self.snapshots.close()
+        self.snapshots.shm.unlink()
+
+
+def isolated(names: List[str]) -> List[str]:
+    """The sensors of the given config names that can be sampled by the worker process"""
+    for name in names:
+        import_module(f"halinuxcompanion.sensors.{name}")
+    return [name for name in names if Sensor.types[name].isolated]
+
+
+class WorkerManager:
+    """Stands for the SensorManager in the worker, the sensors read the sampling scale from it"""
+
+    def __init__(self, snapshots: Snapshots) -> None:
+        self.snapshots = snapshots
+
+    def control(self) -> Tuple[float, float, int, bool]:
+        return CONTROL.unpack(self.snapshots.read(CONTROL_SLOT)[1])
+
+    @property
+    def scale(self) -> float:
+        return self.control()[1]
+
+
+def worker(shm_name: str, wakeup: Connection, names: List[str], options: Dict[str, dict], loglevel: int) -> None:
+    """Entry point of the worker process"""
+    logging.basicConfig(level="INFO")
+    logging.getLogger("halinuxcompanion").setLevel(loglevel)
+    asyncio.run(run_worker(Snapshots.attach(shm_name), wakeup, names, options))
+
+
+async def run_worker(snapshots: Snapshots, wakeup: Connection, names: List[str], options: Dict[str, dict]) -> None:
+    manager = WorkerManager(snapshots)
+    sensors: List[Sensor] = []
+    for name in names:
+        import_module(f"halinuxcompanion.sensors.{name}")
+        sensors.extend(Sensor.types[name].create(options[name]))
+    sensors = sensors[:MAX_SENSORS]
+    for sensor in sensors:
+        sensor.manager = manager
+    tasks = [asyncio.create_task(getattr(sensor, task)()) for sensor in sensors for task in sensor.tasks]
+
+    def publish() -> None:
+        for slot, sensor in enumerate(sensors, FIRST_SENSOR_SLOT):
+            if not sensor.suspended:
+                sensor.sample()
+            if not snapshots.write(slot, json.dumps([sensor.state, sensor.attributes]).encode()):
+                logger.error("State of sensor:%s doesn't fit in the shared memory", sensor.unique_id)
+
+    # The first sample is published before the sensors, so the main process never reads an empty slot
+    publish()
+    fields = [
+        {
+            "unique_id": s.unique_id, "name": s.name, "icon": s.icon, "state": s.state,
+            "attributes": s.attributes, "config_name": s.config_name, "type": s.type,
+            "device_class": s.device_class, "state_class": s.state_class,
+            "unit_of_measurement": s.unit_of_measurement, "entity_category": s.entity_category,
+            "signals": {alias: handler for alias, handler in s.signals.items() if handler == "on_suspend"},
+        }
+        for s in sensors
+    ]
+    snapshots.write(SENSORS_SLOT, json.dumps(fields).encode())
+
+    ring = asyncio.Event()
+    asyncio.get_running_loop().add_reader(wakeup.fileno(), ring.set)
+    tick, suspended = 0, False
+    while True:
+        await ring.wait()
+        ring.clear()
+        try:
+            while wakeup.poll():
+                wakeup.recv_bytes()
+        except EOFError:
+            break  # The main process exited, even if it was killed
+        _, _, requested, suspend = manager.control()
+        if suspend != suspended:
+            suspended = suspend
+            for sensor in sensors:
+                if "on_suspend" in sensor.signals.values():
+                    await sensor.on_suspend(suspended)
+        if requested != tick:
+            tick = requested
+            publish()
+            snapshots.write(TICK_SLOT, TICK.pack(tick))
+
+    for task in tasks:
+        task.cancel()
@@ -0,0 +1,145 @@
+from halinuxcompanion.api import API
+from halinuxcompanion.companion import Companion
+from halinuxcompanion.dbus import UPOWER_INTERFACE, Dbus
+from halinuxcompanion.sensor import SensorManager
+
+from dbus_next.signature import Variant
+from typing import Dict, List, Optional, TYPE_CHECKING
+import asyncio
+import logging
+
+if TYPE_CHECKING:
+    from halinuxcompanion.sampler import SamplerProcess
+
+logger = logging.getLogger(__name__)
+
+# Reachability probes of Home Assistant after resuming, the delay doubles up to refresh_interval
+PROBE_TIMEOUT: float = 2
+PROBE_DELAY: float = 1
+
+
+class Scheduler:
+    """Runs the periodic sensor updates, paused while the machine sleeps and slowed down on battery or when idle.
+    On PrepareForSleep(True) the periodic updates stop, the sensors that handle the signal are still sent (going to
+    sleep). On PrepareForSleep(False) the updates pushed by the sensors are held until Home Assistant is reachable
+    again, then every sensor is sent in a single catch-up update and the periodic updates resume.
+
+    The update and sampling intervals are multiplied by the largest factor of companion.polling that applies: on
+    battery (UPower OnBattery, or psutil when UPower isn't available) and idle (screensaver active). When the factor
+    goes down (plugged in, screensaver off) the sleep is interrupted and an update is sent right away.
+    """
+
+    def __init__(self, companion: Companion, api: API, manager: SensorManager) -> None:
+        self.companion = companion
+        self.api = api
+        self.manager = manager
+        self.polling = True
+        self.resuming: Optional[asyncio.Task] = None
+        self.on_battery = False
+        self.idle = False
+        # Where the power source comes from: upower (signals), psutil (checked every update) or None (no battery)
+        self.power_source: Optional[str] = "psutil"
+        self.wakeup = asyncio.Event()
+        # Worker process sampling some of the sensors, it samples at the same interval
+        self.sampler: Optional["SamplerProcess"] = None
+
+    async def init(self, dbus: Dbus) -> None:
+        await dbus.register_signal("system.login_on_prepare_for_sleep", self.on_prepare_for_sleep)
+        await dbus.register_signal("session.screensaver_on_active_changed", self.on_screensaver_active_changed)
+        await dbus.register_signal("session.gnome_screensaver_on_active_changed", self.on_screensaver_active_changed)
+        upower = await dbus.get_interface(UPOWER_INTERFACE)
+        if upower is not None and await dbus.register_signal(
+            "system.upower_on_properties_changed", self.on_upower_properties_changed
+        ):
+            self.power_source = "upower"
+            self.rescale(on_battery=await upower.get_on_battery())
+
+    def rescale(self, on_battery: Optional[bool] = None, idle: Optional[bool] = None) -> None:
+        """Update the power and idle state and the interval multiplier, waking up the loop if it went down"""
+        if on_battery is not None:
+            self.on_battery = on_battery
+        if idle is not None:
+            self.idle = idle
+        polling = self.companion.polling
+        factors = [1.0]
+        if self.on_battery:
+            factors.append(polling.battery)
+        if self.idle:
+            factors.append(polling.idle)
+        scale, previous = max(factors), self.manager.scale
+        if scale != previous:
+            logger.info("Update interval x%s (on battery:%s, idle:%s)", scale, self.on_battery, self.idle)
+            self.manager.scale = scale
+        if scale < previous:
+            self.wakeup.set()
+
+    def check_battery(self) -> None:
+        """Power source from psutil, used when UPower isn't available"""
+        import psutil
+
+        battery = psutil.sensors_battery()
+        if battery is None:
+            self.power_source = None
+        else:
+            self.rescale(on_battery=not battery.power_plugged)
+
+    def on_upower_properties_changed(self, interface: str, changed: Dict[str, Variant], invalidated: List[str]) -> None:
+        if "OnBattery" in changed:
+            self.rescale(on_battery=changed["OnBattery"].value)
+
+    def on_screensaver_active_changed(self, v: bool) -> None:
+        self.rescale(idle=v)
+
+    def on_prepare_for_sleep(self, v: bool) -> None:
+        """Handles the PrepareForSleep signal, it's synchronous so it runs before the sensors handlers push updates
+
+        :param v: True if going to sleep, False if waking up from it
+        """
+        if self.resuming is not None:
+            self.resuming.cancel()
+            self.resuming = None
+        if self.sampler is not None:
+            self.sampler.suspend(v)
+        if v:
+            logger.info("Going to sleep, pausing sensor updates")
+            self.polling = False
+        else:
+            self.manager.hold()
+            self.resuming = asyncio.create_task(self.resume())
+
+    async def wait_for_network(self) -> None:
+        """Wait until Home Assistant answers, the network usually takes a few seconds to come back after resuming"""
+        delay = PROBE_DELAY
+        while not await self.api.probe(PROBE_TIMEOUT):
+            logger.info("Home Assistant not reachable yet, retrying in %ss", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.companion.refresh_interval)
+
+    async def resume(self) -> None:
+        logger.info("Woke up, waiting for the network to send the sensors")
+        await self.wait_for_network()
+        if self.sampler is not None:
+            await self.sampler.tick()  # Samples from after waking up
+        self.resuming = None
+        self.polling = True
+        self.manager.catch_up()
+
+    async def run(self) -> None:
+        """Loop forever updating sensors, the interval is read every time since it can change on a reload"""
+        while True:
+            self.wakeup.clear()
+            if self.power_source == "psutil":
+                self.check_battery()
+            else:
+                self.rescale()  # The factors can change on a reload
+            if self.sampler is not None:
+                self.sampler.control(self.companion.refresh_interval, self.manager.scale)
+            if self.polling:
+                if self.sampler is not None:
+                    await self.sampler.tick()  # Fresh samples of the worker process
+                # Sending happens in the manager sender, a slow Home Assistant doesn't delay the next sample
+                self.manager.collect()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.companion.refresh_interval * self.manager.scale)
+            except asyncio.TimeoutError:
+                pass
@@ -1,49 +1,118 @@
-from types import MethodType
-from halinuxcompanion.api import API
-from halinuxcompanion.dbus import Dbus
+from halinuxcompanion.companion import ReportPolicyConfig
+from halinuxcompanion.recorder import RECORDER, PeriodicSummary
 from aiohttp import ClientError
-from typing import Union, List, Dict, Callable
-from functools import partial, update_wrapper
+from typing import Callable, ClassVar, Union, List, Dict, Optional, Tuple, Type, TYPE_CHECKING
+from functools import partial
 import json
 import logging
 import asyncio
+import time
+
+if TYPE_CHECKING:
+    from halinuxcompanion.api import API
+    from halinuxcompanion.dbus import Dbus
 
 logger = logging.getLogger(__name__)
 
 SC_REGISTER_SENSOR = 301
 
 
+INSTANCE_FIELDS = ("unique_id", "name", "icon", "state", "attributes")
+# Signals of sensors that stop sampling while the system is suspended or shutting down, see Sensor.on_suspend
+SUSPEND_SIGNALS = {
+    "system.login_on_prepare_for_sleep": "on_suspend",
+    "system.login_on_prepare_for_shutdown": "on_suspend",
+}
+
+
 class Sensor:
-    """Standard sensor class"""
-
-    instances = []
-
-    def __init__(self):
-        self.config_name: str
-        self.attributes: dict = {}
-        self.device_class: str = ""
-        self.state_class: str = ""
-        self.icon: str
-        self.name: str
-        self.state: Union[str, int, float] = ""
-        self.type: str
-        self.unique_id: str
-        self.unit_of_measurement: str = ""
-        self.state_class: str = ""
-        self.entity_category: str = ""
-        self.type: str
-        # Signal name (halinuxcompanion.dbus) and it's callback
-        self.signals: Dict[str, Callable] = {}
-        Sensor.instances.append(self)
-
-    # TODO: Should be async
-    def updater(self) -> None:
-        """To be called every time update is called"""
+    """Base sensor class
+    A sensor type is a subclass that declares its Home Assistant fields as class attributes and implements the hooks:
+        - sample(): Refresh the state and attributes, called before every update unless the sensor is suspended.
+        - create(options): Instances of the type, called once at startup with the sensor options from the configuration.
+          One instance by default, sensors reporting several devices return one instance per device.
+        - signals: Signal alias (defined in halinuxcompanion.dbus) to the name of the method handling it.
+        - tasks: Names of coroutine methods run in the background for the lifetime of the sensor.
+        - isolated: The sensor can be sampled in the sampler worker process (see halinuxcompanion.sampler), it only
+          reads the system and doesn't need the dbus signals or the manager (besides the sampling scale).
+        - pushed: The sensor is sent only when it's pushed (see SensorManager.push), the periodic updates skip it.
+    The instance fields (unique_id, name, icon, state, attributes) declared in the class are the initial values of
+    every instance, they can be overridden as keyword arguments. Subclasses declare __slots__ for any other instance
+    state they need.
+    """
+
+    __slots__ = INSTANCE_FIELDS + ("suspended", "manager")
+
+    # Sensor types by config_name, populated when the sensor modules are imported
+    types: ClassVar[Dict[str, Type["Sensor"]]] = {}
+    defaults: ClassVar[dict] = {"unique_id": "", "name": "", "icon": "", "state": "", "attributes": {}}
+
+    config_name: ClassVar[str] = ""
+    type: ClassVar[str] = "sensor"
+    device_class: ClassVar[str] = ""
+    state_class: ClassVar[str] = ""
+    unit_of_measurement: ClassVar[str] = ""
+    entity_category: ClassVar[str] = ""
+    signals: ClassVar[Dict[str, str]] = {}
+    tasks: ClassVar[Tuple[str, ...]] = ()
+    isolated: ClassVar[bool] = False
+    pushed: ClassVar[bool] = False
+
+    unique_id: str
+    name: str
+    icon: str
+    state: Union[str, int, float]
+    attributes: dict
+    suspended: bool
+    manager: Optional["SensorManager"]
+
+    def __init_subclass__(cls, register: bool = True, **kwargs) -> None:
+        """Move the declared instance fields into the defaults (the class attributes would hide the slots), and
+        register the sensor type if it declares its own config_name.
+
+        :param register: False for sensors created by another type of the same config_name (e.g. one per device)
+        """
+        super().__init_subclass__(**kwargs)
+        cls.defaults = dict(cls.defaults)
+        for field in INSTANCE_FIELDS:
+            if field in cls.__dict__:
+                cls.defaults[field] = cls.__dict__[field]
+                delattr(cls, field)
+        if register and "config_name" in cls.__dict__:
+            Sensor.types[cls.config_name] = cls
+
+    def __init__(self, **fields) -> None:
+        for field, default in self.defaults.items():
+            value = fields.get(field, default)
+            # Every instance gets its own attributes
+            setattr(self, field, dict(value) if field == "attributes" else value)
+        self.suspended = False
+        self.manager = None
+
+    @classmethod
+    def create(cls, options: dict) -> List["Sensor"]:
+        """Instances of the sensor type, called once at startup with the sensor options from the configuration"""
+        return [cls()]
+
+    def sample(self) -> None:
+        """Refresh the state and attributes, called before every update"""
         pass
 
-    def update(self) -> dict:
+    async def on_suspend(self, v: bool) -> None:
+        """Handler for system sleep and shutdown events, sensors listing SUSPEND_SIGNALS stop sampling until resumed.
+        https://www.freedesktop.org/software/systemd/man/org.freedesktop.login1.html
+
+        :param v: True if going to sleep (shutting down), False if waking up from it (powering on)
+        """
+        self.suspended = v
+        if v:
+            self.state = "unavailable"
+
+    def stop(self) -> None:
+        """Release what the sensor holds (files, devices), called when the sensor is stopped by a reload"""
+
+    def payload(self) -> dict:
         """Payload to update the sensor"""
-        self.updater()
         return {
             "attributes": self.attributes,
             "icon": self.icon,
@@ -52,9 +121,8 @@ class Sensor:
             "unique_id": self.unique_id,
         }
 
-    def register(self) -> dict:
-        self.updater()
-        """Payload to register the sensor"""
+    def registration(self) -> dict:
+        """Payload to register the sensor, empty fields are left out"""
         data = {
             "attributes": self.attributes,
             "device_class": self.device_class,
@@ -67,46 +135,159 @@ class Sensor:
             "state_class": self.state_class,
             "entity_category": self.entity_category,
         }
-        pop = []
-        for key in data:
-            if data[key] == "":
-                pop.append(key)
-        [data.pop(key) for key in pop]
-        return data
-
-    def update(self) -> dict:
-        """Payload to update the sensor"""
-        self.updater()
-        return {
-            "attributes": self.attributes,
-            "icon": self.icon,
-            "state": self.state,
-            "type": self.type,
-            "unique_id": self.unique_id,
-        }
+        return {key: value for key, value in data.items() if value != ""}
+
+
+class PropertiesSensor(Sensor, register=False):
+    """Sensor updated from the properties of a dbus object instead of sampling.
+    The properties are read once by the read_properties task, then followed with the PropertiesChanged signal of the
+    object (see halinuxcompanion.dbus.properties_signal), the sensor is sent only when update() reports a change.
+    The service is followed with its NameOwnerChanged signal (see halinuxcompanion.dbus.owner_signal), the properties
+    are read again when it appears or restarts, and the sensor is unavailable while it's gone.
+    Subclasses implement update(), and can sample on their own as a fallback while the object isn't read (connected).
+    """
+
+    __slots__ = ("location", "connected")
+
+    tasks = ("read_properties",)
+
+    def __init__(self, location: Tuple[str, str, str, str], **fields) -> None:
+        """:param location: Bus (system or session), service, path and interface of the object"""
+        super().__init__(**fields)
+        self.location = location
+        self.connected = False
+
+    @property
+    def pushed(self) -> bool:
+        """Once the object is read the sensor is only sent when its properties change"""
+        return self.connected
+
+    def update(self, properties: dict) -> bool:
+        """Update the state from the properties, the ones read or the ones that changed
+
+        :return: True if the state or attributes changed, by default the properties don't change the sensor
+        """
+        return False
+
+    async def read_properties(self) -> None:
+        properties = await self.manager.dbus.get_properties(*self.location)
+        if properties is not None:
+            self.connected = True
+            self.update(properties)
+            self.manager.push(self)
+
+    async def on_owner_changed(self, service: str, old_owner: str, new_owner: str) -> bool:
+        """Handler for the NameOwnerChanged signal of the service
+
+        :return: False if the properties are read again, read_properties sends the sensor
+        """
+        if new_owner:
+            await self.read_properties()
+            return False
+        self.connected = False
+        self.state = "unavailable"
+        return True
+
+    async def on_properties_changed(self, interface: str, changed: dict, invalidated: list) -> bool:
+        """Handler for the PropertiesChanged signal of the object
+
+        :return: False if the sensor didn't change, so it isn't sent
+        """
+        if not self.connected or interface != self.location[3]:
+            return False
+        return self.update({name: variant.value for name, variant in changed.items()})
+
+
+class ReportPolicy:
+    """Decides if a sensor update is meaningful enough to be sent to Home Assistant
+    - deadband: Minimum change of a numeric state, absolute or relative to the last reported state. When set, changes
+      in the attributes alone are not reported (they are sent along the next state change).
+    - min_interval: Minimum seconds between reports.
+    - heartbeat: Maximum seconds without a report, even if nothing changed, so Home Assistant knows the device is alive.
+    """
+
+    def __init__(self, config: ReportPolicyConfig) -> None:
+        self.deadband = config.deadband
+        self.relative = config.relative
+        self.min_interval = config.min_interval
+        self.heartbeat = config.heartbeat
+
+    def changed(self, state, attributes: dict, last_state, last_attributes: dict) -> bool:
+        if self.deadband and is_number(state) and is_number(last_state):
+            threshold = self.deadband * abs(last_state) if self.relative else self.deadband
+            # A relative deadband around 0 is 0, any change is reported but not the same 0 again
+            return abs(state - last_state) >= threshold if threshold else state != last_state
+        return state != last_state or attributes != last_attributes
+
+    def should_report(self, sensor: Sensor, last: Optional[Tuple], now: float) -> bool:
+        """
+        :param sensor: The sensor, already updated
+        :param last: The last reported (state, attributes, time) of the sensor, None if it was never reported
+        :param now: Current time (monotonic)
+        """
+        if last is None:
+            return True
+        last_state, last_attributes, last_time = last
+        elapsed = now - last_time
+        if self.heartbeat and elapsed >= self.heartbeat:
+            return True
+        if elapsed < self.min_interval:
+            return False
+        return self.changed(sensor.state, sensor.attributes, last_state, last_attributes)
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
 
 class SensorManager:
     """Manages sensors registration, and updates to Home Assistant"""
 
-    api: API
+    api: "API"
     update_counter: int = 0
     sensors: List[Sensor] = []
-    dbus: Dbus
+    dbus: "Dbus"
+    tasks: Dict[str, List[asyncio.Task]]
 
-    def __init__(self, api: API, sensors: List[Sensor], dbus: Dbus) -> None:
+    def __init__(
+        self, api: "API", sensors: List[Sensor], dbus: "Dbus", policies: Dict[str, ReportPolicyConfig] = {}
+    ) -> None:
         self.api = api
         self.sensors = sensors
         self.dbus = dbus
+        # Background tasks and signal callbacks by sensor unique_id, so a single sensor can be stopped
+        self.tasks = {}
+        self.callbacks: Dict[str, List[Tuple[str, Callable]]] = {}
+        # Reporting policy by sensor config_name, sensors without one are reported on every update
+        self.policies = {name: ReportPolicy(config) for name, config in policies.items()}
+        # Last reported (state, attributes, time) by sensor unique_id
+        self.reported: Dict[str, Tuple] = {}
+        # Sensors created at runtime (e.g. a device was plugged), registered on the next update
+        self.adopted: List[Sensor] = []
+        # Latest payload of each sensor waiting to be sent by unique_id, held while the network isn't up (e.g. resuming
+        # from sleep), and the sensors update requests in flight with the payloads they carry
+        self.outbox: Dict[str, Tuple[Sensor, dict, float]] = {}
+        self.requests: Dict[asyncio.Task, Dict[str, Tuple[Sensor, dict, float]]] = {}
+        self.held = False
+        self.ready = asyncio.Event()
+        self.sending: Optional[asyncio.Task] = None
+        # Multiplier of the update and sampling intervals, set by the Scheduler (e.g. on battery or idle)
+        self.scale = 1.0
+        # The updates are recorded in the flight recorder, and only summarized in the log
+        self.summary = PeriodicSummary(logger, "Sensors updates")
+        for sensor in sensors:
+            sensor.manager = self
 
     async def register_sensors(self) -> bool:
         """Register all sensors with Home Assisntat
-        If all have been registered successfully, register each sensor signals
+        If all have been registered successfully, register each sensor signals and start their background tasks
         """
         res = await asyncio.gather(*[self._register_sensor(s) for s in self.sensors])
         if all(res):
             # If all sensors registered successfully, register their signals
             await self.register_signals()
+            self.start_tasks()
+            self.sending = asyncio.create_task(self.sender())
             return True
 
         return False
@@ -118,7 +299,8 @@ class SensorManager:
         :param sensor: The sensor to register
         :return: True if the registration was successful, False otherwise
         """
-        data = {"data": sensor.register(), "type": "register_sensor"}
+        sensor.sample()
+        data = {"data": sensor.registration(), "type": "register_sensor"}
         sname = sensor.config_name
         data = json.dumps(data)
         logger.info("Registering sensor:%s payload:%s", sname, data)
@@ -131,48 +313,143 @@ class SensorManager:
             logger.error('Sensor registration failed with status code:%s sensor:%s', res.status, sensor.unique_id)
             return False
 
-    async def update_sensors(self, sensors: List[Sensor] = []) -> bool:
-        """Update the given sensors with Home Assisntat
-        If the update fails it's an error and it should be retried by the caller.
+    def adopt(self, sensors: List[Sensor]) -> None:
+        """Take over sensors created at runtime, they are registered on the next update"""
+        for sensor in sensors:
+            sensor.manager = self
+        self.adopted.extend(sensors)
 
-        :param sensors: The sensors to update, if empty all sensors will be updated
-        :return: True if the update was successful, False otherwise
+    async def register_adopted(self) -> None:
+        """Register the adopted sensors, the ones that fail are retried on the next update"""
+        adopted, self.adopted = self.adopted, []
+        registered = []
+        for sensor in adopted:
+            try:
+                ok = await self._register_sensor(sensor)
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.error("Sensor registration failed with error:%s sensor:%s", e, sensor.unique_id)
+                ok = False
+            (registered if ok else self.adopted).append(sensor)
+
+        if registered:
+            self.sensors.extend(registered)
+            await self.register_signals(registered)
+            self.start_tasks(registered)
+
+    def collect(self, sensors: List[Sensor] = [], force: bool = False) -> None:
+        """Sample the given sensors and put the ones to report in the outbox, where the sender picks them up.
+        The outbox keeps only the latest payload of each sensor, and in-flight requests whose sensors all have a newer
+        payload are cancelled, there's no point in waiting for them. This never waits for the network.
+        Sensors with a reporting policy are only queued when the policy allows it, unless force is set.
+
+        :param sensors: The sensors to sample, if empty all sensors except the pushed ones (periodic update)
+        :param force: Queue the sensors regardless of their reporting policy
         """
-        sensors = sensors or self.sensors
+        now = time.monotonic()
+        periodic = not sensors and not force
+        for sensor in sensors or self.sensors:
+            if periodic and sensor.pushed:
+                continue
+            if not sensor.suspended:
+                sensor.sample()
+            if RECORDER.sink is not None:
+                RECORDER.record(
+                    "sample", sensor.unique_id, sensor.config_name, sensor.type, sensor.state,
+                    dict(sensor.attributes), force,
+                )
+            policy = self.policies.get(sensor.config_name)
+            if force or policy is None or policy.should_report(sensor, self.reported.get(sensor.unique_id), now):
+                payload = sensor.payload()
+                # The sensor keeps updating its attributes while the payload waits to be sent
+                payload["attributes"] = dict(payload["attributes"])
+                self.outbox[sensor.unique_id] = (sensor, payload, now)
+
+        if self.outbox:
+            for request, batch in self.requests.items():
+                if batch.keys() <= self.outbox.keys():
+                    request.cancel()
+            self.ready.set()
+
+    async def send(self) -> bool:
+        """Register the adopted sensors and send everything in the outbox in a single update.
+        If the update fails the payloads go back to the outbox, unless a newer one was queued meanwhile, and they are
+        sent with the next update.
+
+        :return: True if the update was successful (or there was nothing to send), False otherwise
+        """
+        if self.adopted:
+            await self.register_adopted()
+
+        if not self.outbox:
+            return True
+
+        batch, self.outbox = self.outbox, {}
         self.update_counter += 1
+        counter = self.update_counter
         data = {
             "type": "update_sensor_states",
-            "data": [sensor.update() for sensor in sensors],
+            "data": [payload for _, payload, _ in batch.values()],
         }
-        snames = [sensor.config_name for sensor in sensors]
-        logger.info("Sensors update %s with sensors: %s", self.update_counter, snames)
-        logger.debug(
-            "Sensors update %s with sensors: %s payload: %s",
-            self.update_counter,
-            snames,
-            data,
-        )
+        RECORDER.record("update", counter, data)
+        request = asyncio.create_task(self.api.webhook_post("update_sensors", data=json.dumps(data)))
+        self.requests[request] = batch
         try:
-            res = await self.api.webhook_post("update_sensors", data=json.dumps(data))
+            await asyncio.wait([request])
+        finally:
+            del self.requests[request]
+            request.cancel()
+
+        if request.cancelled():
+            # Superseded by newer values
+            RECORDER.record("cancelled", counter)
+            self.summary.count("cancelled")
+            return True
+        try:
+            res = request.result()
+            RECORDER.record("response", counter, res.status)
             if res.ok or res.status == SC_REGISTER_SENSOR:
-                logger.info("Sensors update %s successful", self.update_counter)
+                self.summary.count("sent")
+                for unique_id, (_, payload, now) in batch.items():
+                    self.reported[unique_id] = (payload["state"], payload["attributes"], now)
                 return True
             else:
                 logger.error(
                     "Sensors update %s failed with status code:%s",
-                    self.update_counter,
+                    counter,
                     res.status,
                 )
-        except ClientError as e:
+        except (ClientError, asyncio.TimeoutError) as e:
+            RECORDER.record("error", counter, str(e) or "timeout")
             logger.error(
-                "Sensors update %s failed with error:%s", self.update_counter, e
+                "Sensors update %s failed with error:%s", counter, str(e) or "timeout"
             )
 
+        self.summary.count("failed")
+        RECORDER.dump_on_error()
+        for unique_id, entry in batch.items():
+            self.outbox.setdefault(unique_id, entry)
         return False
 
-    async def _signal_handler(
-        self, signal_alias: str, signal_handler: Callable, sensor: Sensor, *args
-    ) -> None:
+    async def sender(self) -> None:
+        """Send the outbox whenever something is queued, one request at a time, while the manager isn't held"""
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if not self.held:
+                await self.send()
+
+    async def update_sensors(self, sensors: List[Sensor] = [], force: bool = False) -> bool:
+        """Update the given sensors with Home Assisntat, waiting for the request.
+        Used when the caller needs the result, the periodic updates go through collect and the sender.
+
+        :param sensors: The sensors to update, if empty all sensors will be updated
+        :param force: Send the sensors regardless of their reporting policy
+        :return: True if the update was successful (or there was nothing to send), False otherwise
+        """
+        self.collect(sensors, force)
+        return await self.send()
+
+    async def _signal_handler(self, sensor: Sensor, signal_alias: str, handler: str, *args) -> None:
         """Signal handler for the sensor manager
         Each sensor can have multiple signals, at the moment defined in halinuxcompanion.dbus, the callback provided for
         the signal is this function wrapped in a functools.partial this allows for the SensorManager to be in charge of
@@ -180,19 +457,83 @@ class SensorManager:
 
         :param sensor: The sensor that the signal belongs to
         :param signal_alias: The signal alias (defined in halinuxcompanion.dbus)
-        :param signal_handler: The signal handler (defined by the sensor in sensor.signals)
+        :param handler: The name of the sensor method handling the signal (defined by the sensor in sensor.signals)
         :param args: The arguments to pass to the signal handler (coming from the dbus signal)
+        The sensor is pushed unless the handler returns False, for signals that didn't change it (e.g. a signal received
+        for every systemd unit).
+        """
+        RECORDER.record("signal", signal_alias, sensor.unique_id, args)
+        # Some signals come for every change of every object (e.g. systemd units), they're only counted in the summary
+        self.summary.count("signals")
+        if await getattr(sensor, handler)(*args) is not False:
+            logger.debug("Signal %s pushed sensor:%s", signal_alias, sensor.unique_id)
+            self.push(sensor)
+
+    def push(self, sensor: Sensor) -> None:
+        """Send a sensor as soon as possible regardless of its reporting policy.
+        Sensors pushed together (e.g. several sensors handling the same signal) are sent in a single update, since the
+        sender only runs once the handlers are done. While the manager is held they wait in the outbox.
         """
-        logger.info("Signal %s received for sensor:%s", signal_alias, sensor.unique_id)
-        await signal_handler(sensor, *args)
-        await self.update_sensors([sensor])
+        self.collect([sensor], force=True)
 
-    async def register_signals(self) -> None:
-        """Register all signals from all sensors.
-        Each sensor defines signals with a name and callback, which is called by self._signal_handler
+    def hold(self) -> None:
+        """Keep the outbox instead of sending it, until catch_up is called"""
+        self.held = True
+
+    def catch_up(self) -> None:
+        """Send every sensor in a single update, along with the ones pushed while the manager was held"""
+        self.held = False
+        self.collect(force=True)
+
+    async def register_signals(self, sensors: List[Sensor] = []) -> None:
+        """Register all signals from the given sensors.
+        Each sensor defines signals with a name and method, which is called by self._signal_handler
+
+        :param sensors: The sensors to register signals for, if empty all sensors
         """
-        for sensor in self.sensors:
-            for signal_alias, signal_handler in sensor.signals.items():
-                callback = partial(self._signal_handler, signal_alias, signal_handler)
-                callback = MethodType(update_wrapper(callback, signal_handler), sensor)
+        for sensor in sensors or self.sensors:
+            for signal_alias, handler in sensor.signals.items():
+                callback = partial(self._signal_handler, sensor, signal_alias, handler)
                 await self.dbus.register_signal(signal_alias, callback)
+                self.callbacks.setdefault(sensor.unique_id, []).append((signal_alias, callback))
+
+    def start_tasks(self, sensors: List[Sensor] = []) -> None:
+        """Start the background tasks of the given sensors.
+        A reference to each task is kept, otherwise the event loop could garbage collect them.
+
+        :param sensors: The sensors to start tasks for, if empty all sensors
+        """
+        for sensor in sensors or self.sensors:
+            for task in sensor.tasks:
+                logger.info("Starting task %s for sensor:%s", task, sensor.unique_id)
+                self.tasks.setdefault(sensor.unique_id, []).append(asyncio.create_task(getattr(sensor, task)()))
+
+    def set_policies(self, policies: Dict[str, ReportPolicyConfig]) -> None:
+        """Replace the reporting policies, the last reported values are kept"""
+        self.policies = {name: ReportPolicy(config) for name, config in policies.items()}
+
+    async def stop_sensors(self, names: List[str]) -> None:
+        """Stop every sensor created from the given config names: cancel their tasks, unregister their signals and
+        report them unavailable one last time, mobile_app has no way to unregister a sensor.
+
+        :param names: The config names (e.g. cpu, hwmon) of the sensors to stop
+        """
+        stopped = [s for s in self.sensors if s.config_name in names]
+        self.sensors = [s for s in self.sensors if s.config_name not in names]
+        self.adopted = [s for s in self.adopted if s.config_name not in names]
+        for sensor in stopped:
+            self.outbox.pop(sensor.unique_id, None)
+            logger.info("Stopping sensor:%s", sensor.unique_id)
+            for task in self.tasks.pop(sensor.unique_id, []):
+                task.cancel()
+            for signal_alias, callback in self.callbacks.pop(sensor.unique_id, []):
+                self.dbus.unregister_signal(signal_alias, callback)
+            sensor.stop()
+            # Suspended sensors aren't sampled, so the state stays unavailable
+            sensor.suspended = True
+            sensor.state = "unavailable"
+
+        if stopped:
+            await self.update_sensors(stopped, force=True)
+        for sensor in stopped:
+            self.reported.pop(sensor.unique_id, None)
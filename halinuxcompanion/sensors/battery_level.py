@@ -1,32 +1,60 @@
-from types import MethodType
-from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.sensor import PropertiesSensor
+from halinuxcompanion.dbus import UPOWER_DISPLAY_DEVICE, owner_signal, properties_signal
+from typing import List
 import psutil
 
-BatteryLevel = Sensor()
-BatteryLevel.config_name = "battery_level"
-BatteryLevel.attributes = {
-        "time_left": "",
-}
 
-BatteryLevel.device_class = "battery"
-BatteryLevel.state_class = "measurement"
-BatteryLevel.icon = "mdi:battery"
-BatteryLevel.name = "Battery Level"
-BatteryLevel.state = "unavailable"
-BatteryLevel.type = "sensor"
-BatteryLevel.unique_id = "battery_level"
-BatteryLevel.unit_of_measurement = "%"
+def time_left(seconds: int) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+class BatteryLevel(PropertiesSensor):
+    """Pushed from the UPower battery summary when UPower is available, psutil is polled otherwise"""
 
+    __slots__ = ()
+
+    config_name = "battery_level"
+    device_class = "battery"
+    state_class = "measurement"
+    unit_of_measurement = "%"
+    signals = {
+        properties_signal(*UPOWER_DISPLAY_DEVICE): "on_properties_changed",
+        owner_signal(*UPOWER_DISPLAY_DEVICE[:2]): "on_owner_changed",
+    }
+
+    unique_id = "battery_level"
+    name = "Battery Level"
+    icon = "mdi:battery"
+    state = "unavailable"
+    attributes = {
+        "time_left": "",
+    }
 
-def updater(self):
-    data = psutil.sensors_battery()
-    if data is not None:
-        minutes, seconds = divmod(data.secsleft, 60)
-        hours, minutes = divmod(minutes, 60)
+    @classmethod
+    def create(cls, options: dict) -> List["BatteryLevel"]:
+        return [cls(UPOWER_DISPLAY_DEVICE)]
 
-        self.state = round(data.percent)
-        self.icon = "mdi:battery-%d0" % round(data.percent / 10)
-        self.attributes["time_left"] = "%d:%02d:%02d" % (hours, minutes, seconds)
+    def set_level(self, percent: float) -> None:
+        self.state = round(percent)
+        self.icon = "mdi:battery-%d0" % round(percent / 10)
 
+    def update(self, properties: dict) -> bool:
+        """Properties of org.freedesktop.UPower.Device: IsPresent, Percentage and TimeToEmpty (seconds)"""
+        previous = (self.state, self.attributes["time_left"])
+        if properties.get("IsPresent") is False:
+            self.state = "unavailable"
+        elif "Percentage" in properties:
+            self.set_level(properties["Percentage"])
+        if "TimeToEmpty" in properties:
+            self.attributes["time_left"] = time_left(properties["TimeToEmpty"])
+        return (self.state, self.attributes["time_left"]) != previous
 
-BatteryLevel.updater = MethodType(updater, BatteryLevel)
+    def sample(self) -> None:
+        if self.connected:
+            return
+        data = psutil.sensors_battery()
+        if data is not None:
+            self.set_level(data.percent)
+            self.attributes["time_left"] = time_left(data.secsleft)
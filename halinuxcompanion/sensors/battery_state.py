@@ -1,27 +1,53 @@
-from types import MethodType
-from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.sensor import PropertiesSensor
+from halinuxcompanion.dbus import UPOWER_DISPLAY_DEVICE, owner_signal, properties_signal
+from typing import List
 import psutil
 
-BatteryState = Sensor()
-BatteryState.config_name = "battery_state"
-BatteryState.attributes = {}
+# UPower Device State: charging and fully charged, pending charge (plugged in) or discharging, empty, pending
+# discharge. Unknown (0) is left out
+UPOWER_STATES = {1: True, 2: False, 3: False, 4: True, 5: True, 6: False}
 
-BatteryState.icon = "mdi:battery"
-BatteryState.name = "Battery State"
-BatteryState.state = "unavailable"
-BatteryState.type = "sensor"
-BatteryState.unique_id = "battery_state"
 
+class BatteryState(PropertiesSensor):
+    """Pushed from the UPower battery summary when UPower is available, psutil is polled otherwise"""
 
-def updater(self):
-    data = psutil.sensors_battery()
-    if data is not None:
-        if data.power_plugged:
+    __slots__ = ()
+
+    config_name = "battery_state"
+    signals = {
+        properties_signal(*UPOWER_DISPLAY_DEVICE): "on_properties_changed",
+        owner_signal(*UPOWER_DISPLAY_DEVICE[:2]): "on_owner_changed",
+    }
+
+    unique_id = "battery_state"
+    name = "Battery State"
+    icon = "mdi:battery"
+    state = "unavailable"
+
+    @classmethod
+    def create(cls, options: dict) -> List["BatteryState"]:
+        return [cls(UPOWER_DISPLAY_DEVICE)]
+
+    def set_plugged(self, plugged: bool) -> None:
+        if plugged:
             self.state = "charging"
             self.icon = "mdi:battery-plus"
         else:
             self.state = "discharging"
             self.icon = "mdi:battery-minus"
 
+    def update(self, properties: dict) -> bool:
+        """Properties of org.freedesktop.UPower.Device: IsPresent and State"""
+        previous = self.state
+        if properties.get("IsPresent") is False:
+            self.state = "unavailable"
+        elif properties.get("State") in UPOWER_STATES:
+            self.set_plugged(UPOWER_STATES[properties["State"]])
+        return self.state != previous
 
-BatteryState.updater = MethodType(updater, BatteryState)
+    def sample(self) -> None:
+        if self.connected:
+            return
+        data = psutil.sensors_battery()
+        if data is not None:
+            self.set_plugged(data.power_plugged)
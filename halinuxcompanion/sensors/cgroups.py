@@ -0,0 +1,255 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.devices import Counters, Selector
+from halinuxcompanion.inotify import IN_CREATE, IN_DELETE, IN_ISDIR, IN_ONLYDIR, IN_Q_OVERFLOW, Inotify
+from halinuxcompanion.procfs import ProcFile
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_ONLYDIR
+STAT_SIZE = 512
+
+
+def parse_usage(buffer: bytearray, length: int) -> int:
+    """usage_usec of cpu.stat, it's the first line"""
+    return int(buffer[:length].split(None, 2)[1])
+
+
+def parse_io(buffer: bytearray, length: int) -> Tuple[int, int, int, int]:
+    """Read bytes, written bytes, reads and writes of io.stat, summed over the devices"""
+    rbytes = wbytes = rios = wios = 0
+    for line in buffer[:length].splitlines():
+        for field in line.split()[1:]:
+            key, _, value = field.partition(b"=")
+            if key == b"rbytes":
+                rbytes += int(value)
+            elif key == b"wbytes":
+                wbytes += int(value)
+            elif key == b"rios":
+                rios += int(value)
+            elif key == b"wios":
+                wios += int(value)
+    return rbytes, wbytes, rios, wios
+
+
+def optional_file(path: str, size: int) -> Optional[ProcFile]:
+    try:
+        return ProcFile(path, size)
+    except OSError:
+        return None
+
+
+class Cgroup(Sensor, register=False):
+    """CPU usage of a cgroup (percent of one cpu), with its memory and io, read by Cgroups on every update.
+    The files are kept open while the cgroup exists, io.stat and memory.current are missing if the io and memory
+    controllers aren't enabled for the cgroup.
+    """
+
+    __slots__ = ("key", "cpu", "io", "memory")
+
+    config_name = "cgroups"
+    state_class = "measurement"
+    unit_of_measurement = "%"
+
+    icon = "mdi:application-cog"
+    state = "unavailable"
+    attributes = {"memory": 0, "io_read": 0, "io_write": 0, "io_read_iops": 0, "io_write_iops": 0}
+
+    def __init__(self, key: str, **fields) -> None:
+        super().__init__(**fields)
+        self.key = key
+        self.cpu: Optional[ProcFile] = None
+        self.io: Optional[ProcFile] = None
+        self.memory: Optional[ProcFile] = None
+
+    def open(self, path: str) -> None:
+        self.cpu = ProcFile(os.path.join(path, "cpu.stat"), STAT_SIZE)
+        self.io = optional_file(os.path.join(path, "io.stat"), STAT_SIZE)
+        self.memory = optional_file(os.path.join(path, "memory.current"), 32)
+
+    def close(self) -> None:
+        for file in (self.cpu, self.io, self.memory):
+            if file is not None:
+                file.close()
+        self.cpu = self.io = self.memory = None
+
+    def read(self) -> Optional[Tuple[int, int, int, int, int]]:
+        """:return: (cpu usage µs, read bytes, written bytes, reads, writes), None if the cgroup can't be read"""
+        try:
+            buffer = self.cpu.read()
+            usage = parse_usage(buffer, self.cpu.length)
+            io = (0, 0, 0, 0)
+            if self.io is not None:
+                buffer = self.io.read()
+                io = parse_io(buffer, self.io.length)
+            if self.memory is not None:
+                buffer = self.memory.read()
+                self.attributes["memory"] = round(int(buffer[:self.memory.length]) / 1024 / 1024, 1)
+        except (OSError, ValueError, IndexError):
+            # The cgroup was removed since the last discovery
+            return None
+        return (usage, *io)
+
+
+class Cgroups(Sensor):
+    """Number of cgroups reported, it discovers the cgroup v2 hierarchy and creates one sensor for each selected cgroup.
+    The tree is walked once, then directories created and removed are followed with inotify, so the cost of an update
+    doesn't depend on the size of the tree. Without inotify the tree is walked again on every update.
+    """
+
+    __slots__ = ("selected", "depth", "watcher", "cgroups", "known", "counters")
+
+    config_name = "cgroups"
+    state_class = "measurement"
+
+    unique_id = "cgroups"
+    name = "Cgroups"
+    icon = "mdi:application-cog-outline"
+    state = 0
+
+    def __init__(self, selected: Selector, depth: int, **fields) -> None:
+        super().__init__(**fields)
+        self.selected = selected
+        self.depth = depth
+        self.watcher: Optional[Inotify] = None
+        self.cgroups: Dict[str, Cgroup] = {}  # Cgroups currently open, by path relative to the root
+        self.known: Dict[str, Cgroup] = {}  # Every cgroup ever selected, kept after it's removed (e.g. restarts)
+        self.counters = Counters()
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            include: Patterns of the cgroup paths to report, relative to the root, e.g. "system.slice/*.service"
+                (default the services and the containers/virtual machines of systemd-machined)
+            exclude: Patterns of the cgroups to ignore
+            depth: Levels of the hierarchy discovered (default 3)
+        """
+        include = options.get("include", ["system.slice/*.service", "machine.slice/*"])
+        cgroups = cls(Selector(include, options.get("exclude", [])), options.get("depth", 3))
+        if not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+            logger.warning("No cgroup v2 hierarchy in %s, no cgroups are reported", CGROUP_ROOT)
+            cgroups.depth = 0  # Nothing to walk
+            return [cgroups]
+        try:
+            cgroups.watcher = Inotify()
+        except OSError as e:
+            logger.warning("inotify not available, the cgroup tree is walked on every update: %s", e)
+        new = cgroups.discover("")
+        return [cgroups, *new]
+
+    def discover(self, key: str) -> List[Cgroup]:
+        """Walk the tree from a cgroup (relative path, "" for the root), watching the directories and opening the
+        selected cgroups.
+
+        :return: The cgroups selected for the first time
+        """
+        new = []
+        path = os.path.join(CGROUP_ROOT, key)
+        level = key.count("/") + 1 if key else 0
+        if self.watcher is not None and level < self.depth:
+            try:
+                self.watcher.add_watch(path, WATCH_MASK)
+            except OSError as e:
+                logger.debug("Could not watch cgroup %s: %s", key, e)
+        if key and self.selected(key) and key not in self.cgroups:
+            cgroup = self.known.get(key)
+            if cgroup is None:
+                unique_id = "cgroup_" + re.sub(r"[^a-z0-9]+", "_", key.lower()).strip("_")
+                cgroup = Cgroup(key, unique_id=unique_id, name=f"Cgroup {key}")
+            try:
+                cgroup.open(path)
+                self.cgroups[key] = cgroup
+                if key not in self.known:
+                    self.known[key] = cgroup
+                    new.append(cgroup)
+            except OSError as e:
+                logger.debug("Could not open cgroup %s: %s", key, e)
+        if level < self.depth:
+            try:
+                entries = sorted(entry.name for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                entries = []
+            for entry in entries:
+                new.extend(self.discover(f"{key}/{entry}" if key else entry))
+        return new
+
+    def remove(self, key: str) -> None:
+        """Close a removed cgroup and the ones below it"""
+        for child in [k for k in self.cgroups if k == key or k.startswith(key + "/")]:
+            cgroup = self.cgroups.pop(child)
+            cgroup.close()
+            cgroup.state = "unavailable"
+            # A cgroup created again with the same path (e.g. a restarted service) starts its counters from zero
+            if self.counters.previous is not None:
+                self.counters.previous.pop(child, None)
+
+    def walk(self) -> List[Cgroup]:
+        """Walk the whole tree again, the cgroups still there are kept open with their counters, the ones gone are
+        removed
+
+        :return: The cgroups selected for the first time
+        """
+        for key in list(self.cgroups):
+            if not os.path.isdir(os.path.join(CGROUP_ROOT, key)):
+                self.remove(key)
+        return self.discover("")
+
+    def update_tree(self) -> List[Cgroup]:
+        """Apply the changes of the tree since the last update
+
+        :return: The cgroups selected for the first time
+        """
+        if self.watcher is None:
+            return self.walk()
+
+        new = []
+        for path, mask, name in self.watcher.read():
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("Too many cgroup changes at once, walking the tree again")
+                self.watcher.close()
+                self.watcher = Inotify()
+                return new + self.walk()
+            if not (mask & IN_ISDIR) or not path:
+                continue
+            key = os.path.relpath(os.path.join(path, name), CGROUP_ROOT)
+            if mask & IN_CREATE:
+                new.extend(self.discover(key))
+            elif mask & IN_DELETE:
+                self.remove(key)
+        return new
+
+    def stop(self) -> None:
+        for cgroup in self.cgroups.values():
+            cgroup.close()
+        self.cgroups.clear()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def sample(self) -> None:
+        """Read every cgroup once, the cgroup sensors are updated here, so they don't need to sample on their own"""
+        new = self.update_tree()
+        if new and self.manager is not None:
+            self.manager.adopt(new)
+
+        snapshot = {}
+        for key, cgroup in list(self.cgroups.items()):
+            counters = cgroup.read()
+            if counters is None:
+                self.remove(key)
+            else:
+                snapshot[key] = counters
+
+        for key, (usage, rbytes, wbytes, rios, wios) in self.counters.rates(snapshot).items():
+            cgroup = self.cgroups[key]
+            cgroup.state = round(usage / 10000, 1)  # µs per second to percent
+            cgroup.attributes["io_read"] = round(rbytes / 1024, 1)
+            cgroup.attributes["io_write"] = round(wbytes / 1024, 1)
+            cgroup.attributes["io_read_iops"] = round(rios, 1)
+            cgroup.attributes["io_write_iops"] = round(wios, 1)
+
+        self.state = len(self.cgroups)
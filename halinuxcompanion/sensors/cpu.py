@@ -1,73 +1,130 @@
-from types import MethodType
-from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.sensor import SUSPEND_SIGNALS, Sensor
+from halinuxcompanion import procfs
+from array import array
+from math import ceil
+from typing import List, Sequence
+import asyncio
 import psutil
 import os
 
-load_average: bool = False
-allow_update: bool = True
+# Local sampling, the window is aggregated and reported every refresh_interval
+SAMPLE_INTERVAL: float = 0.25  # 4 Hz
+WINDOW_SIZE: int = 240  # Samples kept, one minute at 4 Hz
 
-Cpu = Sensor()
-Cpu.config_name = "cpu"
-Cpu.attributes = {
-    "cpu_count": psutil.cpu_count(logical=False),
-    "cpu_logical_count": psutil.cpu_count(),
-}
 
-if os.name == "posix":
-    load_average = True
+class RingBuffer:
+    """Fixed size ring buffer of cpu samples backed by flat arrays.
+    The per core samples are stored row by row (one row per sample), so the samples of a single core are a strided
+    slice of the array, which allows the aggregates to be computed with builtins instead of python loops.
+    """
 
-Cpu.device_class = "power_factor"
-Cpu.state_class = "measurement"
-Cpu.icon = "mdi:cpu-64-bit"
-Cpu.name = "CPU Load"
-Cpu.state = 0
-Cpu.type = "sensor"
-Cpu.unique_id = "cpu_load"
-Cpu.unit_of_measurement = "%"
+    def __init__(self, size: int, width: int) -> None:
+        self.size = size
+        self.width = width
+        self.totals = array("f", bytes(4 * size))
+        self.cores = array("f", bytes(4 * size * width))
+        self.index = 0
+        self.count = 0
 
+    def append(self, percpu: Sequence[float]) -> None:
+        start = self.index * self.width
+        self.cores[start:start + self.width] = array("f", percpu)
+        self.totals[self.index] = sum(percpu) / self.width
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
 
-async def on_prepare_for_sleep(self, v):
-    """Handler for system sleep and wake up from sleep events.
-    https://www.freedesktop.org/software/systemd/man/org.freedesktop.login1.html
+    def clear(self) -> None:
+        self.index = 0
+        self.count = 0
 
-    :param v: True if going to sleep, False if waking up from it
-    """
-    global allow_update
-    if v:
-        allow_update = False
-        self.state = "unavailable"
-    else:
-        allow_update = True
+    def aggregate(self) -> dict:
+        """Aggregates of the samples in the window: mean, max, p95 and the busiest core (highest mean load)"""
+        n, w = self.count, self.width
+        totals = self.totals[:n]
+        cores = self.cores[:n * w]
+        per_core = [sum(cores[c::w]) for c in range(w)]
+        busiest = max(range(w), key=per_core.__getitem__)
+        return {
+            "mean": round(sum(totals) / n, 1),
+            "window_max": round(max(totals), 1),
+            "window_p95": round(sorted(totals)[ceil(0.95 * n) - 1], 1),
+            "busiest_core": busiest,
+            "busiest_core_load": round(per_core[busiest] / n, 1),
+        }
 
 
-async def on_prepare_for_shutdown(self, v):
-    """Handler for system shutdown/reboot.
-    https://www.freedesktop.org/software/systemd/man/org.freedesktop.login1.html
+stat = procfs.procfile("/proc/stat")
+loadavg_file = procfs.procfile("/proc/loadavg") if os.path.exists("/proc/loadavg") else None
 
-    :param v: True if shutting down, False if powering on.
-    """
-    global allow_update
-    if v:
-        allow_update = False
-        self.state = "unavailable"
-    else:
-        allow_update = True
-
-
-def updater(self):
-    if not allow_update:
-        return
-
-    self.state = psutil.cpu_percent()
-    if load_average:
-        data = psutil.getloadavg()
-        self.attributes["load_1"] = data[0]
-        self.attributes["load_5"] = data[1]
-        self.attributes["load_15"] = data[2]
-
-
-Cpu.updater = MethodType(updater, Cpu)
-Cpu.signals = {
-    "system.login_on_prepare_for_sleep": on_prepare_for_sleep,
-    "system.login_on_prepare_for_shutdown": on_prepare_for_shutdown,
-}
+
+class Cpu(Sensor):
+    __slots__ = ("previous_times", "samples")
+
+    config_name = "cpu"
+    isolated = True
+    device_class = "power_factor"
+    state_class = "measurement"
+    unit_of_measurement = "%"
+    signals = SUSPEND_SIGNALS
+    tasks = ("sampler",)
+
+    unique_id = "cpu_load"
+    name = "CPU Load"
+    icon = "mdi:cpu-64-bit"
+    state = 0
+    attributes = {
+        "cpu_count": psutil.cpu_count(logical=False),
+        "cpu_logical_count": psutil.cpu_count(),
+    }
+
+    def __init__(self, **fields) -> None:
+        super().__init__(**fields)
+        self.previous_times = procfs.cpu_times(stat)
+        self.samples = RingBuffer(WINDOW_SIZE, len(self.previous_times) - 1)
+
+    def cpu_percent(self) -> List[float]:
+        """Load since the previous call, the aggregate of all cpus first followed by each online cpu"""
+        times = procfs.cpu_times(stat)
+        if len(times) != len(self.previous_times):
+            # A cpu went online/offline, start over
+            self.previous_times = times
+            return [0.0] * len(times)
+
+        percent = []
+        for (busy, total), (previous_busy, previous_total) in zip(times, self.previous_times):
+            delta = total - previous_total
+            percent.append(round((busy - previous_busy) / delta * 100, 1) if delta > 0 else 0.0)
+        self.previous_times = times
+        return percent
+
+    async def on_suspend(self, v: bool) -> None:
+        await super().on_suspend(v)
+        if not v:
+            self.samples.clear()
+
+    async def sampler(self) -> None:
+        """Sample the per core load every SAMPLE_INTERVAL seconds (scaled like the updates) into the ring buffer"""
+        self.cpu_percent()  # Sets the reference
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL * self.manager.scale)
+            if not self.suspended:
+                percpu = self.cpu_percent()[1:]
+                if len(percpu) != self.samples.width:
+                    self.samples = RingBuffer(WINDOW_SIZE, len(percpu))
+                self.samples.append(percpu)
+
+    def sample(self) -> None:
+        if self.samples.count:
+            window = self.samples.aggregate()
+            self.samples.clear()
+            self.state = window.pop("mean")
+            self.attributes.update(window)
+        else:
+            # No samples yet (registration or right after waking up)
+            self.state = self.cpu_percent()[0]
+
+        if loadavg_file is not None:
+            data = procfs.loadavg(loadavg_file)
+            self.attributes["load_1"] = data[0]
+            self.attributes["load_5"] = data[1]
+            self.attributes["load_15"] = data[2]
@@ -0,0 +1,78 @@
+from halinuxcompanion.sensor import PropertiesSensor
+from halinuxcompanion.dbus import owner_signal, properties_signal
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Home Assistant fields a configured property can set, besides unique_id, name and icon
+FIELDS = ("type", "device_class", "state_class", "unit_of_measurement", "entity_category")
+
+
+class DbusProperty(PropertiesSensor):
+    """A property of a dbus object, declared in the configuration, sent when its value changes"""
+
+    __slots__ = FIELDS + ("signals", "property", "values", "digits")
+
+    config_name = "dbus_property"
+
+    state = "unavailable"
+
+    def __init__(
+        self, location: tuple, property: str, values: Dict[str, str], digits: Optional[int], fields: dict, **kwargs
+    ) -> None:
+        super().__init__(location, **kwargs)
+        for field in FIELDS:
+            setattr(self, field, fields.get(field, getattr(PropertiesSensor, field)))
+        self.signals = {
+            properties_signal(*location): "on_properties_changed",
+            owner_signal(*location[:2]): "on_owner_changed",
+        }
+        self.property = property
+        self.values = values
+        self.digits = digits
+
+    @classmethod
+    def create(cls, options: dict) -> List["DbusProperty"]:
+        """Options:
+            properties: The properties to report, each with
+                unique_id, name, icon: Of the Home Assistant sensor
+                bus: system or session (default system)
+                service, path, interface, property: Where the property is published
+                values: State for each value of the property (e.g. enums), the other values are reported as they are
+                round: Digits numeric values are rounded to
+                type, device_class, state_class, unit_of_measurement, entity_category: Of the Home Assistant sensor
+        """
+        sensors = []
+        for config in options.get("properties", []):
+            try:
+                location = (config.get("bus", "system"), config["service"], config["path"], config["interface"])
+                sensor = cls(
+                    location,
+                    config["property"],
+                    {str(value): state for value, state in config.get("values", {}).items()},
+                    config.get("round"),
+                    config,
+                    unique_id=config["unique_id"],
+                    name=config.get("name", config["unique_id"]),
+                    icon=config.get("icon", "mdi:information-outline"),
+                )
+            except KeyError as e:
+                logger.error("dbus_property %s is missing the option %s", config.get("unique_id", config), e)
+                continue
+            sensors.append(sensor)
+        return sensors
+
+    def update(self, properties: dict) -> bool:
+        if self.property not in properties:
+            return False
+        value = properties[self.property]
+        if self.digits is not None and isinstance(value, float):
+            value = round(value, self.digits)
+        # Booleans are mapped by their JSON name, as they're written in the configuration
+        key = str(value).lower() if isinstance(value, bool) else str(value)
+        state = self.values.get(key, value)
+        if state == self.state:
+            return False
+        self.state = state
+        return True
@@ -0,0 +1,82 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.devices import Counters, Selector
+from halinuxcompanion import procfs
+from typing import List
+import os
+
+SECTOR_SIZE = 512  # /proc/diskstats always counts 512 bytes sectors
+
+diskstats = procfs.procfile("/proc/diskstats")
+
+
+def is_disk(name: str) -> bool:
+    """Whole disks are in /sys/block, partitions aren't"""
+    return os.path.exists("/sys/block/" + name.replace("/", "!"))
+
+
+class DiskIO(Sensor):
+    __slots__ = ("selected", "counters")
+
+    config_name = "disk_io"
+    isolated = True
+    device_class = "data_rate"
+    state_class = "measurement"
+    unit_of_measurement = "KiB/s"
+    signals = {
+        "system.login_on_prepare_for_sleep": "on_suspend",
+    }
+
+    unique_id = "disk_throughput"
+    name = "Disk Throughput"
+    icon = "mdi:harddisk"
+    state = 0
+
+    def __init__(self, selected: Selector, **fields) -> None:
+        super().__init__(**fields)
+        self.selected = selected
+        self.counters = Counters()
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            include: Disk name patterns to report (default all whole disks, partitions only if included explicitly)
+            exclude: Disk name patterns to ignore (default ["loop*", "ram*"])
+        """
+        include = options.get("include", [])
+        return [cls(Selector(include, options.get("exclude", ["loop*", "ram*"]), None if include else is_disk))]
+
+    async def on_suspend(self, v: bool) -> None:
+        await super().on_suspend(v)
+        if not v:
+            self.counters.reset()
+
+    def snapshot(self) -> dict:
+        """Reads, read sectors, writes and written sectors of the selected disks, from a single read of /proc/diskstats
+        https://www.kernel.org/doc/html/latest/admin-guide/iostats.html
+        """
+        buffer = diskstats.read()
+        data = {}
+        for line in buffer[:diskstats.length].splitlines():
+            values = line.split(None, 10)
+            name = values[2].decode()
+            if self.selected(name):
+                data[name] = (int(values[3]), int(values[5]), int(values[7]), int(values[9]))
+        return data
+
+    def sample(self) -> None:
+        rates = self.counters.rates(self.snapshot())
+        if not rates:
+            # First snapshot or waking up from suspend
+            return
+
+        total = 0.0
+        attributes = {}
+        for name, (reads, read_sectors, writes, written_sectors) in rates.items():
+            read, write = read_sectors * SECTOR_SIZE / 1024, written_sectors * SECTOR_SIZE / 1024
+            attributes[name + "_read"] = round(read, 1)
+            attributes[name + "_write"] = round(write, 1)
+            attributes[name + "_read_iops"] = round(reads, 1)
+            attributes[name + "_write_iops"] = round(writes, 1)
+            total += read + write
+        self.state = round(total, 1)
+        self.attributes = attributes
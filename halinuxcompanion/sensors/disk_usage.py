@@ -0,0 +1,231 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.devices import Selector
+from halinuxcompanion.procfs import ProcFile
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Set
+import logging
+import re
+import os
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MOUNTINFO = "/proc/self/mountinfo"
+# Filesystems without a block device that are still real storage
+NETWORK_FSTYPES = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "fuse.sshfs", "fuse.rclone"}
+# Filesystems with a block device that are always full or read only images
+SKIP_FSTYPES = {"squashfs", "iso9660", "udf", "erofs"}
+# Seconds a network mount can take to answer statvfs before it's reported unavailable
+NETWORK_TIMEOUT = 5
+GIB = 1024**3
+
+
+class Mount(NamedTuple):
+    device: str  # major:minor, bind mounts of the same filesystem share it
+    mountpoint: str
+    fstype: str
+    source: str
+
+
+def unescape(field: str) -> str:
+    """Mount points with spaces, tabs, ... are octal escaped (\\040)"""
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(data: bytes) -> List[Mount]:
+    """https://www.kernel.org/doc/html/latest/filesystems/proc.html#proc-pid-mountinfo-information-about-mounts"""
+    mounts = []
+    for line in data.decode(errors="replace").splitlines():
+        fields = line.split()
+        separator = fields.index("-", 6)
+        mounts.append(Mount(fields[2], unescape(fields[4]), fields[separator + 1], fields[separator + 2]))
+    return mounts
+
+
+def block_fstypes() -> Set[str]:
+    """Filesystems of /proc/filesystems that need a block device, the rest (proc, tmpfs, cgroup2, ...) are virtual"""
+    try:
+        with open("/proc/filesystems") as f:
+            return {line.split()[0] for line in f if not line.startswith("nodev")}
+    except OSError:
+        return set()
+
+
+def usage_thread(path: str) -> Future:
+    """statvfs of a network mount in a daemon thread, a call stuck on a hung server never blocks the exit (the threads
+    of concurrent.futures executors are joined at exit)
+    """
+    future: Future = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(usage(path))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"statvfs {path}", daemon=True).start()
+    return future
+
+
+def usage(path: str) -> Optional[tuple]:
+    """(used percent, total GiB, free GiB) like df, the free space is the one available to unprivileged users"""
+    try:
+        stat = os.statvfs(path)
+    except OSError:
+        return None
+    used = stat.f_blocks - stat.f_bfree
+    available = used + stat.f_bavail
+    if not available:
+        return None
+    return (
+        round(used / available * 100, 1),
+        round(stat.f_blocks * stat.f_frsize / GIB, 2),
+        round(stat.f_bavail * stat.f_frsize / GIB, 2),
+    )
+
+
+class MountUsage(Sensor, register=False):
+    """Used space of a mounted filesystem, read by DiskUsage on every update"""
+
+    __slots__ = ("mount", "network", "pending", "started")
+
+    config_name = "disk_usage"
+    state_class = "measurement"
+    unit_of_measurement = "%"
+
+    icon = "mdi:harddisk"
+    state = "unavailable"
+
+    def __init__(self, mount: Mount, network: bool, **fields) -> None:
+        super().__init__(**fields)
+        self.mount = mount
+        self.network = network
+        self.pending: Optional[Future] = None  # statvfs running in a thread (network mounts)
+        self.started = 0.0
+        self.set_mount(mount)
+
+    def set_mount(self, mount: Mount) -> None:
+        self.mount = mount
+        self.attributes.update(mountpoint=mount.mountpoint, source=mount.source, fstype=mount.fstype)
+
+    def report(self, result: Optional[tuple]) -> None:
+        if result is None:
+            self.state = "unavailable"
+        else:
+            self.state, self.attributes["total"], self.attributes["free"] = result
+
+
+class DiskUsage(Sensor):
+    """Highest used space of the mounted filesystems, it creates one sensor for each of them.
+    /proc/self/mountinfo is parsed again only when the kernel signals a change of the mount table (poll() returns
+    POLLPRI). Network filesystems are read in a thread, if one doesn't answer in NETWORK_TIMEOUT seconds it's reported
+    unavailable and it isn't read again until the call returns, so a hung server never blocks an update.
+    """
+
+    __slots__ = ("selected", "mountinfo", "poll", "fstypes", "mounts", "known")
+
+    config_name = "disk_usage"
+    state_class = "measurement"
+    unit_of_measurement = "%"
+
+    unique_id = "disk_usage_highest"
+    name = "Highest Disk Usage"
+    icon = "mdi:harddisk"
+    state = "unavailable"
+    attributes = {"mounts": 0}
+
+    def __init__(self, selected: Selector, **fields) -> None:
+        super().__init__(**fields)
+        self.selected = selected
+        self.mountinfo = ProcFile(MOUNTINFO)
+        self.poll = select.poll()
+        self.poll.register(self.mountinfo.fd, select.POLLPRI | select.POLLERR)
+        self.fstypes = block_fstypes() - SKIP_FSTYPES | NETWORK_FSTYPES
+        self.mounts: Dict[str, MountUsage] = {}  # Mounted filesystems reported, by mount point
+        self.known: Dict[str, MountUsage] = {}  # Every mount point ever reported, kept after it's unmounted
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            include: Patterns of the mount points to report (default all the real filesystems)
+            exclude: Patterns of the mount points to ignore (default ["/snap/*", "/var/lib/docker/*"])
+        """
+        disk_usage = cls(Selector(options.get("include", []), options.get("exclude", ["/snap/*", "/var/lib/docker/*"])))
+        disk_usage.poll.poll(0)  # Clears the change pending since the file was opened
+        new = disk_usage.discover()
+        return [disk_usage, *new]
+
+    def discover(self) -> List[MountUsage]:
+        """Read the mount table and update the mounts reported
+
+        :return: The mounts discovered for the first time
+        """
+        buffer = self.mountinfo.read()
+        devices = set()
+        mounted = {}
+        for mount in parse_mountinfo(bytes(buffer[:self.mountinfo.length])):
+            # The first mount of a filesystem is reported, bind mounts and subvolumes of it are skipped
+            if mount.fstype in self.fstypes and mount.device not in devices and self.selected(mount.mountpoint):
+                devices.add(mount.device)
+                mounted[mount.mountpoint] = mount
+
+        new = []
+        for mountpoint in list(self.mounts):
+            if mountpoint not in mounted:
+                self.mounts.pop(mountpoint).state = "unavailable"
+        for mountpoint, mount in mounted.items():
+            sensor = self.known.get(mountpoint)
+            if sensor is None:
+                slug = re.sub(r"[^a-z0-9]+", "_", mountpoint.lower()).strip("_") or "root"
+                sensor = self.known[mountpoint] = MountUsage(
+                    mount,
+                    mount.fstype in NETWORK_FSTYPES,
+                    unique_id=f"disk_usage_{slug}",
+                    name=f"Disk Usage {mountpoint}",
+                )
+                new.append(sensor)
+            sensor.set_mount(mount)
+            self.mounts[mountpoint] = sensor
+
+        logger.info("Found %s mounted filesystems", len(self.mounts))
+        return new
+
+    def read_network(self, sensor: MountUsage) -> None:
+        """Report the result of the last statvfs of a network mount and start the next one"""
+        now = time.monotonic()
+        if sensor.pending is not None:
+            if not sensor.pending.done():
+                if now - sensor.started > NETWORK_TIMEOUT:
+                    if sensor.state != "unavailable":
+                        logger.warning("Network mount %s not responding", sensor.mount.mountpoint)
+                    sensor.state = "unavailable"
+                return
+            sensor.report(sensor.pending.result())
+        sensor.pending = usage_thread(sensor.mount.mountpoint)
+        sensor.started = now
+
+    def stop(self) -> None:
+        # Threads stuck on a hung mount can't be interrupted, they're left to finish on their own
+        self.mountinfo.close()
+
+    def sample(self) -> None:
+        """Read the usage of every mount, the mount sensors are updated here so they don't sample on their own"""
+        if self.poll.poll(0):
+            logger.info("Mount table changed")
+            new = self.discover()
+            if new and self.manager is not None:
+                self.manager.adopt(new)
+
+        highest = None
+        for sensor in self.mounts.values():
+            if sensor.network:
+                self.read_network(sensor)
+            else:
+                sensor.report(usage(sensor.mount.mountpoint))
+            if sensor.state != "unavailable" and (highest is None or sensor.state > highest):
+                highest = sensor.state
+
+        self.state = "unavailable" if highest is None else highest
+        self.attributes["mounts"] = len(self.mounts)
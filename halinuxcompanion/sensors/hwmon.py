@@ -0,0 +1,203 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.devices import Selector
+from typing import Dict, List, Optional, Type
+import logging
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+HWMON = "/sys/class/hwmon"
+INPUT_RE = re.compile(r"^(temp|fan)(\d+)_input$")
+
+
+def read_text(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def listdir() -> List[str]:
+    try:
+        return sorted(os.listdir(HWMON))
+    except OSError:
+        return []
+
+
+def chip_key(path: str, chip: str, chips: Dict[str, int]) -> str:
+    """Stable identifier of a chip, hwmonN numbers change between boots and when devices are re-plugged.
+    Chips with the same name (e.g. several nvme drives) are told apart by their device (e.g. nvme0, 0000:01:00.0)
+    """
+    if chips[chip] == 1:
+        return chip
+    device = os.path.basename(os.path.realpath(os.path.join(path, "device")))
+    return f"{chip}_{device}"
+
+
+class HwmonInput(Sensor, register=False):
+    """A temperature or fan input, the file is kept open and read by Hwmon on every update"""
+
+    __slots__ = ("key", "fd")
+
+    config_name = "hwmon"
+    state_class = "measurement"
+    scale = 1
+
+    state = "unavailable"
+
+    def __init__(self, key: str, **fields) -> None:
+        super().__init__(**fields)
+        self.key = key
+        self.fd = -1
+
+    def open(self, path: str) -> None:
+        self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def read(self) -> Optional[float]:
+        try:
+            return round(int(os.pread(self.fd, 32, 0)) / self.scale, 1)
+        except (OSError, ValueError):
+            # Some drivers fail the read when the device is powered down (ENODATA, EIO, ...)
+            return None
+
+
+class HwmonTemperature(HwmonInput, register=False):
+    __slots__ = ()
+
+    device_class = "temperature"
+    unit_of_measurement = "°C"
+    scale = 1000  # Millidegrees
+
+    icon = "mdi:thermometer"
+
+
+class HwmonFan(HwmonInput, register=False):
+    __slots__ = ()
+
+    unit_of_measurement = "RPM"
+
+    icon = "mdi:fan"
+
+
+KINDS: Dict[str, Type[HwmonInput]] = {"temp": HwmonTemperature, "fan": HwmonFan}
+
+
+class Hwmon(Sensor):
+    """Highest temperature, it discovers the inputs and creates one sensor for each of them"""
+
+    __slots__ = ("selected", "tree", "inputs", "known")
+
+    config_name = "hwmon"
+    device_class = "temperature"
+    state_class = "measurement"
+    unit_of_measurement = "°C"
+
+    unique_id = "hwmon_highest_temperature"
+    name = "Highest Temperature"
+    icon = "mdi:thermometer-high"
+    state = "unavailable"
+    attributes = {"inputs": 0}
+
+    def __init__(self, selected: Selector, **fields) -> None:
+        super().__init__(**fields)
+        self.selected = selected
+        self.tree: List[str] = []  # Listing of HWMON at the last discovery
+        self.inputs: Dict[str, HwmonInput] = {}  # Inputs currently open
+        self.known: Dict[str, HwmonInput] = {}  # Every input ever discovered, kept after it disappears
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            include: Patterns of inputs to report, inputs are named chip/label e.g. "coretemp/Package id 0", "nvme/*"
+            exclude: Patterns of inputs to ignore
+        """
+        hwmon = cls(Selector(options.get("include", []), options.get("exclude", [])))
+        new = hwmon.discover(listdir())
+        return [hwmon, *new]
+
+    def discover(self, listing: List[str]) -> List[HwmonInput]:
+        """Discover the temperature and fan inputs of every chip and open them.
+        Called at startup, and again only when the listing of HWMON changes.
+
+        :return: The inputs discovered for the first time
+        """
+        for input in self.inputs.values():
+            input.close()
+        self.inputs.clear()
+
+        chips = {}
+        names = {}
+        for entry in listing:
+            names[entry] = read_text(os.path.join(HWMON, entry, "name")) or entry
+            chips[names[entry]] = chips.get(names[entry], 0) + 1
+
+        new = []
+        for entry in listing:
+            path = os.path.join(HWMON, entry)
+            chip = names[entry]
+            prefix = chip_key(path, chip, chips)
+            try:
+                files = sorted(os.listdir(path))
+            except OSError:
+                continue
+            for file in files:
+                match = INPUT_RE.match(file)
+                if match is None:
+                    continue
+                kind, number = match.groups()
+                label = read_text(os.path.join(path, f"{kind}{number}_label")) or f"{kind}{number}"
+                key = f"{prefix}/{label}"
+                if not self.selected(key) or key in self.inputs:
+                    continue
+
+                input = self.known.get(key)
+                if input is None:
+                    unique_id = "hwmon_" + re.sub(r"[^a-z0-9]+", "_", key.lower()).strip("_")
+                    input = self.known[key] = KINDS[kind](key, unique_id=unique_id, name=f"{chip} {label}")
+                    new.append(input)
+                try:
+                    input.open(os.path.join(path, file))
+                    self.inputs[key] = input
+                except OSError as e:
+                    logger.warning("Could not open hwmon input %s: %s", file, e)
+
+        for key, input in self.known.items():
+            if key not in self.inputs:
+                input.state = "unavailable"
+
+        self.tree = listing
+        logger.info("Discovered %s hwmon inputs", len(self.inputs))
+        return new
+
+    def stop(self) -> None:
+        for input in self.inputs.values():
+            input.close()
+        self.inputs.clear()
+
+    def sample(self) -> None:
+        """Read every input once, and report the highest temperature.
+        The input sensors are updated here, so they don't need to sample on their own.
+        """
+        listing = listdir()
+        if listing != self.tree:
+            logger.info("hwmon tree changed, discovering inputs again")
+            new = self.discover(listing)
+            if new and self.manager is not None:
+                self.manager.adopt(new)
+
+        highest = None
+        for input in self.inputs.values():
+            value = input.read()
+            input.state = "unavailable" if value is None else value
+            if value is not None and isinstance(input, HwmonTemperature) and (highest is None or value > highest):
+                highest = value
+
+        self.state = "unavailable" if highest is None else highest
+        self.attributes["inputs"] = len(self.inputs)
@@ -0,0 +1,107 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.procfs import ProcFile
+from glob import glob
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+ASOUND = "/proc/asound"
+# Seconds between the checks of the capture streams (scaled like the updates), a change is pushed right away
+CHECK_INTERVAL: float = 1
+
+
+class Microphone(Sensor):
+    """Whether a microphone is capturing, from the status of the ALSA capture substreams (no helper is forked).
+    The substreams are found at startup and again when /proc/asound/cards changes (a card was plugged or removed),
+    their status files are kept open, so a check is a read of each of them.
+    """
+
+    __slots__ = ("cards", "cards_data", "streams")
+
+    config_name = "microphone"
+    tasks = ("watch",)
+
+    unique_id = "microphone_state"
+    name = "Microphone State"
+    icon = "mdi:microphone-off"
+    state = "unavailable"
+    attributes = {"devices": []}
+
+    def __init__(self, **fields) -> None:
+        super().__init__(**fields)
+        self.cards: Optional[ProcFile] = None
+        self.cards_data = b""
+        self.streams: List[Tuple[str, ProcFile]] = []  # Capture substreams: device (card id/pcm) and status file
+        try:
+            self.cards = ProcFile(os.path.join(ASOUND, "cards"))
+        except OSError:
+            logger.warning("ALSA not available (no %s), the microphone is unavailable", ASOUND)
+
+    def discover(self) -> None:
+        self.close_streams()
+        for path in sorted(glob(os.path.join(ASOUND, "card*", "pcm*c", "sub*", "status"))):
+            card, pcm = path.split(os.sep)[-4:-2]
+            try:
+                with open(os.path.join(ASOUND, card, "id")) as f:
+                    card = f.read().strip()
+                self.streams.append((f"{card}/{pcm}", ProcFile(path, 1024)))
+            except OSError as e:
+                # The card is being removed, it will show up in /proc/asound/cards
+                logger.debug("Could not open %s: %s", path, e)
+        logger.info("Found %s capture substreams", len(self.streams))
+
+    def close_streams(self) -> None:
+        for _, status in self.streams:
+            status.close()
+        self.streams = []
+
+    def check(self) -> bool:
+        """Read the status of every capture substream, finding them again if the cards changed
+
+        :return: True if the state or the active devices changed
+        """
+        if self.cards is None:
+            return False
+        buffer = self.cards.read()
+        if buffer[:self.cards.length] != self.cards_data:
+            self.cards_data = bytes(buffer[:self.cards.length])
+            self.discover()
+
+        devices = []
+        for device, status in self.streams:
+            try:
+                buffer = status.read()
+            except OSError:
+                # The card was removed, /proc/asound/cards will tell on the next check
+                self.cards_data = b""
+                continue
+            # The buffer is reused, only the bytes of this read are looked at
+            if buffer.startswith(b"state: RUNNING", 0, status.length) and device not in devices:
+                devices.append(device)
+
+        state = "active" if devices else "idle"
+        if (state, devices) == (self.state, self.attributes["devices"]):
+            return False
+        self.state = state
+        self.icon = "mdi:microphone" if devices else "mdi:microphone-off"
+        self.attributes["devices"] = devices
+        return True
+
+    async def watch(self) -> None:
+        """Check the capture substreams every CHECK_INTERVAL, the sensor is pushed as soon as it changes"""
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL * self.manager.scale)
+            if not self.suspended and self.check():
+                self.manager.push(self)
+
+    def stop(self) -> None:
+        self.close_streams()
+        if self.cards is not None:
+            self.cards.close()
+            self.cards = None
+
+    def sample(self) -> None:
+        self.check()
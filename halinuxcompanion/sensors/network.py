@@ -0,0 +1,70 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.devices import Counters, Selector
+from halinuxcompanion import procfs
+from typing import List
+
+net_dev = procfs.procfile("/proc/net/dev")
+
+
+class Network(Sensor):
+    __slots__ = ("selected", "counters")
+
+    config_name = "network"
+    isolated = True
+    device_class = "data_rate"
+    state_class = "measurement"
+    unit_of_measurement = "KiB/s"
+    signals = {
+        "system.login_on_prepare_for_sleep": "on_suspend",
+    }
+
+    unique_id = "network_throughput"
+    name = "Network Throughput"
+    icon = "mdi:network"
+    state = 0
+
+    def __init__(self, selected: Selector, **fields) -> None:
+        super().__init__(**fields)
+        self.selected = selected
+        self.counters = Counters()
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            include: Interface name patterns to report (default all)
+            exclude: Interface name patterns to ignore (default ["lo"])
+        """
+        return [cls(Selector(options.get("include", []), options.get("exclude", ["lo"])))]
+
+    async def on_suspend(self, v: bool) -> None:
+        await super().on_suspend(v)
+        if not v:
+            self.counters.reset()
+
+    def snapshot(self) -> dict:
+        """Received and transmitted bytes of the selected interfaces, from a single read of /proc/net/dev"""
+        buffer = net_dev.read()
+        data = {}
+        # The first two lines are headers
+        for line in buffer[:net_dev.length].splitlines()[2:]:
+            name, values = line.split(b":", 1)
+            name = name.strip().decode()
+            if self.selected(name):
+                values = values.split(None, 9)
+                data[name] = (int(values[0]), int(values[8]))
+        return data
+
+    def sample(self) -> None:
+        rates = self.counters.rates(self.snapshot())
+        if not rates:
+            # First snapshot or waking up from suspend
+            return
+
+        total = 0.0
+        attributes = {}
+        for name, (rx, tx) in rates.items():
+            attributes[name + "_rx"] = round(rx / 1024, 1)
+            attributes[name + "_tx"] = round(tx / 1024, 1)
+            total += rx + tx
+        self.state = round(total / 1024, 1)
+        self.attributes = attributes
@@ -0,0 +1,113 @@
+from halinuxcompanion.sensor import Sensor
+from heapq import nlargest
+from operator import attrgetter
+from typing import Dict, List
+import time
+import os
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+STAT_BUFFER = bytearray(1024)  # /proc/<pid>/stat is a single line of a few hundred bytes
+
+
+class Process:
+    """Cached entry of the process table, parsed fully only the first time the pid is seen"""
+
+    __slots__ = ("pid", "path", "name", "start", "cpu_time", "cpu", "rss")
+
+    def __init__(self, pid: int, path: str, name: str, start: bytes) -> None:
+        self.pid = pid
+        self.path = path
+        self.name = name
+        self.start = start  # Start time, to detect pid reuse
+        self.cpu_time = -1
+        self.cpu = 0.0
+        self.rss = 0
+
+
+def read_stat(path: str) -> bytes:
+    """Fields of /proc/<pid>/stat after the command name, which is the only field that can contain spaces"""
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        length = os.readv(fd, [STAT_BUFFER])
+    finally:
+        os.close(fd)
+    return STAT_BUFFER[:length]
+
+
+class Processes(Sensor):
+    __slots__ = ("top", "cache", "previous_time")
+
+    config_name = "processes"
+    isolated = True
+    state_class = "measurement"
+
+    unique_id = "processes"
+    name = "Processes"
+    icon = "mdi:format-list-numbered"
+    state = 0
+    attributes = {"top_cpu": [], "top_memory": []}
+
+    def __init__(self, top: int = 5, **fields) -> None:
+        super().__init__(**fields)
+        self.top = top
+        self.cache: Dict[int, Process] = {}
+        self.previous_time = 0.0
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            top: Number of processes reported by cpu and memory usage (default 5)
+        """
+        return [cls(int(options.get("top", 5)))]
+
+    def scan(self, elapsed: float) -> None:
+        """Refresh the cache with the current process table.
+        New pids are parsed fully (name and start time), for known pids only the cpu times and rss are parsed, and
+        exited pids are dropped. Stat fields: https://man7.org/linux/man-pages/man5/proc.5.html
+        """
+        cache = self.cache
+        seen = set()
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            process = cache.get(pid)
+            try:
+                stat = read_stat(process.path if process else "/proc/%s/stat" % entry)
+            except OSError:
+                # Exited between the listing and the read
+                continue
+
+            comm_end = stat.rindex(b")")
+            # Fields 3 (state) to 24 (rss), utime is 14, stime is 15, starttime is 22
+            fields = stat[comm_end + 2:].split(None, 22)
+            if process is None or process.start != fields[19]:
+                name = stat[stat.index(b"(") + 1:comm_end].decode(errors="replace")
+                process = cache[pid] = Process(pid, "/proc/%s/stat" % entry, name, bytes(fields[19]))
+
+            cpu_time = int(fields[11]) + int(fields[12])
+            if process.cpu_time >= 0 and elapsed > 0:
+                process.cpu = (cpu_time - process.cpu_time) / CLOCK_TICKS / elapsed * 100
+            process.cpu_time = cpu_time
+            process.rss = int(fields[21]) * PAGE_SIZE_KB
+            seen.add(pid)
+
+        for pid in cache.keys() - seen:
+            del cache[pid]
+
+    def sample(self) -> None:
+        now = time.monotonic()
+        self.scan(now - self.previous_time if self.previous_time else 0.0)
+        self.previous_time = now
+
+        processes = self.cache.values()
+        self.state = len(self.cache)
+        self.attributes["top_cpu"] = [
+            {"pid": p.pid, "name": p.name, "cpu": round(p.cpu, 1)}
+            for p in nlargest(self.top, processes, key=attrgetter("cpu"))
+        ]
+        self.attributes["top_memory"] = [
+            {"pid": p.pid, "name": p.name, "rss": p.rss}
+            for p in nlargest(self.top, processes, key=attrgetter("rss"))
+        ]
@@ -0,0 +1,163 @@
+from halinuxcompanion.sensor import Sensor
+from halinuxcompanion.dbus import SYSTEMD_INTERFACE
+from typing import Dict, List, Optional, Set
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+# Failed units listed in the attributes, the state is the count of all of them
+MAX_LISTED = 20
+
+
+def unit_name(path: str) -> str:
+    """Name of a unit from its object path, systemd escapes the characters other than letters and digits as _xx"""
+    return re.sub(r"_([0-9a-f]{2})", lambda m: chr(int(m.group(1), 16)), path.rsplit("/", 1)[1])
+
+
+class Unit(Sensor, register=False):
+    """Active state of a watched unit, updated by Systemd from the signals"""
+
+    __slots__ = ("unit",)
+
+    config_name = "systemd"
+
+    icon = "mdi:cog-outline"
+    state = "unknown"
+    attributes = {"sub_state": "unknown", "result": "unknown"}
+
+    def __init__(self, unit: str, **fields) -> None:
+        super().__init__(**fields)
+        self.unit = unit
+
+    def set_state(self, active: Optional[str], sub: Optional[str]) -> bool:
+        """:return: True if the state changed"""
+        state, sub_state = self.state, self.attributes["sub_state"]
+        if active is not None:
+            self.state = active
+        if sub is not None:
+            self.attributes["sub_state"] = sub
+        return (state, sub_state) != (self.state, self.attributes["sub_state"])
+
+
+class Systemd(Sensor):
+    """Number of failed systemd units, it creates one sensor for each watched unit.
+    The active state of every loaded unit is kept in memory, it's loaded once with ListUnits and then updated only from
+    the signals of systemd (PropertiesChanged of the units, UnitNew, UnitRemoved, JobRemoved), nothing is polled.
+    """
+
+    __slots__ = ("units", "failed", "watched")
+
+    config_name = "systemd"
+    state_class = "measurement"
+    signals = {
+        "system.systemd_units_on_properties_changed": "on_properties_changed",
+        "system.systemd_on_unit_new": "on_unit_new",
+        "system.systemd_on_unit_removed": "on_unit_removed",
+        "system.systemd_on_job_removed": "on_job_removed",
+    }
+    tasks = ("subscribe",)
+
+    unique_id = "systemd_failed_units"
+    name = "Failed Units"
+    icon = "mdi:alert-circle-outline"
+    state = 0
+    attributes = {"failed": []}
+
+    def __init__(self, watched: List[Unit], **fields) -> None:
+        super().__init__(**fields)
+        self.units: Dict[str, str] = {}  # Active state by unit name
+        self.failed: Set[str] = set()
+        self.watched = {unit.unit: unit for unit in watched}
+
+    @classmethod
+    def create(cls, options: dict) -> List[Sensor]:
+        """Options:
+            units: Names of the units to report the state of, e.g. ["backup.timer", "nginx.service"] (default none)
+        """
+        watched = [
+            Unit(name, unique_id="systemd_" + re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_"), name=f"Unit {name}")
+            for name in options.get("units", [])
+        ]
+        return [cls(watched), *watched]
+
+    async def subscribe(self) -> None:
+        """Ask systemd to emit its signals (only sent while a client is subscribed) and load the states of the units"""
+        iface = await self.manager.dbus.get_interface(SYSTEMD_INTERFACE)
+        if iface is None:
+            logger.warning("systemd not available on the system bus, no units are reported")
+            self.state = "unavailable"
+            self.manager.push(self)
+            return
+        await iface.call_subscribe()
+        self.load(await iface.call_list_units())
+        for sensor in (self, *self.watched.values()):
+            self.manager.push(sensor)
+
+    def load(self, units: list) -> None:
+        """Replace the states with the result of ListUnits: name, description, load, active, sub, ..."""
+        self.units = {unit[0]: unit[3] for unit in units}
+        self.failed = {name for name, active in self.units.items() if active == "failed"}
+        for name, sensor in self.watched.items():
+            active, sub = next(((u[3], u[4]) for u in units if u[0] == name), ("inactive", "dead"))  # Not loaded
+            sensor.set_state(active, sub)
+        self.report()
+        logger.info("Loaded %s systemd units, %s failed", len(self.units), len(self.failed))
+
+    def report(self) -> None:
+        self.state = len(self.failed)
+        self.attributes["failed"] = sorted(self.failed)[:MAX_LISTED]
+
+    def set_state(self, name: str, active: Optional[str], sub: Optional[str] = None) -> bool:
+        """Update the state of a unit, the watched ones are pushed when they change
+
+        :return: True if the failed units changed
+        """
+        sensor = self.watched.get(name)
+        if sensor is not None and sensor.set_state(active, sub) and self.manager is not None:
+            self.manager.push(sensor)
+        if active is None:
+            return False
+        self.units[name] = active
+        was_failed = name in self.failed
+        if active == "failed":
+            self.failed.add(name)
+        else:
+            self.failed.discard(name)
+        if was_failed != (active == "failed"):
+            self.report()
+            return True
+        return False
+
+    async def on_properties_changed(self, path: str, interface: str, changed: dict, invalidated: list) -> bool:
+        """Handler for the property changes of every unit, only the ActiveState and SubState are of interest.
+        https://www.freedesktop.org/software/systemd/man/org.freedesktop.systemd1.html
+
+        :return: False if the failed units didn't change, so the sensor isn't sent
+        """
+        if interface != UNIT_INTERFACE or ("ActiveState" not in changed and "SubState" not in changed):
+            return False
+        active, sub = changed.get("ActiveState"), changed.get("SubState")
+        return self.set_state(unit_name(path), active and active.value, sub and sub.value)
+
+    async def on_unit_new(self, id: str, path: str) -> bool:
+        """Handler for units loaded into memory, they're inactive until a job starts them"""
+        if id not in self.units:
+            self.units[id] = "inactive"
+        return False
+
+    async def on_unit_removed(self, id: str, path: str) -> bool:
+        """Handler for units unloaded from memory (garbage collected or reset), they're inactive from then on"""
+        changed = self.set_state(id, "inactive", "dead")
+        self.units.pop(id, None)
+        return changed
+
+    async def on_job_removed(self, id: int, job: str, unit: str, result: str) -> bool:
+        """Handler for finished jobs, the result (done, failed, timeout, ...) is reported for the watched units"""
+        sensor = self.watched.get(unit)
+        if sensor is not None and sensor.attributes["result"] != result:
+            sensor.attributes["result"] = result
+            if self.manager is not None:
+                self.manager.push(sensor)
+        return False
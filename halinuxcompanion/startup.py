@@ -0,0 +1,104 @@
+"""Startup time report, printed with --startup-report.
+Startup is split in steps (imports, dbus connection, sensors, ...), each step records how long it took and the modules
+it imported. The modules are timed by an import hook (see ImportTimer), the report lists the slowest ones of each step.
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import sys
+import time
+
+# Modules listed for each step, the slowest first
+TOP_MODULES = 15
+
+
+class ImportTimer:
+    """Meta path finder that times the execution of every module imported while it's installed.
+    It finds the module with the other finders and wraps the exec_module of its loader, nested imports are subtracted
+    from the time of the module importing them. Modules of the builtin and frozen importers aren't timed, they're
+    loaded by classes shared by every module.
+    """
+
+    def __init__(self) -> None:
+        # (self, cumulative) milliseconds by module
+        self.times: Dict[str, Tuple[float, float]] = {}
+        # Milliseconds spent in the nested imports of each import in progress
+        self.stack: List[float] = []
+
+    def install(self) -> None:
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            loader.exec_module = self.timed(name, loader.exec_module)
+        return spec
+
+    def timed(self, name: str, exec_module):
+        def exec_timed(module) -> None:
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                nested = self.stack.pop()
+                if self.stack:
+                    self.stack[-1] += elapsed
+                self.times[name] = (elapsed - nested, elapsed)
+
+        return exec_timed
+
+
+class StartupReport:
+    """Times of the startup steps, measured from the creation of the report"""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        # (step, milliseconds, modules imported during the step)
+        self.steps: List[Tuple[str, float, List[str]]] = []
+        self.imports: Optional[ImportTimer] = None
+
+    def time_imports(self) -> None:
+        """Time every module imported from now on"""
+        self.imports = ImportTimer()
+        self.imports.install()
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        modules = set(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.steps.append((name, elapsed, sorted(sys.modules.keys() - modules)))
+
+    def format(self) -> str:
+        total = (time.perf_counter() - self.start) * 1000
+        if self.imports is not None:
+            self.imports.uninstall()
+        times = self.imports.times if self.imports is not None else {}
+        lines = ["Startup report (milliseconds, modules: cumulative and self time)"]
+        for name, elapsed, modules in self.steps:
+            lines.append(f"{elapsed:9.1f}  {name}")
+            timed = sorted((m for m in modules if m in times), key=lambda m: times[m][1], reverse=True)
+            for module in timed[:TOP_MODULES]:
+                own, cumulative = times[module]
+                lines.append(f"{'':11}{cumulative:7.1f} {own:7.1f}  {module}")
+            if len(modules) > TOP_MODULES:
+                lines.append(f"{'':11}{len(modules)} modules imported")
+        lines.append(f"{total:9.1f}  total")
+        return "\n".join(lines)
@@ -1,9 +1,11 @@
 from halinuxcompanion.api import Server
 from halinuxcompanion.notifier import Notifier
 from halinuxcompanion.sensors.status import Status
+import asyncio
 import json
 from halinuxcompanion.companion import CommandConfig, Companion
 import pytest
+from dbus_next.signature import Variant
 
 
 def get_config() -> dict:
@@ -31,8 +33,8 @@ def setup_notifier() -> Notifier:
     return notifier
 
 
-def test_status_updater():
-    Status.updater()
+def test_status_sample():
+    Status().sample()
 
 
 @pytest.mark.asyncio
@@ -79,3 +81,1134 @@ def test_setup():
 def test_companion_init():
     companion = setup_companion()
     assert companion is not None
+
+
+def test_cpu_ring_buffer():
+    from halinuxcompanion.sensors.cpu import RingBuffer
+
+    samples = RingBuffer(4, 2)
+    for percpu in ([10, 30], [20, 40], [0, 100], [50, 50], [90, 10]):
+        samples.append(percpu)
+
+    # Oldest sample ([10, 30]) was overwritten
+    assert samples.count == 4
+    window = samples.aggregate()
+    assert window["mean"] == 45.0
+    assert window["window_max"] == 50.0
+    assert window["window_p95"] == 50.0
+    assert window["busiest_core"] == 1
+    assert window["busiest_core_load"] == 50.0
+
+
+def test_procfs_readers(tmp_path):
+    from halinuxcompanion import procfs
+
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal:       16000 kB\nMemFree:         4000 kB\nMemAvailable:    8000 kB\n")
+    file = procfs.ProcFile(str(meminfo), size=8)  # Forces the buffer to grow
+    assert procfs.fields(file, (b"MemAvailable", b"MemTotal", b"Missing")) == [8000, 16000, 0]
+
+    # Re-read after the content changed, the file descriptor is kept open
+    meminfo.write_text("MemTotal:       16000 kB\nMemFree:         2000 kB\n")
+    assert procfs.fields(file, (b"MemFree",)) == [2000]
+    file.close()
+
+    stat = tmp_path / "stat"
+    stat.write_text("cpu  10 0 10 70 10 0 0 0 0 0\ncpu0 10 0 10 70 10 0 0 0 0 0\nintr 1 2 3\n")
+    file = procfs.ProcFile(str(stat))
+    assert procfs.cpu_times(file) == [(20, 100), (20, 100)]
+    file.close()
+
+
+def test_counters_rates():
+    from halinuxcompanion.devices import COUNTER_32, Counters, Selector
+
+    counters = Counters()
+    assert counters.rates({"eth0": (100, COUNTER_32 - 150), "tun0": (3000, 10**9)}) == {}
+
+    # 32 bit wrap on eth0, wlan0 is new and gets a rate from the next snapshot
+    counters.time -= 2
+    counters.boottime -= 2
+    rates = counters.rates({"eth0": (300, 50), "tun0": (10, 10), "wlan0": (0, 0)})
+    assert rates["eth0"][0] == pytest.approx(100, rel=0.01)
+    assert rates["eth0"][1] == pytest.approx(100, rel=0.01)
+    # tun0 was re-created, its counter went from 10**9 to 10: a reset, not a wrap of about 3 GiB
+    assert "wlan0" not in rates and "tun0" not in rates
+
+    # Suspended in between, the boot clock advanced but the monotonic clock didn't
+    counters.boottime -= 60
+    assert counters.rates({"eth0": (400, 100), "wlan0": (10, 10)}) == {}
+
+    selected = Selector(["eth*", "wlan*"], ["*0"])
+    assert selected("eth1") and not selected("eth0") and not selected("lo")
+
+
+def test_processes_cache():
+    import os
+    from halinuxcompanion.sensors.processes import Processes
+
+    (processes,) = Processes.create({"top": 2})
+    processes.sample()
+    own = processes.cache[os.getpid()]
+    processes.sample()
+    # Known pids keep their cache entry
+    assert processes.cache[os.getpid()] is own
+    assert processes.state == len(processes.cache)
+    assert len(processes.attributes["top_memory"]) == 2
+
+
+def test_hwmon_discovery(tmp_path, monkeypatch):
+    import shutil
+    from halinuxcompanion.sensors import hwmon
+
+    chip = tmp_path / "hwmon0"
+    chip.mkdir()
+    (chip / "name").write_text("coretemp\n")
+    (chip / "temp1_input").write_text("45000\n")
+    (chip / "temp1_label").write_text("Package id 0\n")
+    (chip / "fan1_input").write_text("1200\n")
+    monkeypatch.setattr(hwmon, "HWMON", str(tmp_path))
+
+    root, fan, package = hwmon.Hwmon.create({})
+    root.sample()
+    assert package.unique_id == "hwmon_coretemp_package_id_0"
+    assert package.device_class == "temperature"
+    assert package.state == 45.0
+    assert fan.unit_of_measurement == "RPM"
+    assert fan.state == 1200
+    assert root.state == 45.0
+
+    # Cached handles are re-read without a new discovery
+    (chip / "temp1_input").write_text("50000\n")
+    root.sample()
+    assert package.state == 50.0
+
+    # Chip removed, its sensors become unavailable
+    shutil.rmtree(chip)
+    root.sample()
+    assert package.state == "unavailable"
+
+
+class ApiStub:
+    """Records the webhook posts instead of sending them"""
+
+    def __init__(self):
+        self.posts = []
+        self.reachable = True
+
+    async def webhook_post(self, type, data):
+        self.posts.append((type, json.loads(data)))
+        return ResponseStub(200)
+
+    async def probe(self, timeout):
+        return self.reachable
+
+
+class ResponseStub:
+    def __init__(self, status):
+        self.status = status
+        self.ok = status < 400
+
+
+def test_cgroups_discovery(tmp_path, monkeypatch):
+    import shutil
+    import time
+    from types import SimpleNamespace
+    from halinuxcompanion import devices
+    from halinuxcompanion.sensors import cgroups
+
+    # The rates are computed over a clock that advances one second between the samples
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(devices, "time", SimpleNamespace(
+        monotonic=lambda: clock.now, clock_gettime=lambda _: clock.now, CLOCK_BOOTTIME=time.CLOCK_BOOTTIME
+    ))
+
+    def service(name, usage, rbytes):
+        path = tmp_path / "system.slice" / name
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "cpu.stat").write_text(f"usage_usec {usage}\nuser_usec 0\nsystem_usec 0\n")
+        (path / "io.stat").write_text(f"8:0 rbytes={rbytes} wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n")
+        (path / "memory.current").write_text("1048576\n")
+
+    monkeypatch.setattr(cgroups, "CGROUP_ROOT", str(tmp_path))
+    (tmp_path / "cgroup.controllers").write_text("cpu io memory\n")
+    service("a.service", 0, 0)
+    (tmp_path / "system.slice" / "a.service" / "nested").mkdir()
+    parent, a = cgroups.Cgroups.create({})
+    assert a.unique_id == "cgroup_system_slice_a_service" and parent.watcher is not None
+
+    class ManagerStub:
+        adopted = []
+
+        def adopt(self, sensors):
+            self.adopted.extend(sensors)
+
+    parent.manager = ManagerStub()
+    parent.sample()
+    clock.now += 1
+    service("a.service", 500000, 2048)
+    # Created after the first walk, found through inotify without walking the tree
+    service("b.service", 0, 0)
+    parent.sample()
+    assert a.state == 50.0 and a.attributes["io_read"] == 2.0 and a.attributes["memory"] == 1.0
+    assert [s.unique_id for s in parent.manager.adopted] == ["cgroup_system_slice_b_service"]
+    assert parent.state == 2
+
+    shutil.rmtree(tmp_path / "system.slice" / "a.service")
+    parent.sample()
+    assert a.state == "unavailable" and parent.state == 1
+    parent.stop()
+
+    # Without inotify the tree is walked on every update, the counters of the cgroups still there are kept
+    def no_inotify():
+        raise OSError("no inotify")
+
+    monkeypatch.setattr(cgroups, "Inotify", no_inotify)
+    service("a.service", 0, 0)
+    parent, a, b = cgroups.Cgroups.create({})
+    assert parent.watcher is None
+    parent.manager = ManagerStub()
+    parent.sample()
+    cpu = a.cpu
+    for usage in (250000, 500000):
+        clock.now += 1
+        service("a.service", usage, 0)
+        parent.sample()
+        assert a.state == 25.0
+    assert a.cpu is cpu
+    shutil.rmtree(tmp_path / "system.slice" / "b.service")
+    clock.now += 1
+    parent.sample()
+    assert b.state == "unavailable" and a.state == 0.0 and parent.state == 1
+    parent.stop()
+
+
+def test_disk_usage(tmp_path, monkeypatch):
+    import threading
+    import time
+    from halinuxcompanion.sensors import disk_usage
+
+    mountinfo = tmp_path / "mountinfo"
+    lines = [
+        "23 28 0:22 / /proc rw,relatime - proc proc rw",
+        "28 1 254:0 / / rw,relatime - ext4 /dev/vda rw",
+        "29 28 254:0 /home /srv/home\\040bind rw,relatime - ext4 /dev/vda rw",
+        "30 28 7:1 / /snap/core/1 ro,relatime - squashfs /dev/loop1 ro",
+        "31 28 0:40 / /mnt/nas rw,relatime shared:5 - nfs4 nas:/export rw",
+    ]
+    mountinfo.write_text("\n".join(lines) + "\n")
+    monkeypatch.setattr(disk_usage, "MOUNTINFO", str(mountinfo))
+    hung = threading.Event()
+
+    def usage(path):
+        if path == "/mnt/nas":
+            hung.wait(5)
+            return None
+        return (50.0, 100.0, 50.0)
+
+    monkeypatch.setattr(disk_usage, "usage", usage)
+    monkeypatch.setattr(disk_usage, "NETWORK_TIMEOUT", 0)
+    parent, root, nas = disk_usage.DiskUsage.create({})
+    # Virtual filesystems, bind mounts of a reported filesystem and images are left out
+    assert [root.unique_id, nas.unique_id] == ["disk_usage_root", "disk_usage_mnt_nas"]
+    assert nas.network and nas.attributes["fstype"] == "nfs4"
+
+    # A network mount that doesn't answer doesn't block the update
+    start = time.monotonic()
+    parent.sample()
+    parent.sample()
+    assert time.monotonic() - start < 1
+    assert root.state == 50.0 and nas.state == "unavailable" and parent.state == 50.0
+    # The hung call doesn't block the exit either
+    assert all(t.daemon for t in threading.enumerate() if t.name == "statvfs /mnt/nas")
+
+    # Unmounted
+    mountinfo.write_text("\n".join(lines[:2]) + "\n")
+    assert parent.discover() == []
+    assert nas.state == "unavailable" and parent.mounts.keys() == {"/"}
+    hung.set()
+    parent.stop()
+
+
+@pytest.mark.asyncio
+async def test_report_policy():
+    from halinuxcompanion.companion import ReportPolicyConfig
+    from halinuxcompanion.sensor import ReportPolicy, Sensor, SensorManager
+
+    class PolicySensor(Sensor):
+        __slots__ = ()
+        config_name = "test_policy"
+
+        unique_id = "test_policy"
+        icon = "mdi:test"
+        state = 10.0
+
+    sensor = PolicySensor()
+    api = ApiStub()
+    policies = {"test_policy": ReportPolicyConfig(deadband=1, heartbeat=3600)}
+    manager = SensorManager(api, [sensor], None, policies)
+
+    # First update is always sent
+    assert await manager.update_sensors()
+    assert len(api.posts) == 1
+
+    # Within the deadband, nothing is sent
+    sensor.state = 10.5
+    sensor.attributes = {"changed": True}
+    assert await manager.update_sensors()
+    assert len(api.posts) == 1
+
+    sensor.state = 11.0
+    assert await manager.update_sensors()
+    assert len(api.posts) == 2
+    assert api.posts[-1][1]["data"][0]["state"] == 11.0
+
+    # Heartbeat
+    last_state, last_attributes, last_time = manager.reported["test_policy"]
+    manager.reported["test_policy"] = (last_state, last_attributes, last_time - 3600)
+    assert await manager.update_sensors()
+    assert len(api.posts) == 3
+
+    # Forced updates (signals) ignore the policy
+    assert await manager.update_sensors([sensor], force=True)
+    assert len(api.posts) == 4
+    del Sensor.types["test_policy"]
+
+    # Relative deadband, a state sitting at 0 isn't reported again
+    policy = ReportPolicy(ReportPolicyConfig(deadband=0.1, relative=True))
+    assert not policy.changed(0.0, {}, 0.0, {}) and policy.changed(0.5, {}, 0.0, {})
+    assert not policy.changed(10.5, {}, 10.0, {}) and policy.changed(11.0, {}, 10.0, {})
+
+
+@pytest.mark.asyncio
+async def test_stop_sensors():
+    from halinuxcompanion.sensor import Sensor, SensorManager
+
+    class TaskSensor(Sensor):
+        __slots__ = ()
+        config_name = "test_task"
+        tasks = ("run",)
+
+        unique_id = "test_task"
+        icon = "mdi:test"
+        state = 1
+
+        async def run(self):
+            await asyncio.sleep(3600)
+
+    api = ApiStub()
+    sensor = TaskSensor()
+    manager = SensorManager(api, [sensor], None)
+    assert await manager.register_sensors()
+    task = manager.tasks["test_task"][0]
+
+    await manager.stop_sensors(["test_task"])
+    await asyncio.sleep(0)
+    assert task.cancelled()
+    assert manager.sensors == [] and "test_task" not in manager.tasks
+    assert api.posts[-1][1]["data"][0]["state"] == "unavailable"
+    del Sensor.types["test_task"]
+    manager.sending.cancel()
+
+    config = get_config()
+    running = Companion(config)
+    config["refresh_interval"] = 5
+    assert running.restart_required(Companion(config)) == []
+    config["computer_port"] = 8500
+    assert running.restart_required(Companion(config)) == ["computer_port"]
+
+
+@pytest.mark.asyncio
+async def test_reload(tmp_path, monkeypatch):
+    """A reload stops the disabled sensors and creates the enabled ones, importing modules never imported before"""
+    import sys
+    from halinuxcompanion.__main__ import reload
+    from halinuxcompanion.sensor import Sensor, SensorManager
+
+    monkeypatch.delitem(sys.modules, "halinuxcompanion.sensors.camera_state", raising=False)
+    monkeypatch.delitem(Sensor.types, "camera_state", raising=False)
+    config = get_config()
+    companion = Companion(config)
+    manager = SensorManager(ApiStub(), [], None)
+    config["sensors"]["camera_state"]["enabled"] = True
+    config["sensors"]["uptime"]["enabled"] = False
+    config["refresh_interval"] = 5
+    file = tmp_path / "config.json"
+    file.write_text(json.dumps(config))
+
+    await reload(str(file), "INFO", companion, manager, None)
+    assert [sensor.unique_id for sensor in manager.adopted] == ["camera_state"]
+    assert companion.sensors["camera_state"] and not companion.sensors["uptime"]
+    assert companion.refresh_interval == 5
+
+
+# Import time budget of a cold start without notifications, in seconds. About 0.5s on a laptop.
+STARTUP_IMPORT_BUDGET = 1.5
+
+
+def test_startup_import_budget():
+    import subprocess
+    import sys
+
+    code = """
+import sys, time
+start = time.perf_counter()
+import halinuxcompanion.__main__
+import halinuxcompanion.companion, halinuxcompanion.api, halinuxcompanion.dbus, halinuxcompanion.sensor
+import halinuxcompanion.sensors.memory, halinuxcompanion.sensors.network, halinuxcompanion.sensors.status
+print(time.perf_counter() - start)
+print(*[m for m in ("aiohttp.web", "psutil", "halinuxcompanion.notifier") if m in sys.modules])
+"""
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.splitlines()
+    assert float(out[0]) < STARTUP_IMPORT_BUDGET
+    # Only imported when notifications or the sensors that need them are enabled
+    assert out[1] == ""
+
+
+def test_startup_report(tmp_path, monkeypatch):
+    """Each module imported during a step is timed, the nested imports are subtracted from the importing module"""
+    import sys
+    from importlib import import_module
+    from halinuxcompanion.startup import StartupReport
+
+    (tmp_path / "startup_outer.py").write_text("import startup_inner\n")
+    (tmp_path / "startup_inner.py").write_text("import time\ntime.sleep(0.05)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    report = StartupReport()
+    report.time_imports()
+    with report.step("Import outer"):
+        import_module("startup_outer")
+    lines = report.format().splitlines()
+    assert report.imports not in sys.meta_path
+
+    inner = report.imports.times["startup_inner"]
+    outer = report.imports.times["startup_outer"]
+    assert inner[0] >= 50 and outer[1] >= 50 and outer[0] < 50
+    assert lines[1].endswith("Import outer") and lines[2].endswith("startup_outer")
+    assert lines[3].endswith("startup_inner")
+
+
+@pytest.mark.asyncio
+async def test_scheduler_resume(monkeypatch):
+    from halinuxcompanion import scheduler
+    from halinuxcompanion.scheduler import Scheduler
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors.cpu import Cpu
+    from halinuxcompanion.sensors.status import Status
+
+    monkeypatch.setattr(scheduler, "PROBE_DELAY", 0.01)
+    api = ApiStub()
+    status, cpu = Status(), Cpu()
+    manager = SensorManager(api, [status, cpu], None)
+    sender = asyncio.create_task(manager.sender())
+    sched = Scheduler(setup_companion(), api, manager)
+
+    # Going to sleep: polling stops, the sensors handling the signal are sent together
+    sched.on_prepare_for_sleep(True)
+    await status.on_prepare_for_sleep(True)
+    manager.push(status)
+    await cpu.on_suspend(True)
+    manager.push(cpu)
+    await asyncio.sleep(0.01)
+    assert not sched.polling
+    assert len(api.posts) == 1 and len(api.posts[0][1]["data"]) == 2
+
+    # Waking up without network: nothing is sent until Home Assistant is reachable
+    api.reachable = False
+    sched.on_prepare_for_sleep(False)
+    await status.on_prepare_for_sleep(False)
+    manager.push(status)
+    await asyncio.sleep(0.05)
+    assert len(api.posts) == 1
+
+    # Single catch-up update with every sensor
+    api.reachable = True
+    await asyncio.wait_for(sched.resuming, 1)
+    await asyncio.sleep(0)
+    assert sched.polling
+    assert len(api.posts) == 2 and len(api.posts[1][1]["data"]) == 2
+    sender.cancel()
+    await asyncio.gather(sender, return_exceptions=True)
+
+
+class SlowApiStub(ApiStub):
+    """Home Assistant that hangs until released, or fails"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+        self.fail = False
+
+    async def webhook_post(self, type, data):
+        await self.release.wait()
+        if self.fail:
+            raise asyncio.TimeoutError()
+        return await super().webhook_post(type, data)
+
+
+@pytest.mark.asyncio
+async def test_sender_superseded_and_failed(tmp_path, monkeypatch):
+    from halinuxcompanion.recorder import RECORDER
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors.status import Status
+
+    monkeypatch.setattr(RECORDER, "path", str(tmp_path / "flight-recorder.jsonl"))
+    api = SlowApiStub()
+    status = Status()
+    manager = SensorManager(api, [status], None)
+    sender = asyncio.create_task(manager.sender())
+
+    # Collecting never waits for the hung request, and a newer value cancels it
+    manager.collect()
+    await asyncio.sleep(0)
+    assert len(manager.requests) == 1
+    status.state = False
+    manager.collect()
+    assert manager.outbox
+    api.release.set()
+    await asyncio.sleep(0.01)
+    assert len(api.posts) == 1 and api.posts[0][1]["data"][0]["state"] is False
+    assert manager.reported["status"][0] is False
+
+    # A failed update goes back to the outbox, unless a newer value was queued
+    api.fail = True
+    assert not await manager.update_sensors()
+    assert manager.outbox["status"][1]["state"] is False
+    sender.cancel()
+    await asyncio.gather(sender, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_flight_recorder(tmp_path):
+    from halinuxcompanion.recorder import RECORDER, FlightRecorder, PeriodicSummary
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors.status import Status
+
+    path = tmp_path / "flight-recorder.jsonl"
+    recorder = FlightRecorder(size=3, path=str(path))
+    for counter in range(5):
+        recorder.record("update", counter, {"data": []})
+    recorder.record("signal", "system.login_on_prepare_for_sleep", "status", (Variant("b", True),))
+    recorder.dump_on_error()
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    # Only the last records are kept
+    assert [r[1] for r in records] == ["update", "update", "signal"]
+    assert records[0][2:] == [3, {"data": []}]
+    assert records[2][2:] == ["system.login_on_prepare_for_sleep", "status", [True]]
+    # Dumps caused by errors are rate limited
+    path.unlink()
+    recorder.dump_on_error()
+    assert not path.exists()
+
+    class LogStub:
+        def __init__(self):
+            self.lines = []
+
+        def info(self, message, *args):
+            self.lines.append(message % args)
+
+    log = LogStub()
+    summary = PeriodicSummary(log, "Sensors updates", interval=0.05)
+    summary.count("sent")
+    await asyncio.sleep(0.06)
+    summary.count("sent")
+    assert log.lines == ["Sensors updates in the last 0s: {'sent': 2}"]
+
+    # The manager records its updates
+    manager = SensorManager(ApiStub(), [Status()], None)
+    assert await manager.update_sensors()
+    kinds = [record[1] for record in RECORDER.records]
+    assert kinds[-2:] == ["update", "response"]
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path):
+    from halinuxcompanion.recorder import RECORDER
+    from halinuxcompanion.replay import Replay, load
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors.status import Status
+
+    class EventApiStub:
+        status = 200
+
+        async def post(self, endpoint, data):
+            return self
+
+    path = tmp_path / "recording.jsonl"
+    RECORDER.start_recording(str(path))
+    status = Status()
+    manager = SensorManager(ApiStub(), [status], None)
+    assert await manager.update_sensors()
+    await manager._signal_handler(status, "system.login_on_prepare_for_sleep", "on_prepare_for_sleep", True)
+    notifier = setup_notifier()
+    notifier.interface = NotificationsStub()
+    notifier.api = EventApiStub()
+    notifier.ha_url = ""
+    notifier.tagtoid = {}
+    data = {"tag": "greeting", "actions": [{"action": "open", "title": "Open"}]}
+    notifier.handle_notification({"message": "hello", "push_token": "secret", "data": data})
+    while notifier.lanes:
+        await asyncio.sleep(0.01)
+    await notifier.on_action(1, "open")
+    await notifier.on_close(1, "dismissed")
+    await asyncio.sleep(0)
+    RECORDER.stop_recording()
+
+    with open(path) as f:
+        records = load(f)
+    notify = next(r for r in records if r[1] == "notify")
+    assert notify[2] == {"message": "hello", "data": data}
+    records.append([records[-1][0] + 0.01, "webhook", 1, "update_sensors", "local", 500, 0.001])
+
+    replay = Replay(records, speed=100)
+    await replay.run()
+    assert replay.counts["sample"] == 2 and replay.counts["notify"] == 1 and replay.counts["signal"] == 1
+    assert replay.api.posts["update_sensors"] >= 1
+    assert replay.notifier.interface.notified == 1
+    assert replay.sensors["status"].state is False
+    # The action and the close refer to the recorded id, their events are fired
+    assert replay.api.posts["/api/events/mobile_app_notification_action"] == 1
+    assert replay.api.posts["/api/events/mobile_app_notification_cleared"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sampler_process():
+    from halinuxcompanion.sampler import CONTROL_SLOT, SamplerProcess, Snapshots, isolated
+
+    companion = setup_companion()
+    companion.sensor_options = {"memory": {}, "cpu": {}, "status": {}}
+    assert isolated(["memory", "cpu", "status"]) == ["memory", "cpu"]
+
+    sampler = SamplerProcess(companion, ["memory", "cpu"])
+    try:
+        # Torn writes are never read: the sequence is odd while a slot is being written
+        snapshots = Snapshots.attach(sampler.snapshots.shm.name)
+        sequence, data = snapshots.read(CONTROL_SLOT)
+        assert sequence == 2 and data is not None
+        snapshots.buffer[0] = 3
+        assert snapshots.read(CONTROL_SLOT)[1] is None
+        snapshots.buffer[0] = 2
+        snapshots.close()
+
+        sensors = await sampler.start()
+        assert [s.unique_id for s in sensors] == ["memory_usage", "cpu_load"]
+        memory = sensors[0]
+        assert memory.config_name == "memory" and memory.unit_of_measurement == "%"
+        assert "system.login_on_prepare_for_sleep" in memory.signals
+        memory.sample()
+        assert 0 < memory.state <= 100 and memory.attributes["total"] > 0
+
+        # The worker samples on the ticks of the main process, and stops sampling while suspended
+        sequence = memory.sequence
+        await sampler.tick()
+        memory.sample()
+        assert memory.sequence > sequence and 0 < memory.state <= 100
+        sampler.suspend(True)
+        await sampler.tick()
+        memory.sample()
+        assert memory.state == "unavailable"
+        sampler.suspend(False)
+        await sampler.tick()
+        memory.sample()
+        assert 0 < memory.state <= 100
+        sampler.process.kill()
+        sampler.process.join()
+        memory.sample()
+        assert memory.state == "unavailable"
+    finally:
+        sampler.stop()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_adaptive_polling():
+    from halinuxcompanion.scheduler import Scheduler
+    from halinuxcompanion.sensor import SensorManager
+
+    manager = SensorManager(ApiStub(), [], None)
+    sched = Scheduler(setup_companion(), manager.api, manager)
+
+    sched.rescale(on_battery=True)
+    assert manager.scale == 4 and not sched.wakeup.is_set()
+    sched.on_screensaver_active_changed(True)
+    assert manager.scale == 10
+
+    # Back to full rate right away
+    sched.on_screensaver_active_changed(False)
+    assert manager.scale == 4 and sched.wakeup.is_set()
+    sched.wakeup.clear()
+    sched.on_upower_properties_changed("org.freedesktop.UPower", {"OnBattery": Variant("b", False)}, [])
+    assert manager.scale == 1 and sched.wakeup.is_set()
+
+
+@pytest.mark.asyncio
+async def test_api_failover(monkeypatch):
+    from aiohttp import ClientError, web
+    from halinuxcompanion import api as api_module
+    from halinuxcompanion.api import API
+
+    async def webhook(request):
+        return web.json_response({})
+
+    async def not_connected(request):
+        return web.Response(status=503)
+
+    app = web.Application()
+    app.router.add_post("/api/webhook/{id}", webhook)
+    app.router.add_post("/cloudhook", not_connected)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    # Local instance unreachable (nothing listens on port 1), remote ui reachable
+    companion = setup_companion()
+    companion.ha_url = "http://127.0.0.1:1"
+    # A session of this test's event loop, closed at the end
+    monkeypatch.setattr(api_module, "SESSION", None)
+    api = API(companion)
+    api.process_registration_data(
+        {"secret": "", "webhook_id": "abc", "remote_ui_url": f"http://127.0.0.1:{port}"}
+    )
+    assert [e.name for e in api.endpoints] == ["local", "remote_ui"]
+    assert api.endpoint().name == "local"
+
+    res = await api.webhook_post("test", "{}")
+    assert res.status == 200
+    local, remote = api.endpoints
+    assert not local.healthy and remote.healthy and remote.latency is not None
+    assert api.endpoint() is remote
+
+    # The probes find the local endpoint back, and it's used once it's the fastest
+    local.url = remote.url
+    assert await api.probe_endpoints(timeout=1)
+    assert local.healthy
+    local.latency, remote.latency = 0.01, 0.1
+    assert api.endpoint() is local
+
+    # A fast error status (e.g. a cloudhook while the instance isn't connected) fails over, and isn't a latency
+    local.latency, remote.latency = 0.1, 0.01
+    remote.url = f"http://127.0.0.1:{port}/cloudhook"
+    res = await api.webhook_post("test", "{}")
+    assert res.status == 200 and not remote.healthy and remote.latency == 0.01
+    assert api.endpoint() is local
+
+    await runner.cleanup()
+    with pytest.raises(ClientError):
+        await api.webhook_post("test", "{}", timeout=1)
+    await api.session.close()
+
+
+class NotificationsStub:
+    """org.freedesktop.Notifications interface that takes a while to answer, and records the calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def call_notify(self, app, replace_id, icon, title, message, actions, hints, timeout):
+        self.calls.append((replace_id, message))
+        id = len(self.calls)
+        await asyncio.sleep(0.01)
+        return id
+
+
+@pytest.mark.asyncio
+async def test_notifier_lanes():
+    notifier = setup_notifier()
+    notifier.interface = NotificationsStub()
+    notifier.ha_url = "http://localhost:8123"
+    notifier.tagtoid = {}
+
+    def notification(message, tag):
+        return notifier.notification_transform({"message": message, "data": {"tag": tag}})
+
+    notifier.dispatch(notification("progress 1", "progress"))
+    await asyncio.sleep(0)
+    # Superseded while the first one is in flight, only the latest reaches dbus
+    notifier.dispatch(notification("progress 2", "progress"))
+    notifier.dispatch(notification("progress 3", "progress"))
+    notifier.dispatch(notification("other", "other"))
+    while notifier.lanes:
+        await asyncio.sleep(0.01)
+
+    calls = notifier.interface.calls
+    assert calls[:2] == [(0, "progress 1"), (0, "other")]
+    # Replaces the first one, its id is known by the time it's sent
+    assert calls[2] == (1, "progress 3")
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_notification_tracing(tmp_path):
+    from halinuxcompanion.tracing import Tracer, summary
+
+    class EventApiStub:
+        status = 200
+
+        async def post(self, endpoint, data):
+            return self
+
+    notifier = setup_notifier()
+    notifier.interface = NotificationsStub()
+    notifier.api = EventApiStub()
+    notifier.ha_url = "http://localhost:8123"
+    notifier.url_program = ""
+    notifier.tagtoid = {}
+    notifier.tracer = Tracer(str(tmp_path / "traces.jsonl"))
+
+    notifier.handle_notification({"message": "progress 1", "data": {"tag": "progress"}})
+    notifier.handle_notification({"message": "progress 2", "data": {"tag": "progress"}})
+    while notifier.lanes:
+        await asyncio.sleep(0.01)
+    await notifier.on_action(1, "default")
+    await notifier.on_close(1, "dismissed")
+    await asyncio.sleep(0.01)
+
+    superseded, closed = notifier.tracer.completed
+    assert [stage for stage, _ in superseded.spans] == ["received", "transformed", "superseded"]
+    assert [stage for stage, _ in closed.spans] == [
+        "received", "transformed", "queued", "notified", "action", "closed", "closed_event"
+    ]
+    with open(tmp_path / "traces.jsonl") as f:
+        traces = [json.loads(line) for line in f]
+    assert traces[1]["id"] == closed.id
+    report = summary(traces)
+    assert "notified" in report and "superseded" in report
+
+
+@pytest.mark.asyncio
+async def test_command_runner():
+    from halinuxcompanion.commands import CommandRunner
+
+    class EventApiStub:
+        def __init__(self):
+            self.events = []
+
+        async def post(self, endpoint, data):
+            self.events.append(json.loads(data))
+
+    api = EventApiStub()
+    runner = CommandRunner(api, max_running=1)
+    start = asyncio.get_running_loop().time()
+    slow = runner.run("slow", ["sleep", "0.2"], dedupe=True)
+    assert runner.run("slow", ["sleep", "0.2"], dedupe=True) is None
+    # Waits for the slot, then it's killed after its timeout
+    killed = runner.run("killed", ["sleep", "5"], timeout=0.1, event=True)
+    await asyncio.gather(slow, killed)
+    assert asyncio.get_running_loop().time() - start < 1
+    assert api.events[0]["command"] == "killed" and api.events[0]["timed_out"]
+    assert api.events[0]["returncode"] == -9
+    assert not runner.running and not runner.tasks
+
+    # Missing programs are logged, not raised
+    missing = runner.run("missing", ["halinuxcompanion-missing-program"], event=True)
+    await missing
+    assert api.events[1]["returncode"] is None
+
+
+@pytest.mark.asyncio
+async def test_notifier_commands():
+    from halinuxcompanion.commands import CommandRunner
+
+    class EventApiStub:
+        def __init__(self):
+            self.events = []
+
+        async def post(self, endpoint, data):
+            self.events.append(json.loads(data))
+
+    notifier = setup_notifier()
+    notifier.runner = CommandRunner(EventApiStub(), max_running=1)
+    notifier.commands = {
+        # No timeout by default, it keeps running and doesn't take the only slot
+        "command_player": CommandConfig(name="Player", command=["sleep", "0.3"], event=True),
+        "command_suspend": CommandConfig(name="Suspend", command=["true"], timeout=5, event=True),
+    }
+    notifier.handle_notification({"message": "command_player"})
+    notifier.handle_notification({"message": "command_player"})
+    notifier.handle_notification({"message": "command_suspend"})
+    await asyncio.gather(*notifier.runner.tasks)
+
+    events = notifier.runner.api.events
+    assert [event["command"] for event in events] == ["command_suspend", "command_player", "command_player"]
+    assert all(event["returncode"] == 0 and not event["timed_out"] for event in events)
+
+
+@pytest.mark.asyncio
+async def test_push_channel(monkeypatch):
+    from aiohttp import web
+    from halinuxcompanion import api as api_module
+    from halinuxcompanion.api import API
+    from halinuxcompanion.push_channel import PushChannel
+
+    confirmed = []
+
+    async def websocket(request):
+        """Home Assistant websocket api, sends one notification and waits for its confirmation"""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"type": "auth_required"})
+        assert (await ws.receive_json())["access_token"] == "token"
+        await ws.send_json({"type": "auth_ok"})
+        subscribe = await ws.receive_json()
+        assert subscribe["type"] == "mobile_app/push_notification_channel" and subscribe["webhook_id"] == "abc"
+        await ws.send_json({"id": subscribe["id"], "type": "result", "success": True})
+        event = {"message": "hello", "data": {"tag": "greeting"}, "hass_confirm_id": "c1"}
+        await ws.send_json({"id": subscribe["id"], "type": "event", "event": event})
+        confirmed.append(await ws.receive_json())
+        await ws.close()
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/api/websocket", websocket)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    companion = setup_companion()
+    companion.ha_url, companion.ha_token = f"http://127.0.0.1:{port}", "token"
+    monkeypatch.setattr(api_module, "SESSION", None)
+    api = API(companion)
+    api.process_registration_data({"secret": "", "webhook_id": "abc"})
+    received = []
+    channel = PushChannel(api, received.append)
+    await channel.listen()
+
+    assert received == [{"message": "hello", "data": {"tag": "greeting"}}]
+    assert confirmed[0]["type"] == "mobile_app/push_notification_confirm" and confirmed[0]["confirm_id"] == "c1"
+    assert channel.subscribed
+    await api.session.close()
+    await runner.cleanup()
+
+    # The registration advertises the channel instead of the push_url
+    config = get_config()
+    config["services"]["notifications"]["websocket"] = True
+    companion = Companion(config)
+    assert companion.app_data["push_websocket_channel"] and "push_url" not in companion.app_data
+
+
+@pytest.mark.asyncio
+async def test_systemd_units():
+    """The failed units and the watched units follow the systemd signals, the match rule handler routes them"""
+    from dbus_next import Message, MessageType
+    from halinuxcompanion.dbus import SIGNALS, match_handler
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors.systemd import UNIT_INTERFACE, Systemd, unit_name
+
+    systemd, backup = Systemd.create({"units": ["backup.timer"]})
+    manager = SensorManager(None, [systemd, backup], None)
+    systemd.load([
+        ("backup.timer", "", "loaded", "active", "waiting", "", "/", 0, "", "/"),
+        ("nginx.service", "", "loaded", "failed", "failed", "", "/", 0, "", "/"),
+    ])
+    assert systemd.state == 1 and systemd.attributes["failed"] == ["nginx.service"]
+    assert (backup.state, backup.attributes["sub_state"]) == ("active", "waiting")
+
+    # A unit starting doesn't change the failed units, the sensor isn't pushed
+    path = "/org/freedesktop/systemd1/unit/sshd_2eservice"
+    assert unit_name(path) == "sshd.service"
+    changed = {"ActiveState": Variant("s", "activating"), "SubState": Variant("s", "start")}
+    alias = "system.systemd_units_on_properties_changed"
+    await manager._signal_handler(systemd, alias, "on_properties_changed", path, UNIT_INTERFACE, changed, [])
+    assert systemd.unique_id not in manager.outbox
+    args = (path, UNIT_INTERFACE, {"ActiveState": Variant("s", "failed")}, [])
+    await manager._signal_handler(systemd, alias, "on_properties_changed", *args)
+    assert systemd.state == 2 and manager.outbox[systemd.unique_id][1]["state"] == 2
+    # Counted in the summary instead of a log line each
+    assert manager.summary.counts["signals"] == 2
+
+    # The watched unit is pushed on its own
+    await systemd.on_properties_changed(
+        "/org/freedesktop/systemd1/unit/backup_2etimer", UNIT_INTERFACE, {"ActiveState": Variant("s", "inactive")}, []
+    )
+    await systemd.on_job_removed(1, "/org/freedesktop/systemd1/job/1", "backup.timer", "done")
+    assert manager.outbox[backup.unique_id][1]["state"] == "inactive"
+    assert manager.outbox[backup.unique_id][1]["attributes"]["result"] == "done"
+    assert await systemd.on_unit_removed("nginx.service", "/") and systemd.state == 1
+
+    # Signals from the unit objects reach the callback with their path, other senders are ignored
+    received = []
+    owners = {"org.freedesktop.systemd1": ":1.2"}
+    handler = match_handler(SIGNALS[alias], owners, lambda *a: received.append(a))
+    body = [UNIT_INTERFACE, {"ActiveState": Variant("s", "active")}, []]
+    signal = {"interface": "org.freedesktop.DBus.Properties", "member": "PropertiesChanged", "signature": "sa{sv}as"}
+    handler(Message(message_type=MessageType.SIGNAL, sender=":1.2", path=path, body=body, **signal))
+    handler(Message(message_type=MessageType.SIGNAL, sender=":1.9", path=path, body=body, **signal))
+    manager_path = "/org/freedesktop/systemd1"
+    handler(Message(message_type=MessageType.SIGNAL, sender=":1.2", path=manager_path, body=body, **signal))
+    assert received == [(path, *body)]
+    # The new owner once the service restarted
+    owners["org.freedesktop.systemd1"] = ":1.9"
+    handler(Message(message_type=MessageType.SIGNAL, sender=":1.9", path=path, body=body, **signal))
+    assert len(received) == 2
+
+
+@pytest.mark.asyncio
+async def test_dbus_properties():
+    """Configured dbus properties and the UPower battery are read once, then sent only when a signal changes them"""
+    from halinuxcompanion.dbus import SIGNALS, UPOWER_DISPLAY_DEVICE, match_rule
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors.battery_level import BatteryLevel
+    from halinuxcompanion.sensors.battery_state import BatteryState
+    from halinuxcompanion.sensors.dbus_property import DbusProperty
+
+    class DbusStub:
+        def __init__(self, properties):
+            self.properties = properties
+
+        async def get_properties(self, bus, service, path, interface):
+            return self.properties.get((service, path, interface))
+
+    config = {
+        "unique_id": "connectivity",
+        "service": "org.freedesktop.NetworkManager",
+        "path": "/org/freedesktop/NetworkManager",
+        "interface": "org.freedesktop.NetworkManager",
+        "property": "Connectivity",
+        "values": {"1": "none", "4": "full"},
+    }
+    (connectivity,) = DbusProperty.create({"properties": [config, {"unique_id": "incomplete"}]})
+    level, state = BatteryLevel.create({})[0], BatteryState.create({})[0]
+    alias = next(iter(connectivity.signals))
+    assert "arg0='org.freedesktop.NetworkManager'" in match_rule(SIGNALS[alias])
+
+    display = UPOWER_DISPLAY_DEVICE[1:]
+    dbus = DbusStub({
+        tuple(config[k] for k in ("service", "path", "interface")): {"Connectivity": 4, "State": 70},
+        display: {"IsPresent": True, "Percentage": 57.4, "TimeToEmpty": 3725, "State": 2},
+    })
+    manager = SensorManager(None, [connectivity, level, state], dbus)
+    for sensor in (connectivity, level, state):
+        await sensor.read_properties()
+    assert manager.outbox["connectivity"][1]["state"] == "full"
+    assert (level.state, level.attributes["time_left"], state.state) == (57, "1:02:05", "discharging")
+    manager.outbox.clear()
+    # The periodic updates don't send them
+    manager.collect()
+    assert not manager.outbox
+
+    # A sensor is sent only when a change signal changes its value
+    interface = "org.freedesktop.NetworkManager"
+    handler = "on_properties_changed"
+    await manager._signal_handler(connectivity, alias, handler, interface, {"Version": Variant("s", "1.2")}, [])
+    await manager._signal_handler(connectivity, alias, handler, interface, {"Connectivity": Variant("u", 4)}, [])
+    assert not manager.outbox
+    await manager._signal_handler(connectivity, alias, handler, interface, {"Connectivity": Variant("u", 1)}, [])
+    assert manager.outbox["connectivity"][1]["state"] == "none"
+    changed = {"Percentage": Variant("d", 57.2), "State": Variant("u", 1)}
+    await manager._signal_handler(level, alias, handler, display[2], changed, [])
+    await manager._signal_handler(state, alias, handler, display[2], changed, [])
+    assert "battery_level" not in manager.outbox and manager.outbox["battery_state"][1]["state"] == "charging"
+
+    # Without UPower the battery is polled with psutil
+    battery = BatteryLevel.create({})[0]
+    manager = SensorManager(None, [battery], DbusStub({}))
+    await battery.read_properties()
+    assert not battery.connected
+    manager.collect()
+    assert "battery_level" in manager.outbox
+
+    # The service goes away and comes back (e.g. restarted), the properties are read again
+    manager = SensorManager(None, [connectivity], dbus)
+    owner_alias, handler = list(connectivity.signals.items())[1]
+    await manager._signal_handler(connectivity, owner_alias, handler, config["service"], ":1.5", "")
+    assert not connectivity.connected and manager.outbox["connectivity"][1]["state"] == "unavailable"
+    manager.collect()
+    assert "connectivity" in manager.outbox
+    manager.outbox.clear()
+    await manager._signal_handler(connectivity, owner_alias, handler, config["service"], "", ":1.7")
+    assert connectivity.connected and manager.outbox["connectivity"][1]["state"] == "full"
+
+
+@pytest.mark.asyncio
+async def test_dbus_owner():
+    """The owner of the services sending match rule signals is followed, they can start after the companion"""
+    from dbus_next import Message, MessageType
+    from halinuxcompanion.dbus import BUS_PATH, BUS_SERVICE, Dbus, properties_signal
+
+    class BusStub:
+        def __init__(self):
+            self.handlers = []
+            self.rules = []
+
+        async def call(self, msg):
+            if msg.member == "GetNameOwner":
+                error = "org.freedesktop.DBus.Error.NameHasNoOwner"
+                return Message(message_type=MessageType.ERROR, error_name=error, reply_serial=1)
+            self.rules.append(msg.body[0])
+            return Message(message_type=MessageType.METHOD_RETURN, reply_serial=1)
+
+        def add_message_handler(self, handler):
+            self.handlers.append(handler)
+
+        def emit(self, sender, path, interface, member, signature, body):
+            msg = Message(
+                message_type=MessageType.SIGNAL, sender=sender, path=path, interface=interface, member=member,
+                signature=signature, body=body,
+            )
+            for handler in self.handlers:
+                handler(msg)
+
+    dbus = Dbus()
+    dbus.system = BusStub()
+    dbus.owners = {"system": {BUS_SERVICE: BUS_SERVICE}}
+    alias = properties_signal("system", "org.example.Service", "/org/example", "org.example.Object")
+    received = []
+    assert await dbus.register_match(alias, lambda *a: received.append(a))
+    assert dbus.owners["system"]["org.example.Service"] == ""
+
+    changed = ("sa{sv}as", ["org.example.Object", {}, []])
+    dbus.system.emit(":1.3", "/org/example", "org.freedesktop.DBus.Properties", "PropertiesChanged", *changed)
+    owner_changed = ("sss", ["org.example.Service", "", ":1.4"])
+    dbus.system.emit(BUS_SERVICE, BUS_PATH, BUS_SERVICE, "NameOwnerChanged", *owner_changed)
+    dbus.system.emit(":1.4", "/org/example", "org.freedesktop.DBus.Properties", "PropertiesChanged", *changed)
+    assert received == [tuple(changed[1])]
+    dbus.matches.clear()
+
+
+@pytest.mark.asyncio
+async def test_microphone(tmp_path, monkeypatch):
+    """Capture substreams are found again when the cards change, a running one makes the microphone active"""
+    from halinuxcompanion.sensor import SensorManager
+    from halinuxcompanion.sensors import microphone
+
+    def add_card(number, id):
+        status = tmp_path / f"card{number}" / "pcm0c" / "sub0" / "status"
+        status.parent.mkdir(parents=True)
+        status.write_text("closed\n")
+        (tmp_path / f"card{number}" / "id").write_text(id + "\n")
+        with open(tmp_path / "cards", "a") as f:
+            f.write(f" {number} [{id}]: card\n")
+        return status
+
+    pch = add_card(0, "PCH")
+    monkeypatch.setattr(microphone, "ASOUND", str(tmp_path))
+    sensor = microphone.Microphone()
+    manager = SensorManager(None, [sensor], None)
+    sensor.sample()
+    assert (sensor.state, len(sensor.streams)) == ("idle", 1)
+    assert not sensor.check()
+
+    pch.write_text("state: RUNNING\nowner_pid   : 1234\n")
+    headset = add_card(1, "Headset")
+    assert sensor.check() and sensor.state == "active" and sensor.attributes["devices"] == ["PCH/pcm0c"]
+    headset.write_text("state: RUNNING\n")
+    pch.write_text("closed\n")
+    assert sensor.check() and sensor.attributes["devices"] == ["Headset/pcm0c"]
+    # An empty read doesn't keep the state of the previous one
+    headset.write_text("")
+    assert sensor.check() and sensor.state == "idle"
+    headset.write_text("state: RUNNING\n")
+    assert sensor.check() and sensor.state == "active"
+
+    # The watch task pushes the change without waiting for the next update
+    monkeypatch.setattr(microphone, "CHECK_INTERVAL", 0)
+    task = asyncio.create_task(sensor.watch())
+    headset.write_text("closed\n")
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert manager.outbox["microphone_state"][1]["state"] == "idle"
+    sensor.stop()
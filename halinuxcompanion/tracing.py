@@ -0,0 +1,105 @@
+"""Latency tracing of the notification lifecycle.
+Every notification gets a trace when it arrives, each stage it goes through (transformed, sent to dbus, action invoked,
+event sent to Home Assistant, ...) is recorded as a span with the milliseconds since the arrival. Completed traces are
+kept in a ring buffer and, when a trace file is configured, appended to it as JSON Lines.
+
+The latency percentiles of each stage are printed with:
+    python -m halinuxcompanion.tracing traces.jsonl
+"""
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+import argparse
+import json
+import logging
+import math
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Completed traces kept in memory
+RING_SIZE = 200
+PERCENTILES = (50, 90, 99)
+
+
+class Trace:
+    """The spans of a notification, a span is (stage, milliseconds since the trace started)"""
+
+    def __init__(self) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.start = time.monotonic()
+        self.wall = time.time()
+        self.spans: List[Tuple[str, float]] = [("received", 0.0)]
+        self.done = False
+
+    def span(self, stage: str) -> None:
+        self.spans.append((stage, round((time.monotonic() - self.start) * 1000, 3)))
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "start": self.wall, "spans": self.spans}
+
+    def __repr__(self) -> str:
+        return f"Trace({self.id})"
+
+
+class Tracer:
+    """Creates the traces and stores them once completed"""
+
+    def __init__(self, path: Optional[str] = None, size: int = RING_SIZE) -> None:
+        self.path = path
+        self.completed: Deque[Trace] = deque(maxlen=size)
+
+    def start(self) -> Trace:
+        return Trace()
+
+    def finish(self, trace: Trace, stage: str) -> None:
+        """Record the last span of a trace and store it, a trace is only finished once"""
+        if trace.done:
+            return
+        trace.span(stage)
+        trace.done = True
+        self.completed.append(trace)
+        logger.debug("Notification trace:%s completed spans:%s", trace.id, trace.spans)
+        if self.path:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(trace.to_dict()) + "\n")
+            except OSError as e:
+                logger.error("Could not write the notification trace to %s: %s", self.path, e)
+
+
+def stage_latencies(traces: Iterable[dict]) -> Dict[str, List[float]]:
+    """Milliseconds each stage took (since the previous span of the trace), by stage"""
+    latencies: Dict[str, List[float]] = {}
+    for trace in traces:
+        previous = 0.0
+        for stage, elapsed in trace["spans"][1:]:
+            latencies.setdefault(stage, []).append(elapsed - previous)
+            previous = elapsed
+    return latencies
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summary(traces: Iterable[dict]) -> str:
+    lines = [f"{'stage':<16}{'count':>7}" + "".join(f"{f'p{p}':>10}" for p in PERCENTILES) + f"{'max':>10}"]
+    for stage, values in stage_latencies(traces).items():
+        values.sort()
+        columns = [percentile(values, p) for p in PERCENTILES] + [values[-1]]
+        lines.append(f"{stage:<16}{len(values):>7}" + "".join(f"{v:>10.1f}" for v in columns))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latency percentiles (milliseconds) of the notification stages")
+    parser.add_argument("file", help="JSON Lines file of notification traces (services.notifications.trace_file)")
+    args = parser.parse_args()
+    with open(args.file) as f:
+        print(summary(json.loads(line) for line in f if line.strip()))
+
+
+if __name__ == "__main__":
+    main()